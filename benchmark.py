@@ -0,0 +1,332 @@
+import os
+import sys
+import json
+import glob
+import time
+import resource
+import argparse
+import threading
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import constant as c
+from spp import Dijkstra
+from tsp import CHI, HeldKarp, TwoOpt
+
+BASE_OSMID = 1_000_000_000      # 合成ネットワークの頂点の osmid の始まり
+ORIGIN = (34.90, 135.16)        # 合成ネットワークを置く南西の端の緯度経度
+METERS_PER_DEG_LAT = 111_320.0
+SPACING = 100.0                 # 格子の間隔及びランダム幾何グラフの平均的な頂点間隔 [m]
+MAXSPEEDS = np.array([30.0, 40.0, 50.0, 60.0])
+
+def _to_latlon(x_m: np.ndarray, y_m: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ 南西の端からの距離 [m] を緯度経度に変換 """
+    lat = ORIGIN[0] + y_m / METERS_PER_DEG_LAT
+    lon = ORIGIN[1] + x_m / (METERS_PER_DEG_LAT * np.cos(np.radians(ORIGIN[0])))
+    return lat, lon
+
+def _write_network(path_prefix: str, x_m: np.ndarray, y_m: np.ndarray, u: np.ndarray, v: np.ndarray,
+                   oneway: np.ndarray, rng: np.random.Generator, signal_rate: float = 0.1) -> tuple[str, str]:
+    """ 頂点の座標と辺の端点から、extract_road_csv が読む形式の頂点・辺の csv ファイルを出力 \n
+    双方向の辺は osmnx と同じく逆向きの行も reversed=True として出力し、最高速度は一部を欠損値やリスト文字列とする。
+    Returns:
+        node_csv (str): 頂点の csv ファイルの path
+        edge_csv (str): 辺の csv ファイルの path
+    """
+    n, m = len(x_m), len(u)
+    lat, lon = _to_latlon(x_m, y_m)
+    highway = np.where(rng.random(n) < signal_rate, 'traffic_signals', '')
+    nodes = pd.DataFrame({'osmid': BASE_OSMID + np.arange(n), 'y': lat.round(7), 'x': lon.round(7),
+                          'street_count': np.bincount(np.concatenate((u, v)), minlength=n), 'highway': highway})
+    length = np.hypot(x_m[u] - x_m[v], y_m[u] - y_m[v]) * rng.uniform(1.0, 1.2, m)
+    maxspeed = MAXSPEEDS[rng.integers(len(MAXSPEEDS), size=m)].astype(object)
+    draw = rng.random(m)
+    maxspeed[draw < 0.1] = np.nan
+    maxspeed[(draw >= 0.1) & (draw < 0.15)] = "['40', '60']"
+    forward = pd.DataFrame({'u': BASE_OSMID + u, 'v': BASE_OSMID + v, 'key': 0, 'osmid': np.arange(m), 'oneway': oneway,
+                            'reversed': False, 'length': length.round(3), 'maxspeed': maxspeed})
+    backward = forward[~oneway].rename(columns={'u': 'v', 'v': 'u'}).assign(reversed=True)
+    edges = pd.concat([forward, backward], ignore_index=True)[['u', 'v', 'key', 'osmid', 'oneway', 'reversed', 'length', 'maxspeed']]
+    node_csv, edge_csv = f'{path_prefix}_node.csv', f'{path_prefix}_edge.csv'
+    nodes.to_csv(node_csv, index=False)
+    edges.to_csv(edge_csv, index=False)
+    return node_csv, edge_csv
+
+def make_grid_network(n: int, path_prefix: str, seed: int = 0) -> tuple[str, str]:
+    """ 約 n 頂点の格子状の道路ネットワークを生成 \n
+    東西方向の道路は 1 本おきに東向きと西向きの一方通行を交互に置き、南北方向の道路は双方向として強連結を保つ。
+    Args:
+        n (int): 頂点数の目安
+        path_prefix (str): 出力する csv ファイルの path の接頭辞
+        seed (int, optional): 乱数の種
+    Returns:
+        node_csv (str): 頂点の csv ファイルの path
+        edge_csv (str): 辺の csv ファイルの path
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    row, col = np.divmod(np.arange(side * side), side)
+    h = np.flatnonzero(col < side - 1)
+    vt = np.flatnonzero(row < side - 1)
+    east, west = row[h] % 4 == 1, row[h] % 4 == 3
+    u = np.concatenate((np.where(west, h + 1, h), vt))
+    v = np.concatenate((np.where(west, h, h + 1), vt + side))
+    oneway = np.concatenate((east | west, np.zeros(len(vt), dtype=bool)))
+    return _write_network(path_prefix, col * SPACING, row * SPACING, u, v, oneway, rng)
+
+def make_geometric_network(n: int, path_prefix: str, seed: int = 0, degree: float = 6.0, oneway_rate: float = 0.15) -> tuple[str, str]:
+    """ n 頂点のランダム幾何グラフの道路ネットワークを生成 \n
+    正方形の中に一様に置いた頂点のうち、平均次数が degree となる距離以内の組を辺で結ぶ。
+    連結性を保つため、帯状に蛇行する順に隣り合う頂点を双方向の辺で結び、それ以外の辺の一部を一方通行とする。
+    Args:
+        n (int): 頂点数
+        path_prefix (str): 出力する csv ファイルの path の接頭辞
+        seed (int, optional): 乱数の種
+        degree (float, optional): 平均次数の目安
+        oneway_rate (float, optional): 一方通行とする辺の割合
+    Returns:
+        node_csv (str): 頂点の csv ファイルの path
+        edge_csv (str): 辺の csv ファイルの path
+    """
+    rng = np.random.default_rng(seed)
+    width = SPACING * np.sqrt(n)
+    x, y = rng.uniform(0, width, n), rng.uniform(0, width, n)
+    r = width * np.sqrt(degree / (np.pi * n))
+    band = np.floor(y / r).astype(np.int64)
+
+    # 同じ帯と 1 つ下の帯の頂点を x 座標順に並べ、近い順にずらして距離 r 以内の組を探す
+    ids = np.concatenate((np.arange(n), np.arange(n)))
+    key = np.concatenate((band, band - 1))
+    order = np.lexsort((np.concatenate((x, x)), key))
+    ids, key = ids[order], key[order]
+    pairs = []
+    for shift in range(1, len(ids)):
+        a, b = ids[:-shift], ids[shift:]
+        same = key[:-shift] == key[shift:]
+        close = same & (np.abs(x[a] - x[b]) <= r)
+        if not close.any():
+            break
+        close &= (a != b) & (np.hypot(x[a] - x[b], y[a] - y[b]) <= r)
+        pairs.append(np.stack((a[close], b[close]), axis=1))
+    pairs = np.unique(np.sort(np.concatenate(pairs), axis=1), axis=0) if pairs else np.empty((0, 2), dtype=np.int64)
+
+    # 帯ごとに向きを変えて蛇行する経路を背骨とする
+    snake = np.lexsort((np.where(band % 2 == 0, x, -x), band))
+    backbone = np.sort(np.stack((snake[:-1], snake[1:]), axis=1), axis=1)
+    all_pairs = np.unique(np.concatenate((pairs, backbone)), axis=0)
+    is_backbone = np.zeros(len(all_pairs), dtype=bool)
+    is_backbone[np.searchsorted(all_pairs[:, 0] * n + all_pairs[:, 1], backbone[:, 0] * n + backbone[:, 1])] = True
+    u, v = all_pairs[:, 0].copy(), all_pairs[:, 1].copy()
+    oneway = ~is_backbone & (rng.random(len(u)) < oneway_rate)
+    flip = rng.random(len(u)) < 0.5
+    u[flip], v[flip] = v[flip], u[flip].copy()
+    return _write_network(path_prefix, x, y, u, v, oneway, rng)
+
+GENERATORS = {'grid': make_grid_network, 'geometric': make_geometric_network}
+
+def ensure_network(kind: str, n: int, work_dir: str, seed: int = 0) -> tuple[str, str]:
+    """ 合成ネットワークの csv ファイルが無ければ生成し、その path を返す """
+    os.makedirs(work_dir, exist_ok=True)
+    prefix = os.path.join(work_dir, f'{kind}_{n}_{seed}')
+    if not (os.path.exists(f'{prefix}_node.csv') and os.path.exists(f'{prefix}_edge.csv')):
+        return GENERATORS[kind](n, prefix, seed)
+    return f'{prefix}_node.csv', f'{prefix}_edge.csv'
+
+PAGE_MB = os.sysconf('SC_PAGE_SIZE') / (1 << 20) if hasattr(os, 'sysconf') else 0.0
+
+def _max_rss_mb() -> float:
+    """ プロセスと終了した子プロセスの最大常駐メモリ [MB] を返す (Linux は KB 単位、macOS は byte 単位) \n
+    起動してからの最大値のため段階ごとの値にはならず、/proc の無い環境でのみ用いる。
+    """
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+def _process_rss_mb(pid: int) -> float:
+    """ プロセス pid の現在の常駐メモリ [MB] を返す \n
+    fork したワーカープロセスと共有するページを重複して数えないよう、smaps_rollup があれば共有するプロセス数で按分した Pss を用いる。
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * PAGE_MB
+
+def _tree_rss_mb(pid: int) -> float:
+    """ プロセス pid とその子孫のプロセス (距離行列のワーカープロセスなど) の現在の常駐メモリの合計 [MB] を /proc から求める """
+    total = 0.0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            total += _process_rss_mb(p)
+            for children in glob.glob(f'/proc/{p}/task/*/children'):
+                with open(children) as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            # 計測中に終了したプロセス
+            continue
+    return total
+
+class _RssSampler(threading.Thread):
+    """ 段階の間、プロセスとその子孫の常駐メモリの合計を一定間隔で読み、最大値を記録するスレッド \n
+    間隔より短い間だけ確保されたメモリは取りこぼすことがある。
+    """
+    def __init__(self, interval: float = 0.01) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.pid = os.getpid()
+        self.start_mb = self.peak_mb = _tree_rss_mb(self.pid)
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _tree_rss_mb(self.pid))
+
+    def stop(self) -> float:
+        """ 読み取りを止め、段階の間の最大値 [MB] を返す """
+        self._done.set()
+        self.join()
+        self.peak_mb = max(self.peak_mb, _tree_rss_mb(self.pid))
+        return self.peak_mb
+
+class _Stage:
+    """ 計測する段階の経過時間と最大メモリ使用量を記録するコンテキストマネージャ \n
+    /proc のある環境では段階の間のプロセスとワーカープロセスの常駐メモリの合計の最大値 'peak_rss_mb' と、
+    段階の開始時からの増加量 'rss_delta_mb' を記録する。/proc の無い環境では起動してからの最大常駐メモリのみを記録する。
+    """
+    def __init__(self, records: list[dict], base: dict, stage: str, trace: bool) -> None:
+        self.record = dict(base, stage=stage)
+        self.trace = trace
+        records.append(self.record)
+
+    def __enter__(self) -> dict:
+        if self.trace:
+            tracemalloc.start()
+        self.sampler = _RssSampler() if os.path.exists(f'/proc/{os.getpid()}/statm') else None
+        if self.sampler is not None:
+            self.sampler.start()
+        self.start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc) -> None:
+        self.record['seconds'] = round(time.perf_counter() - self.start, 6)
+        if self.sampler is not None:
+            peak = self.sampler.stop()
+            self.record['peak_rss_mb'] = round(peak, 1)
+            self.record['rss_delta_mb'] = round(peak - self.sampler.start_mb, 1)
+        else:
+            self.record['peak_rss_mb'] = round(_max_rss_mb(), 1)
+        if self.trace:
+            self.record['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / (1 << 20), 1)
+            tracemalloc.stop()
+
+def run_case(kind: str, n: int, stops: list[int], core: str = 'csr', work_dir: str = 'bench', seed: int = 0,
+             workers: int = None, dijkstra_runs: int = 3, trace: bool = False,
+             neighborhoods: tuple[str, ...] = ('2opt', 'oropt', 'or3'), exact_threshold: int = 16,
+             matrix_cache: str = None) -> list[dict]:
+    """ 1 つのネットワークについて、読み込み、ダイクストラ法、距離行列、最近挿入法、巡回路の改善の各段階を計測 \n
+    距離行列と巡回路の改善は TwoOpt.from_network と TwoOpt.solve を通して計測し、頂点数に応じた Held-Karp 法への切り替えや
+    距離行列のキャッシュを含める。'dist_matrix' 段階は TwoOpt.from_network 全体の時間で、近傍リストと最近挿入法による初期巡回路
+    ('chi' 段階で同じ距離行列から改めて計測する) の時間も含む。頂点数が 12 以下ならば計測の外で Held-Karp 法の厳密解を求め、
+    巡回路のコストとの差を 'gap' に記録する。
+    Args:
+        kind (str): 'grid' もしくは 'geometric'
+        n (int): 頂点数
+        stops (list[int]): 巡回路の頂点数のリスト、頂点数を超えるものは頂点数に切り詰める
+        core (str, optional): グラフの保持形式、Network を参照
+        work_dir (str, optional): 合成ネットワークの csv ファイルを置くディレクトリ
+        seed (int, optional): 乱数の種
+        workers (int, optional): 距離行列の計算に用いるプロセス数
+        dijkstra_runs (int, optional): 全頂点へのダイクストラ法を計測する始点の数
+        trace (bool, optional): 真ならば tracemalloc で各段階の Python のメモリ使用量の最大値も計測 (遅くなる)
+        neighborhoods (tuple[str, ...], optional): 局所探索に用いる近傍、TwoOpt.solve を参照
+        exact_threshold (int, optional): 頂点数がこれ未満ならば TwoOpt.solve が Held-Karp 法を用いる
+        matrix_cache (str, optional): 距離行列のキャッシュを保存するディレクトリの path、省略時はキャッシュしない
+    Returns:
+        records (list[dict]): 段階ごとの 'network', 'nodes', 'edges', 'core', 'stops', 'stage', 'seconds', 'peak_rss_mb' などの計測結果
+    """
+    node_csv, edge_csv = ensure_network(kind, n, work_dir, seed)
+    records: list[dict] = []
+    base = {'network': kind, 'nodes': n, 'core': core}
+    with _Stage(records, base, 'load', trace) as record:
+        N = Dijkstra(node_csv, edge_csv, core, cache_entries=1)
+    osmids = N.node_arrays()[0]
+    base['nodes'] = record['nodes'] = len(osmids)
+    base['edges'] = N.graph.m if N.graph is not None else sum(len(adj) for adj in N.edges.values())
+    record['edges'] = base['edges']
+    rng = np.random.default_rng(seed)
+
+    with _Stage(records, base, 'dijkstra', trace) as record:
+        for s in rng.choice(osmids, size=dijkstra_runs):
+            N.solve(int(s))
+        record['runs'] = dijkstra_runs
+
+    for k in sorted({min(k, len(osmids)) for k in stops}):
+        V = rng.choice(osmids, size=k, replace=False).tolist()
+        case = dict(base, stops=k)
+        with _Stage(records, case, 'dist_matrix', trace) as record:
+            T = TwoOpt.from_network(N, V, workers, exact_threshold=exact_threshold, matrix_cache=matrix_cache)
+            record['unreachable_pairs'] = int(np.isinf(T.dist_matrix).sum())
+        dist_matrix = T.dist_matrix
+        with _Stage(records, case, 'chi', trace) as record:
+            CHI(dist_matrix).solve()
+            chi_cost = float(T.min_cost)
+            record['cost'] = chi_cost
+        with _Stage(records, case, 'solve', trace) as record:
+            method = 'held_karp' if 3 <= T.n < T.exact_threshold else 'local_search'
+            T.solve(neighborhoods)
+            cost = float(T.min_cost)
+            record['method'] = method
+            record['cost'] = cost
+            record['improvement'] = (chi_cost - cost) / chi_cost if chi_cost > 0 else 0.0
+            if method == 'local_search':
+                record['neighborhoods'] = ','.join(neighborhoods)
+        if 3 <= k <= 12:
+            # 頂点数が少なければ厳密解との差で巡回路の質を評価 (計測の外で求める参照解)
+            optimum = HeldKarp(dist_matrix).solve()
+            optimal_cost = float(sum(dist_matrix[a, b] for a, b in zip(optimum, optimum[1:])))
+            record['optimal_cost'] = optimal_cost
+            record['gap'] = (cost - optimal_cost) / optimal_cost if optimal_cost > 0 else 0.0
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='合成道路ネットワークで各段階の実行時間、メモリ使用量、巡回路の質を計測し JSON Lines で出力')
+    parser.add_argument('--networks', nargs='+', default=['grid', 'geometric'], choices=sorted(GENERATORS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1_000, 10_000], help='頂点数 (例: 1000 10000 100000 1000000)')
+    parser.add_argument('--stops', nargs='+', type=int, default=[10, 100], help='巡回路の頂点数 (例: 10 100 1000 5000)')
+    parser.add_argument('--core', default='csr', choices=('dict', 'csr', 'snapshot'))
+    parser.add_argument('--work-dir', default='bench')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace', action='store_true', help='tracemalloc で段階ごとのメモリ使用量も計測')
+    parser.add_argument('--neighborhoods', nargs='+', default=['2opt', 'oropt', 'or3'],
+                        help="局所探索に用いる近傍 (2-opt だけと比べる場合は '2opt' のみ)")
+    parser.add_argument('--exact-threshold', type=int, default=16,
+                        help='巡回路の頂点数がこれ未満ならば Held-Karp 法を用いる (0 ならば常に局所探索)')
+    parser.add_argument('--matrix-cache', default=None, help='距離行列のキャッシュを保存するディレクトリ')
+    parser.add_argument('--out', default=None, help='出力先の .jsonl ファイル、省略時は標準出力')
+    args = parser.parse_args()
+
+    out = open(args.out, 'a', encoding='utf-8') if args.out else sys.stdout
+    # 前のネットワークのメモリを持ち越さないよう、ネットワークごとに新しいプロセスで計測
+    context = multiprocessing.get_context('spawn')
+    for kind in args.networks:
+        for n in args.sizes:
+            kwargs = {'kind': kind, 'n': n, 'stops': args.stops, 'core': args.core, 'work_dir': args.work_dir,
+                      'seed': args.seed, 'workers': args.workers, 'trace': args.trace,
+                      'neighborhoods': tuple(args.neighborhoods), 'exact_threshold': args.exact_threshold,
+                      'matrix_cache': args.matrix_cache}
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                records = executor.submit(run_case, **kwargs).result()
+            for record in records:
+                out.write(json.dumps(record) + '\n')
+            out.flush()
+    if args.out:
+        out.close()
+        print(c.FontColor.YELLOW + 'Program ran successfully' + c.FontColor.END)
@@ -0,0 +1,227 @@
+import os
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dist_matrix import build_dist_matrix
+from local_search import LocalSearch
+from spp import Dijkstra
+from tsp import CHI, HeldKarp
+
+_network: Dijkstra | None = None   # ワーカープロセスが fork で引き継ぐ読み込み済みの道路ネットワーク
+MIN_CLUSTER_SIZE = 50              # これより小さいクラスタでは境界の割合が大きく、巡回路のコストが 1 割前後増える
+
+def _init_worker(network: Dijkstra) -> None:
+    """ ワーカープロセスで共有する道路ネットワークを設定 """
+    global _network
+    _network = network
+
+def stop_coordinates(N, V: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    """ 頂点の座標を、緯度に応じて経度方向を縮めた平面の座標で返す \n
+    Args:
+        N (Network): 道路ネットワーク
+        V (list[int]): 頂点の osmid のリスト
+    Returns:
+        px (np.ndarray): 経度方向の座標 [度]
+        py (np.ndarray): 緯度方向の座標 [度]
+    """
+    if N.graph is not None:
+        i = N.graph.index.lookup(V)
+        x, y = np.asarray(N.graph.x)[i], np.asarray(N.graph.y)[i]
+    else:
+        x = np.array([N.nodes[v]['x'] for v in V], dtype=np.float64)
+        y = np.array([N.nodes[v]['y'] for v in V], dtype=np.float64)
+    return x * np.cos(np.radians(y.mean())), y
+
+def cluster_stops(px: np.ndarray, py: np.ndarray, cluster_size: int) -> np.ndarray:
+    """ 頂点を、広がりの大きい方向の中央値で 2 分割することを繰り返して地理的なクラスタに分ける \n
+    Args:
+        px (np.ndarray): 頂点の x 座標
+        py (np.ndarray): 頂点の y 座標
+        cluster_size (int): 1 つのクラスタの頂点数の上限
+    Returns:
+        labels (np.ndarray): 各頂点のクラスタの番号
+    """
+    labels = np.zeros(len(px), dtype=np.int64)
+    stack = [np.arange(len(px))]
+    k = 0
+    while stack:
+        members = stack.pop()
+        if len(members) <= cluster_size:
+            labels[members] = k
+            k += 1
+            continue
+        coord = px[members] if np.ptp(px[members]) >= np.ptp(py[members]) else py[members]
+        order = members[np.argsort(coord, kind='stable')]
+        half = len(order) // 2
+        stack.extend((order[half:], order[:half]))
+    return labels
+
+def _order_clusters(cx: np.ndarray, cy: np.ndarray, exact_threshold: int) -> list[int]:
+    """ クラスタの重心間の直線距離で巡回路を求め、クラスタを巡る順序とする """
+    if len(cx) <= 3:
+        return list(range(len(cx)))
+    d = np.hypot(cx[:, None] - cx[None, :], cy[:, None] - cy[None, :])
+    if len(cx) < exact_threshold:
+        return HeldKarp(d).solve()[:-1]
+    return LocalSearch(d, CHI(d).solve()).vnd(('2opt', 'oropt'))[:-1]
+
+def _path_cost(dist_matrix: np.ndarray, order: list[int]) -> float:
+    """ 頂点の添字の順にたどる経路のコストを返す """
+    return float(sum(dist_matrix[i][j] for i, j in zip(order, order[1:])))
+
+def _solve_path(args: tuple[list[int], dict, bool]) -> tuple[list[int], list[float], list[list[int]]]:
+    """ ワーカープロセスで、両端を固定した経路の途中の頂点の順序を求める \n
+    終点から始点への弧だけをコスト 0 とし、それ以外の始点に入る弧と終点から出る弧を通れなくした巡回路として解く。
+    始点と終点に同じ頂点を指定すれば、その頂点から始まる巡回路となる。
+    Args:
+        args (tuple[list[int], dict, bool]): 頂点の osmid の並び (先頭と末尾を固定)、探索の設定、
+            及び真ならば最近挿入法で初期解を作り直し、偽ならば与えた並びを初期解とするかどうか
+    Returns:
+        path (list[int]): 頂点の osmid の順序
+        costs (list[float]): 隣り合う頂点間のコスト
+        paths (list[list[int]]): 隣り合う頂点間の最短経路
+    """
+    W, options, reorder = args
+    m = len(W)
+    dist_matrix, sp_matrix = build_dist_matrix(_network, W, workers=1)
+    order = list(range(m))
+    if m > 3:
+        d = np.array(dist_matrix)
+        d[:, 0] = np.inf
+        d[m - 1, :] = np.inf
+        d[m - 1, 0] = 0
+        if m < options['exact_threshold']:
+            tour = HeldKarp(d).solve()
+        else:
+            if reorder:
+                # 最近挿入法の巡回路を先頭から始まるように回し、末尾に固定する頂点を最後へ移す
+                cycle = CHI(dist_matrix).solve()[:-1]
+                s = cycle.index(0)
+                order = [i for i in cycle[s:] + cycle[:s] if i != m - 1] + [m - 1]
+            tour = LocalSearch(d, order + [0]).vnd(options['neighborhoods'])
+        candidate = tour[:-1]
+        if candidate[-1] == m - 1 and _path_cost(dist_matrix, candidate) <= _path_cost(dist_matrix, order):
+            order = candidate
+    legs = list(zip(order, order[1:]))
+    return [W[i] for i in order], [float(dist_matrix[i][j]) for i, j in legs], [sp_matrix.get_path(i, j) for i, j in legs]
+
+def _junctions(members: list[list[int]], cluster_order: list[int], xy: dict) -> list[tuple[int, int]]:
+    """ 隣り合うクラスタの間で直線距離が最も近い頂点の組を選び、各クラスタの入口と出口の頂点を返す \n
+    頂点が 2 個以上のクラスタでは入口と出口が異なる頂点となるように、出口を次に近い頂点に選び直す。
+    Returns:
+        ends (list[tuple[int, int]]): cluster_order の順に、各クラスタの (入口, 出口) の osmid
+    """
+    k = len(cluster_order)
+    exits, entries = [], []
+    for pos in range(k):
+        a, b = members[cluster_order[pos]], members[cluster_order[(pos + 1) % k]]
+        pa, pb = np.array([xy[v] for v in a]), np.array([xy[v] for v in b])
+        d = np.hypot(pa[:, None, 0] - pb[None, :, 0], pa[:, None, 1] - pb[None, :, 1])
+        i, j = np.unravel_index(np.argmin(d), d.shape)
+        exits.append((a, d[:, j]))
+        entries.append(b[j])
+    ends = []
+    for pos in range(k):
+        entry = entries[pos - 1]
+        a, d = exits[pos]
+        if len(a) > 1:
+            d = np.where(np.array(a) == entry, np.inf, d)
+        ends.append((entry, a[int(np.argmin(d))]))
+    return ends
+
+def _map(executor: ProcessPoolExecutor | None, fn, items: list) -> list:
+    """ ワーカープロセスがあれば並列に、無ければ同じプロセスで fn を適用 """
+    return list(executor.map(fn, items)) if executor is not None else [fn(item) for item in items]
+
+def solve_clustered(N: Dijkstra, V: list[int], cluster_size: int = 200, workers: int = None, window: int = 7,
+                    neighborhoods: tuple[str, ...] = ('2opt', 'oropt', 'or3'), exact_threshold: int = 16) -> dict:
+    """ 頂点を地理的なクラスタに分けてクラスタごとに巡回路を求め、それらをつないだ巡回路を求める \n
+    1. 頂点の座標を中央値で再帰的に 2 分割し、cluster_size 以下のクラスタに分ける
+    2. クラスタの重心間の直線距離の巡回路の順にクラスタを並べ、隣り合うクラスタの最も近い頂点の組を各クラスタの出口と入口とする
+    3. クラスタごとの距離行列と、入口から出口までの全ての頂点を通る経路を複数プロセスで並列に求める
+    4. クラスタの境界ごとに前後 window 個ずつの頂点の順序を、両端を固定して改善する (境界のつなぎ目の弧もここで求める)
+    距離行列は各クラスタと各境界の中だけで求めるため、頂点数にほぼ比例する時間で解けるが、TwoOpt より解の質は劣る。
+    1 万頂点の合成ネットワークで TwoOpt (近傍は '2opt', 'oropt', 'or3') と比べたコストの増加は、500 頂点では cluster_size が
+    100 で 1〜2%、50 で 2〜3%、25 で 7〜9%、200 頂点では cluster_size が 100 で -2〜+7% であり、cluster_size が 10 では 8〜18% 増えた。
+    クラスタの数が少ないか cluster_size が小さいとつなぎ目の割合が大きくなるため、cluster_size は 100 以上とし、
+    頂点数が cluster_size の数倍に満たない場合 (TwoOpt で十分に速く解ける場合) は TwoOpt を用いる。
+    Args:
+        N (Dijkstra): 読み込み済みの道路ネットワーク、ワーカープロセスへ fork で引き継ぐ
+        V (list[int]): 巡回路に含む頂点の osmid を格納したリスト
+        cluster_size (int, optional): 1 つのクラスタの頂点数の上限、MIN_CLUSTER_SIZE 以上
+        workers (int, optional): プロセス数、省略時は CPU 数 (1 ならば同じプロセスで計算)
+        window (int, optional): 境界の改善で動かすクラスタの端の頂点数 (各クラスタの頂点数の半分まで)
+        neighborhoods (tuple[str, ...], optional): 局所探索に用いる近傍、TwoOpt.solve を参照
+        exact_threshold (int, optional): 頂点数がこれ未満のクラスタや境界は Held-Karp 法で厳密に解く
+    Returns:
+        dict: TwoOpt.solve と同じ形式の 'tour_osmid', 'cost', 'paths'
+    Raises:
+        ValueError: cluster_size が MIN_CLUSTER_SIZE 未満の場合
+    """
+    if cluster_size < MIN_CLUSTER_SIZE:
+        raise ValueError(f'cluster_size must be at least {MIN_CLUSTER_SIZE}, got {cluster_size}')
+    if not V:
+        return {'tour_osmid': [], 'cost': 0.0, 'paths': []}
+    stats = N.stats
+    px, py = stop_coordinates(N, V)
+    with stats.phase('clusters'):
+        labels = cluster_stops(px, py, cluster_size)
+    k = int(labels.max()) + 1
+    stats.count('clusters.count', k)
+    options = {'neighborhoods': tuple(neighborhoods), 'exact_threshold': exact_threshold}
+    members = [[V[i] for i in np.flatnonzero(labels == c)] for c in range(k)]
+    workers = min(os.cpu_count() or 1, max(k, 1)) if workers is None else workers
+
+    executor = None
+    if workers > 1:
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        executor = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(N,))
+    else:
+        _init_worker(N)
+    try:
+        if k == 1:
+            with stats.phase('cluster_tours'):
+                tour, costs, paths = _solve_path((V + V[:1], options, True))
+            tour.pop()
+        else:
+            with stats.phase('stitch'):
+                xy = {v: (float(x), float(y)) for v, x, y in zip(V, px, py)}
+                cx = np.array([np.mean([xy[v][0] for v in m]) for m in members])
+                cy = np.array([np.mean([xy[v][1] for v in m]) for m in members])
+                cluster_order = _order_clusters(cx, cy, exact_threshold)
+                ends = _junctions(members, cluster_order, xy)
+            with stats.phase('cluster_tours'):
+                jobs = []
+                for c, (entry, leave) in zip(cluster_order, ends):
+                    inner = [v for v in members[c] if v != entry and v != leave]
+                    jobs.append(([entry] + inner + ([leave] if leave != entry else []), options, True))
+                tour, costs, paths, starts = [], [], [], []
+                for t, cs, ps in _map(executor, _solve_path, jobs):
+                    starts.append(len(tour))
+                    tour += t
+                    # クラスタ間のつなぎ目の弧は境界の改善で求める
+                    costs += cs + [float('inf')]
+                    paths += ps + [[]]
+            with stats.phase('boundary'):
+                n, sizes = len(tour), [len(members[c]) for c in cluster_order]
+                spans = []
+                for pos in range(k):
+                    nxt = (pos + 1) % k
+                    tail = max(1, min(window, sizes[pos] // 2))
+                    head = max(1, min(window, sizes[nxt] // 2))
+                    spans.append(((starts[nxt] - tail) % n, tail + head))
+                windows = [([tour[(a + j) % n] for j in range(length)], options, False) for a, length in spans]
+                for (a, length), (w, cs, ps) in zip(spans, _map(executor, _solve_path, windows)):
+                    for j in range(length):
+                        tour[(a + j) % n] = w[j]
+                    for j in range(length - 1):
+                        costs[(a + j) % n] = cs[j]
+                        paths[(a + j) % n] = ps[j]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # 巡回路を V[0] から始まるように回転する
+    s = tour.index(V[0])
+    tour, costs, paths = tour[s:] + tour[:s], costs[s:] + costs[:s], paths[s:] + paths[:s]
+    return {'tour_osmid': tour + tour[:1], 'cost': float(sum(costs)), 'paths': paths}
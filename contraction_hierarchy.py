@@ -0,0 +1,279 @@
+import heapq
+import hashlib
+import numpy as np
+from typing import Dict
+
+def network_arcs(N) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ ネットワークから通行可能な弧 (コストが有限) を添字の配列で取り出す \n
+    Args:
+        N (Network): 道路ネットワーク
+    Returns:
+        osmids (np.ndarray): 添字 i の頂点の osmid
+        src (np.ndarray): 各弧の始点の添字
+        dst (np.ndarray): 各弧の終点の添字
+        cost (np.ndarray): 各弧のコスト
+    """
+    if N.graph is not None:
+        g = N.graph
+        osmids = np.asarray(g.osmids)
+        src = np.repeat(np.arange(g.n, dtype=np.int64), np.diff(g.offsets))
+        dst = np.asarray(g.targets, dtype=np.int64)
+        cost = np.asarray(g.costs, dtype=np.float64)
+    else:
+        osmids = np.array(sorted(set(N.nodes) | set(N.edges)), dtype=np.int64)
+        index = {osmid: i for i, osmid in enumerate(osmids.tolist())}
+        arcs = [(index[u], index[v], edge['cost']) for u, edges in N.edges.items() for v, edge in edges.items()]
+        src = np.array([a[0] for a in arcs], dtype=np.int64)
+        dst = np.array([a[1] for a in arcs], dtype=np.int64)
+        cost = np.array([a[2] for a in arcs], dtype=np.float64)
+    usable = np.isfinite(cost) & (src != dst)
+    return osmids, src[usable], dst[usable], cost[usable]
+
+def graph_fingerprint(osmids: np.ndarray, src: np.ndarray, dst: np.ndarray, cost: np.ndarray) -> str:
+    """ 頂点と弧の配列からグラフを識別するハッシュ値を計算 \n
+    Returns:
+        fingerprint (str): 頂点の osmid と弧の端点・コストの sha256
+    """
+    h = hashlib.sha256()
+    for array, dtype in ((osmids, np.int64), (src, np.int64), (dst, np.int64), (cost, np.float64)):
+        h.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+    return h.hexdigest()
+
+def _to_csr(n: int, heads: list[int], tails: list[int], costs: list[float], mids: list[int]) -> tuple[np.ndarray, ...]:
+    """ (頂点, 相手の頂点, コスト, 経由頂点) の組を頂点ごとにまとめた CSR 形式の配列に変換 """
+    heads = np.asarray(heads, dtype=np.int64)
+    order = np.argsort(heads, kind='stable')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=n), out=offsets[1:])
+    return (offsets, np.asarray(tails, dtype=np.int64)[order],
+            np.asarray(costs, dtype=np.float64)[order], np.asarray(mids, dtype=np.int64)[order])
+
+
+class ContractionHierarchy:
+    """ 頂点の縮約順序とショートカット辺からなる縮約階層を用いて 2 点間の最短経路を高速に求めるクラス """
+    def __init__(self, osmids: np.ndarray, rank: np.ndarray,
+                 up_offsets: np.ndarray, up_targets: np.ndarray, up_costs: np.ndarray, up_mids: np.ndarray,
+                 down_offsets: np.ndarray, down_sources: np.ndarray, down_costs: np.ndarray, down_mids: np.ndarray,
+                 fingerprint: str = '') -> None:
+        """ 前処理済みの配列から縮約階層を初期化 \n
+        Args:
+            osmids (np.ndarray): 添字 i の頂点の osmid
+            rank (np.ndarray): 添字 i の頂点が縮約された順番
+            up_* (np.ndarray): 上向きグラフ、頂点 i から順位の高い頂点への弧 (終点, コスト, 経由頂点)
+            down_* (np.ndarray): 下向きグラフ、順位の高い頂点から頂点 i への弧 (始点, コスト, 経由頂点)
+                経由頂点は、ショートカット辺が縮約した頂点の添字 (元の辺ならば -1)
+            fingerprint (str, optional): 前処理に用いたグラフのハッシュ値
+        Attributes:
+            index (Dict[int, int]): 頂点の osmid から添字への対応
+            last_query (tuple | None): 直前の問い合わせの始点, 終点, 出会った頂点, 前向き・後ろ向きの直前の頂点
+        """
+        self.osmids = osmids
+        self.rank = rank
+        self.up = (up_offsets, up_targets, up_costs, up_mids)
+        self.down = (down_offsets, down_sources, down_costs, down_mids)
+        self.fingerprint = fingerprint
+        self.index: Dict[int, int] = {osmid: i for i, osmid in enumerate(osmids.tolist())}
+        self.last_query = None
+
+    @classmethod
+    def build(cls, N, settle_limit: int = 500) -> 'ContractionHierarchy':
+        """ 道路ネットワークの頂点を順に縮約し、ショートカット辺を加えて縮約階層を構築 \n
+        縮約の順序は (追加するショートカット数 - 削除する辺数 + 縮約済みの隣接頂点数) が小さい順とし、
+        優先度は取り出す際に再計算する (lazy update)。
+        Args:
+            N (Network): 道路ネットワーク
+            settle_limit (int, optional): 証人探索で確定させる頂点数の上限
+        Returns:
+            ch (ContractionHierarchy): 構築した縮約階層
+        """
+        osmids, src, dst, cost = network_arcs(N)
+        n = len(osmids)
+        out_adj: list[Dict[int, list]] = [{} for _ in range(n)]
+        in_adj: list[Dict[int, list]] = [{} for _ in range(n)]
+        for u, v, c in zip(src.tolist(), dst.tolist(), cost.tolist()):
+            if v not in out_adj[u] or c < out_adj[u][v][0]:
+                out_adj[u][v] = [c, -1]
+                in_adj[v][u] = out_adj[u][v]
+
+        def _witness(u: int, excluded: int, max_cost: float) -> Dict[int, float]:
+            """ 頂点 excluded を通らずに u から max_cost 以内で到達できる頂点までのコスト """
+            dist = {u: 0}
+            q = [(0, u)]
+            settled = 0
+            while q:
+                d, x = heapq.heappop(q)
+                if dist[x] < d:
+                    continue
+                settled += 1
+                if d > max_cost or settled > settle_limit:
+                    break
+                for y, (c, _) in out_adj[x].items():
+                    if y != excluded and d + c < dist.get(y, float('inf')):
+                        dist[y] = d + c
+                        heapq.heappush(q, (d + c, y))
+            return dist
+
+        def _shortcuts(v: int) -> list[tuple[int, int, float]]:
+            """ 頂点 v を縮約するときに必要なショートカット辺 (u, w, コスト) """
+            shortcuts = []
+            for u, (cuv, _) in in_adj[v].items():
+                candidates = {w: cuv + cvw for w, (cvw, _) in out_adj[v].items() if w != u}
+                if not candidates:
+                    continue
+                dist = _witness(u, v, max(candidates.values()))
+                for w, c in candidates.items():
+                    if dist.get(w, float('inf')) > c:
+                        shortcuts.append((u, w, c))
+            return shortcuts
+
+        deleted = [0] * n
+        def _priority(v: int) -> int:
+            return len(_shortcuts(v)) - len(in_adj[v]) - len(out_adj[v]) + deleted[v]
+
+        q = [(_priority(v), v) for v in range(n)]
+        heapq.heapify(q)
+        rank = np.full(n, -1, dtype=np.int64)
+        up, down = ([], [], [], []), ([], [], [], [])
+        order = 0
+        while q:
+            _, v = heapq.heappop(q)
+            p = _priority(v)
+            if q and p > q[0][0]:
+                heapq.heappush(q, (p, v))
+                continue
+            for u, w, c in _shortcuts(v):
+                if w not in out_adj[u] or c < out_adj[u][w][0]:
+                    out_adj[u][w] = [c, v]
+                    in_adj[w][u] = out_adj[u][w]
+            # 残っている弧は全て順位の高い頂点との弧なので、上向き・下向きグラフとして確定
+            for w, (c, mid) in out_adj[v].items():
+                for a, b in zip(up, (v, w, c, mid)):
+                    a.append(b)
+                del in_adj[w][v]
+                deleted[w] += 1
+            for u, (c, mid) in in_adj[v].items():
+                for a, b in zip(down, (v, u, c, mid)):
+                    a.append(b)
+                del out_adj[u][v]
+                deleted[u] += 1
+            out_adj[v], in_adj[v] = {}, {}
+            rank[v] = order
+            order += 1
+        return cls(osmids, rank, *_to_csr(n, *up), *_to_csr(n, *down),
+                   fingerprint=graph_fingerprint(osmids, src, dst, cost))
+
+    def save(self, path: str) -> None:
+        """ 縮約階層を .npz ファイルに保存 \n
+        Args:
+            path (str): 保存先のファイルの path
+        """
+        np.savez(path, osmids=self.osmids, rank=self.rank,
+                 up_offsets=self.up[0], up_targets=self.up[1], up_costs=self.up[2], up_mids=self.up[3],
+                 down_offsets=self.down[0], down_sources=self.down[1], down_costs=self.down[2], down_mids=self.down[3],
+                 fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, path: str) -> 'ContractionHierarchy':
+        """ save で保存した縮約階層を読み込む \n
+        Args:
+            path (str): 保存したファイルの path
+        Returns:
+            ch (ContractionHierarchy): 読み込んだ縮約階層
+        """
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+        arrays['fingerprint'] = str(arrays['fingerprint'])
+        return cls(**arrays)
+
+    def _arcs(self, graph: tuple[np.ndarray, ...], i: int) -> tuple[list[int], list[float]]:
+        """ 上向きまたは下向きグラフで頂点 i に接続する弧の相手の頂点とコスト """
+        offsets, others, costs, _ = graph
+        a, b = offsets[i], offsets[i + 1]
+        return others[a:b].tolist(), costs[a:b].tolist()
+
+    def query(self, start: int, goal: int) -> float:
+        """ 上向きグラフのみを双方向に探索して 2 点間の最短経路のコストを求める \n
+        Args:
+            start (int): 始点の osmid
+            goal (int): 終点の osmid
+        Returns:
+            cost (float): 始点から終点までの最短経路のコスト (到達不能ならば inf)
+        """
+        s, t = self.index[start], self.index[goal]
+        dist = ({s: 0}, {t: 0})
+        prev = ({s: -1}, {t: -1})
+        q = ([(0, s)], [(0, t)])
+        graphs = (self.up, self.down)
+        best = 0 if s == t else float('inf')
+        meet = s if s == t else None
+        while (q[0] and q[0][0][0] < best) or (q[1] and q[1][0][0] < best):
+            if not q[1] or q[1][0][0] >= best:
+                side = 0
+            elif not q[0] or q[0][0][0] >= best:
+                side = 1
+            else:
+                side = 0 if q[0][0][0] <= q[1][0][0] else 1
+            d, u = heapq.heappop(q[side])
+            if dist[side][u] < d:
+                continue
+            if u in dist[1 - side] and d + dist[1 - side][u] < best:
+                best = d + dist[1 - side][u]
+                meet = u
+            others, costs = self._arcs(graphs[side], u)
+            for v, c in zip(others, costs):
+                if d + c < dist[side].get(v, float('inf')):
+                    dist[side][v] = d + c
+                    prev[side][v] = u
+                    heapq.heappush(q[side], (d + c, v))
+        self.last_query = (start, goal, meet, prev)
+        return best
+
+    def _mid(self, a: int, b: int) -> int:
+        """ 階層内の弧 (a, b) の経由頂点を返す (元の辺ならば -1) """
+        if self.rank[a] < self.rank[b]:
+            offsets, others, costs, mids = self.up
+            head, other = a, b
+        else:
+            offsets, others, costs, mids = self.down
+            head, other = b, a
+        lo, hi = offsets[head], offsets[head + 1]
+        k = lo + int(np.flatnonzero(others[lo:hi] == other)[0])
+        return int(mids[k])
+
+    def _unpack(self, a: int, b: int, path: list[int]) -> None:
+        """ ショートカット辺 (a, b) を元の辺の列に展開して、b までの頂点を path に追加 """
+        stack = [(a, b)]
+        while stack:
+            x, y = stack.pop()
+            mid = self._mid(x, y)
+            if mid == -1:
+                path.append(y)
+            else:
+                stack.append((mid, y))
+                stack.append((x, mid))
+
+    def get_shortest_path(self, start: int, goal: int) -> list[int]:
+        """ ショートカット辺を展開して、始点から終点までの最短経路を osmid の列で返す \n
+        Args:
+            start (int): 始点の osmid
+            goal (int): 終点の osmid
+        Returns:
+            path (list[int]): 要素は各頂点の osmid で、始点から終点までの最短経路 (到達不能ならば空のリスト)
+        """
+        if self.last_query is None or self.last_query[:2] != (start, goal):
+            self.query(start, goal)
+        _, _, meet, prev = self.last_query
+        if meet is None:
+            return []
+        up_nodes = [meet]
+        while prev[0][up_nodes[-1]] != -1:
+            up_nodes.append(prev[0][up_nodes[-1]])
+        up_nodes.reverse()
+        down_nodes = [meet]
+        while prev[1][down_nodes[-1]] != -1:
+            down_nodes.append(prev[1][down_nodes[-1]])
+        nodes = up_nodes + down_nodes[1:]
+        path = [nodes[0]]
+        for a, b in zip(nodes, nodes[1:]):
+            self._unpack(a, b, path)
+        return self.osmids[path].tolist()
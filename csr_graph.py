@@ -0,0 +1,298 @@
+import numpy as np
+from collections.abc import Mapping
+from typing import Iterator
+
+def encode_edge_osmids(values) -> tuple[np.ndarray, np.ndarray | None]:
+    """ 辺の osmid を int64 の配列に変換 \n
+    複数の osmid がまとめられた辺の osmid (リストの文字列) は文字列の表に格納し、-(表の添字 + 1) で表す。
+    Args:
+        values (array_like): 辺の osmid (整数と文字列が混在してもよい)
+    Returns:
+        codes (np.ndarray): 辺の osmid もしくは文字列の表を指す負の値
+        names (np.ndarray | None): 文字列の osmid の表、全て整数ならば None
+    """
+    values = np.asarray(values)
+    if values.dtype != object and np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64, copy=False), None
+    values = values.astype(object)
+    is_name = np.fromiter((isinstance(v, str) and not v.lstrip('-').isdigit() for v in values), dtype=bool, count=len(values))
+    codes = np.empty(len(values), dtype=np.int64)
+    codes[~is_name] = [int(v) for v in values[~is_name]]
+    names, inverse = np.unique(values[is_name].astype(str), return_inverse=True)
+    codes[is_name] = -(inverse + 1)
+    return codes, (names if len(names) else None)
+
+
+class CSRGraph:
+    """ 頂点の osmid を連続した整数の添字に対応付け、隣接関係を CSR 形式の NumPy 配列で保持するグラフ """
+    def __init__(self, osmids: np.ndarray, x: np.ndarray, y: np.ndarray, is_signal: np.ndarray,
+                 offsets: np.ndarray, targets: np.ndarray, costs: np.ndarray, edge_osmids: np.ndarray,
+                 order: np.ndarray | None = None, sorted_osmids: np.ndarray | None = None,
+                 edge_osmid_names: np.ndarray | None = None) -> None:
+        """ CSR 形式の配列からグラフを初期化 \n
+        Args:
+            osmids (np.ndarray): 添字 i の頂点の osmid
+            x (np.ndarray): 添字 i の頂点の x 座標
+            y (np.ndarray): 添字 i の頂点の y 座標
+            is_signal (np.ndarray): 添字 i の頂点が交通信号機ならば真
+            offsets (np.ndarray): 頂点 i から出る弧は targets[offsets[i]:offsets[i+1]] に格納
+            targets (np.ndarray): 各弧の終点の添字
+            costs (np.ndarray): 各弧のコスト
+            edge_osmids (np.ndarray): 各弧に対応する辺の osmid、encode_edge_osmids で変換した int64 の配列
+            order (np.ndarray, optional): osmids を昇順に並べる添字の配列、省略時は計算する
+            sorted_osmids (np.ndarray, optional): 昇順に並べた osmids (osmids[order])、省略時は計算する
+            edge_osmid_names (np.ndarray, optional): edge_osmids の負の値が指す文字列の osmid の表
+        Attributes:
+            n (int): 頂点数
+            m (int): 弧の数
+            index (OsmidIndex): 頂点の osmid から添字への対応
+            fingerprint (str | None): スナップショットから読み込んだ場合、元の csv ファイルの内容のハッシュ値
+            via_offsets (np.ndarray | None): graph_pruning で縮約した場合、弧 k が経由する頂点は via_nodes[via_offsets[k]:via_offsets[k+1]]
+            via_nodes (np.ndarray | None): 縮約した弧が経由する頂点の添字
+            active (np.ndarray | None): 縮約した場合、探索に残した頂点ならば真
+        """
+        self.osmids = osmids
+        self.x = x
+        self.y = y
+        self.is_signal = is_signal
+        self.offsets = offsets
+        self.targets = targets
+        self.costs = costs
+        self.edge_osmids = edge_osmids
+        self.edge_osmid_names = edge_osmid_names
+        self.n: int = len(osmids)
+        self.m: int = len(targets)
+        self.index = OsmidIndex(osmids, order, sorted_osmids)
+        self.fingerprint: str | None = None
+        self.via_offsets: np.ndarray | None = None
+        self.via_nodes: np.ndarray | None = None
+        self.active: np.ndarray | None = None
+
+    @classmethod
+    def from_arrays(cls, node_osmid, node_x, node_y, node_is_signal,
+                    edge_u, edge_v, edge_osmid, edge_cost, edge_oneway, edge_reversed) -> 'CSRGraph':
+        """ 頂点と辺の配列から CSR グラフを構築  \n
+        Network.__add_edge と同様に、辺 (u, v) ごとに順方向と逆方向の 2 本の弧を作り、
+        一方通行の逆走方向はコストを inf とする。同じ (u, v) の弧が複数ある場合は後の行を優先する。
+        Args:
+            node_osmid, node_x, node_y, node_is_signal: 頂点の osmid, x 座標, y 座標, 交通信号機かどうか
+            edge_u, edge_v, edge_osmid, edge_cost: 辺の始点 osmid, 終点 osmid, 辺の osmid, コスト [min]
+            edge_oneway, edge_reversed: 一方通行ならば真, 逆方向に一方通行ならば真
+        Returns:
+            graph (CSRGraph): 構築したグラフ
+        """
+        osmids = np.asarray(node_osmid, dtype=np.int64)
+        n = len(osmids)
+        index = OsmidIndex(osmids)
+
+        def _to_index(values) -> np.ndarray:
+            i = index.lookup(values)
+            if np.any(i < 0):
+                raise ValueError('辺の端点に頂点 csv に存在しない osmid が含まれています')
+            return i
+
+        u = _to_index(edge_u)
+        v = _to_index(edge_v)
+        cost = np.asarray(edge_cost, dtype=np.float64)
+        oneway = np.asarray(edge_oneway, dtype=bool)
+        reverse = np.asarray(edge_reversed, dtype=bool)
+        edge_osmid, names = encode_edge_osmids(edge_osmid)
+
+        # 行 i の順方向の弧を 2i 番目、逆方向の弧を 2i+1 番目に並べる
+        m = len(u)
+        src = np.empty(2 * m, dtype=np.int64)
+        dst = np.empty(2 * m, dtype=np.int64)
+        arc_cost = np.empty(2 * m, dtype=np.float64)
+        src[0::2], src[1::2] = u, v
+        dst[0::2], dst[1::2] = v, u
+        arc_cost[0::2] = np.where(oneway & reverse, np.inf, cost)
+        arc_cost[1::2] = np.where(oneway & ~reverse, np.inf, cost)
+        arc_osmid = np.repeat(edge_osmid, 2)
+
+        # 同じ (u, v) の弧は最後に現れたものを残す (辞書への上書きと同じ挙動)
+        key = src * max(n, 1) + dst
+        _, last = np.unique(key[::-1], return_index=True)
+        keep = (2 * m - 1) - last
+        src, dst, arc_cost, arc_osmid = src[keep], dst[keep], arc_cost[keep], arc_osmid[keep]
+
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+        return cls(osmids, np.asarray(node_x, dtype=np.float64), np.asarray(node_y, dtype=np.float64),
+                   np.asarray(node_is_signal, dtype=bool), offsets, dst, arc_cost, arc_osmid, index.order, index.sorted_osmids,
+                   names)
+
+    @classmethod
+    def from_records(cls, nodes: list[dict], edges: list[dict]) -> 'CSRGraph':
+        """ extract_road_csv が返すレコードのリストから CSR グラフを構築  \n
+        Args:
+            nodes (list[dict]): extract_node_datas が返す頂点の情報
+            edges (list[dict]): extract_edge_datas が返す辺の情報
+        Returns:
+            graph (CSRGraph): 構築したグラフ
+        """
+        length = np.array([edge['length'] for edge in edges], dtype=np.float64)
+        maxspeed = np.array([edge['maxspeed'] for edge in edges], dtype=np.float64)
+        return cls.from_arrays(
+            [node['osmid'] for node in nodes],
+            [node['x'] for node in nodes],
+            [node['y'] for node in nodes],
+            [node['highway'] == 'traffic_signals' for node in nodes],
+            [edge['u'] for edge in edges],
+            [edge['v'] for edge in edges],
+            [edge['osmid'] for edge in edges],
+            (length / 1000) / (maxspeed / 60),  # 辺 (u, v) を移動するためにかかる時間 [min]
+            [bool(edge['oneway']) for edge in edges],
+            [bool(edge['reversed']) for edge in edges],
+        )
+
+    def reverse(self) -> 'CSRGraph':
+        """ 全ての弧の向きを反転したグラフを返す \n
+        Returns:
+            graph (CSRGraph): 弧 (u, v) を弧 (v, u) とした転置グラフ
+        """
+        src = np.repeat(np.arange(self.n, dtype=np.int64), np.diff(self.offsets))
+        order = np.lexsort((src, self.targets))
+        offsets = np.zeros(self.n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.targets, minlength=self.n), out=offsets[1:])
+        return CSRGraph(self.osmids, self.x, self.y, self.is_signal,
+                        offsets, src[order], self.costs[order], self.edge_osmids[order], self.index.order,
+                        self.index.sorted_osmids, self.edge_osmid_names)
+
+    def edge_osmid(self, k: int) -> int | str:
+        """ 弧 k に対応する辺の osmid を返す、複数の osmid がまとめられた辺はリストの文字列 (辞書で保持した場合と同じ値) """
+        code = int(self.edge_osmids[k])
+        if code < 0 and self.edge_osmid_names is not None:
+            return str(self.edge_osmid_names[-code - 1])
+        return code
+
+    def expand_path(self, path: list[int]) -> list[int]:
+        """ 縮約した弧を経由する頂点に展開した経路を返す \n
+        Args:
+            path (list[int]): 頂点の添字の経路
+        Returns:
+            path (list[int]): 縮約前のグラフでの頂点の添字の経路 (縮約していなければそのまま)
+        """
+        if self.via_offsets is None or len(path) < 2:
+            return list(path)
+        expanded = [path[0]]
+        for u, v in zip(path, path[1:]):
+            a, b = self.offsets[u], self.offsets[u + 1]
+            hit = np.flatnonzero(self.targets[a:b] == v)
+            if len(hit):
+                k = a + hit[0]
+                expanded.extend(self.via_nodes[self.via_offsets[k]:self.via_offsets[k + 1]].tolist())
+            expanded.append(v)
+        return expanded
+
+    def expanded_arcs(self) -> tuple[np.ndarray, np.ndarray]:
+        """ 通行可能な弧を縮約前の弧に展開し、その始点と終点の添字を返す """
+        src = np.repeat(np.arange(self.n, dtype=np.int64), np.diff(self.offsets))
+        finite = np.isfinite(np.asarray(self.costs))
+        if self.via_offsets is None:
+            return src[finite], np.asarray(self.targets, dtype=np.int64)[finite]
+        arcs = np.flatnonzero(finite)
+        lens = np.diff(self.via_offsets)[arcs]
+        # 弧ごとに [始点, 経由する頂点..., 終点] を連結した列を作り、隣り合う組を縮約前の弧とする
+        width = lens + 2
+        begin = np.concatenate(([0], np.cumsum(width)[:-1]))
+        seq = np.empty(int(width.sum()), dtype=np.int64)
+        seq[begin] = src[arcs]
+        seq[begin + width - 1] = self.targets[arcs]
+        owner = np.repeat(np.arange(len(arcs)), lens)
+        inner = np.arange(int(lens.sum())) - np.repeat(np.concatenate(([0], np.cumsum(lens)[:-1])), lens)
+        seq[begin[owner] + 1 + inner] = self.via_nodes[np.repeat(self.via_offsets[arcs], lens) + inner]
+        pair = np.ones(max(len(seq) - 1, 0), dtype=bool)
+        pair[(begin + width - 1)[:-1]] = False
+        return seq[:-1][pair], seq[1:][pair]
+
+    def arcs(self, i: int) -> tuple[list[int], list[float]]:
+        """ 頂点 i から出る弧の終点とコストを返す \n
+        Args:
+            i (int): 頂点の添字
+        Returns:
+            targets (list[int]): 弧の終点の添字
+            costs (list[float]): 弧のコスト
+        """
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return self.targets[a:b].tolist(), self.costs[a:b].tolist()
+
+
+class OsmidIndex(Mapping):
+    """ 頂点の osmid から添字への対応を、ソート済みの osmid の配列の二分探索で引く読み取り専用の辞書 """
+    def __init__(self, osmids: np.ndarray, order: np.ndarray | None = None, sorted_osmids: np.ndarray | None = None) -> None:
+        """ 対応表を初期化 \n
+        Args:
+            osmids (np.ndarray): 添字 i の頂点の osmid
+            order (np.ndarray, optional): osmids を昇順に並べる添字の配列、省略時は計算する
+            sorted_osmids (np.ndarray, optional): 昇順に並べた osmids (osmids[order])、省略時は計算する
+        """
+        self.osmids = osmids
+        self.order = np.argsort(osmids, kind='stable') if order is None else order
+        self.sorted_osmids = np.asarray(osmids)[self.order] if sorted_osmids is None else sorted_osmids
+
+    def lookup(self, osmids) -> np.ndarray:
+        """ 複数の osmid をまとめて添字に変換 \n
+        Args:
+            osmids (array_like): 頂点の osmid の配列
+        Returns:
+            index (np.ndarray): 各 osmid に対応する添字 (存在しない osmid は -1)
+        """
+        osmids = np.asarray(osmids, dtype=np.int64)
+        if len(self.order) == 0:
+            return np.full(osmids.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.sorted_osmids, osmids)
+        pos[pos == len(self.order)] = 0
+        index = np.asarray(self.order[pos], dtype=np.int64)
+        index[self.osmids[index] != osmids] = -1
+        return index
+
+    def _find(self, osmid: int) -> int:
+        """ 1 つの osmid の添字を返す (存在しなければ -1)、配列を作らずに二分探索する """
+        pos = int(self.sorted_osmids.searchsorted(osmid))
+        if pos == len(self.sorted_osmids) or self.sorted_osmids[pos] != osmid:
+            return -1
+        return int(self.order[pos])
+
+    def __getitem__(self, osmid: int) -> int:
+        i = self._find(osmid)
+        if i < 0:
+            raise KeyError(osmid)
+        return i
+
+    def __contains__(self, osmid) -> bool:
+        try:
+            return self._find(np.int64(osmid)) >= 0
+        except (TypeError, ValueError, OverflowError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.osmids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.osmids)
+
+
+class NodeArrayView(Mapping):
+    """ 頂点の添字で並んだ配列を、osmid をキーとする読み取り専用の辞書として見せるビュー """
+    def __init__(self, index: OsmidIndex, values: np.ndarray, as_osmid: bool = False) -> None:
+        """ ビューを初期化 \n
+        Args:
+            index (OsmidIndex): 添字と osmid の対応
+            values (np.ndarray): 頂点の添字で並んだ配列
+            as_osmid (bool, optional): 真ならば値を頂点の添字とみなして osmid に変換して返す (-1 はそのまま)
+        """
+        self.index = index
+        self.values = values
+        self.as_osmid = as_osmid
+
+    def __getitem__(self, osmid: int):
+        value = self.values[self.index[osmid]]
+        if self.as_osmid:
+            return -1 if value < 0 else int(self.index.osmids[value])
+        return float(value)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
@@ -0,0 +1,350 @@
+import os
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contraction_hierarchy import network_arcs
+from matrix_cache import MatrixCache, matrix_fingerprint
+from solver_stats import SolverStats, heap_ops
+
+_graph: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None   # ワーカープロセスが共有する読み取り専用のグラフ
+
+def search_arrays(N) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ 探索に用いる CSR 形式の配列をネットワークから取り出す \n
+    Args:
+        N (Network): 道路ネットワーク
+    Returns:
+        osmids (np.ndarray): 添字 i の頂点の osmid
+        offsets (np.ndarray): 頂点 i から出る弧は targets[offsets[i]:offsets[i+1]] に格納
+        targets (np.ndarray): 各弧の終点の添字
+        costs (np.ndarray): 各弧のコスト
+    """
+    if N.graph is not None:
+        return N.graph.osmids, N.graph.offsets, N.graph.targets, N.graph.costs
+    osmids, src, dst, cost = network_arcs(N)
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(len(osmids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(osmids)), out=offsets[1:])
+    return osmids, offsets, dst[order], cost[order]
+
+def _stop_indices(N, osmids: np.ndarray, V: list[int]) -> list[int]:
+    """ 頂点の osmid を search_arrays の添字に変換 """
+    if N.graph is not None:
+        index = N.graph.index
+        return [index[v] for v in V]
+    lookup = {osmid: i for i, osmid in enumerate(osmids.tolist())}
+    return [lookup[v] for v in V]
+
+def _reverse_arrays(offsets: np.ndarray, targets: np.ndarray, costs: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ CSR 形式の配列の全ての弧の向きを反転 """
+    n = len(offsets) - 1
+    src = np.repeat(np.arange(n, dtype=np.int64), np.diff(offsets))
+    order = np.argsort(targets, kind='stable')
+    reverse_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(targets, minlength=n), out=reverse_offsets[1:])
+    return reverse_offsets, src[order], costs[order]
+
+def _init_worker(graph: tuple[np.ndarray, np.ndarray, np.ndarray]) -> None:
+    """ ワーカープロセスで共有するグラフを設定 """
+    global _graph
+    _graph = graph
+
+def one_to_many(source: int, targets: list[int], stats: SolverStats = None,
+                graph: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None) -> tuple[list[float], dict[int, int]]:
+    """ 始点から全ての終点が確定した時点で打ち切るダイクストラ法 \n
+    Args:
+        source (int): 始点の添字
+        targets (list[int]): 終点の添字のリスト
+        stats (SolverStats, optional): ヒープ操作と弧の緩和の回数を数える計測
+        graph (tuple[np.ndarray, np.ndarray, np.ndarray], optional): 探索するグラフの (offsets, targets, costs)
+            省略時はワーカープロセスで _init_worker が設定したグラフ (メインプロセスでは複数のスレッドから使えるように明示する)
+    Returns:
+        row (list[float]): 始点から各終点までの最短経路のコスト (到達不能ならば inf)
+        prev (dict[int, int]): 探索した頂点の最短経路における直前の頂点の添字 (始点は -1)
+    """
+    offsets, arc_targets, arc_costs = _graph if graph is None else graph
+    push, pop = heap_ops(stats, 'dist_matrix')
+    dist = {source: 0}
+    prev = {source: -1}
+    remaining = set(targets)
+    q = [(0, source)]
+    relaxed = 0
+    while q and remaining:
+        d, u = pop(q)
+        if dist[u] < d:
+            continue
+        remaining.discard(u)
+        if not remaining:
+            break
+        a, b = offsets[u], offsets[u + 1]
+        relaxed += int(b - a)
+        for v, c in zip(arc_targets[a:b].tolist(), arc_costs[a:b].tolist()):
+            if d + c < dist.get(v, float('inf')):
+                dist[v] = d + c
+                prev[v] = u
+                push(q, (d + c, v))
+    if stats is not None:
+        stats.count('dist_matrix.relaxations', relaxed)
+    return [dist.get(t, float('inf')) for t in targets], prev
+
+def compact_tree(prev: dict[int, int], targets: list[int], row: list[float]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ 最短経路木から終点への経路上の頂点だけを残し、配列に詰め直す \n
+    Args:
+        prev (dict[int, int]): 探索した頂点の最短経路における直前の頂点の添字 (始点は -1)
+        targets (list[int]): 終点の添字のリスト
+        row (list[float]): 始点から各終点までの最短経路のコスト
+    Returns:
+        nodes (np.ndarray): 残した頂点のグラフ上の添字
+        parents (np.ndarray): nodes[k] の直前の頂点の nodes 内での位置 (始点は -1)
+        target_pos (np.ndarray): 各終点の nodes 内での位置 (到達不能ならば -1)
+    """
+    pos: dict[int, int] = {}
+    nodes, parents, target_pos = [], [], []
+    for t, cost in zip(targets, row):
+        if cost == float('inf'):
+            target_pos.append(-1)
+            continue
+        chain = []
+        u = t
+        while u != -1 and u not in pos:
+            chain.append(u)
+            u = prev[u]
+        parent = -1 if u == -1 else pos[u]
+        for x in reversed(chain):
+            pos[x] = len(nodes)
+            nodes.append(x)
+            parents.append(parent)
+            parent = pos[x]
+        target_pos.append(pos[t])
+    return (np.array(nodes, dtype=np.int64), np.array(parents, dtype=np.int32), np.array(target_pos, dtype=np.int32))
+
+def _solve_rows(args: tuple[list[int], list[int], bool],
+                graph: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None) -> tuple[list[tuple[list[float], tuple[np.ndarray, np.ndarray, np.ndarray]]], dict]:
+    """ 複数の始点をまとめてワーカープロセスで処理し、コストの行と詰め直した最短経路木、及び数えた回数を返す \n
+    同じプロセスで処理する場合は graph を渡し、モジュールのグローバル変数を書き換えない。
+    """
+    sources, targets, instrument = args
+    stats = SolverStats(enabled=instrument)
+    stats.count('dist_matrix.heap_pushes', len(sources))
+    results = []
+    for s in sources:
+        row, prev = one_to_many(s, targets, stats, graph)
+        results.append((row, compact_tree(prev, targets, row)))
+    return results, dict(stats.counters)
+
+
+class PathMatrix:
+    """ 始点ごとの最短経路木を配列で保持し、要求された頂点間の経路だけを復元する最短経路行列 """
+    def __init__(self, osmids: np.ndarray, trees: list[tuple[np.ndarray, np.ndarray, np.ndarray] | None], graph=None,
+                 search: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None, stops: list[int] | None = None) -> None:
+        """ 最短経路行列を初期化 \n
+        Args:
+            osmids (np.ndarray): グラフ上の添字 i の頂点の osmid
+            trees (list[tuple[np.ndarray, np.ndarray, np.ndarray] | None]): 始点ごとに compact_tree で詰め直した最短経路木
+                None の始点は経路を参照したときに終点までを探索する (距離行列をキャッシュから読んだ行)
+            graph (CSRGraph, optional): 縮約したグラフの場合、経路を展開するために用いるグラフ
+            search (tuple[np.ndarray, np.ndarray, np.ndarray], optional): 最短経路木が None の始点の探索に用いる (offsets, targets, costs)
+            stops (list[int], optional): 頂点集合の各頂点のグラフ上の添字
+        """
+        self.osmids = osmids
+        self.trees = trees
+        self.graph = graph
+        self.search = search
+        self.stops = stops
+
+    def get_path(self, i: int, j: int) -> list[int]:
+        """ i 番目の頂点から j 番目の頂点までの最短経路を復元 \n
+        Args:
+            i (int): 始点の頂点集合内での添字
+            j (int): 終点の頂点集合内での添字
+        Returns:
+            path (list[int]): 要素は各頂点の osmid で、始点から終点までの最短経路 (到達不能ならば空のリスト)
+        """
+        tree = self.trees[i]
+        p = None
+        if tree is None:
+            # 最短経路木を持たない始点は、終点が確定した時点で打ち切る探索で経路を求める
+            row, prev = one_to_many(self.stops[i], [self.stops[j]], graph=self.search)
+            tree, p = compact_tree(prev, [self.stops[j]], row), 0
+        nodes, parents, target_pos = tree
+        path = []
+        p = int(target_pos[j if p is None else p])
+        while p != -1:
+            path.append(int(nodes[p]))
+            p = int(parents[p])
+        path.reverse()
+        if self.graph is not None:
+            path = self.graph.expand_path(path)
+        return self.osmids[path].tolist()
+
+    def __getitem__(self, i: int) -> 'PathRow':
+        if not -len(self.trees) <= i < len(self.trees):
+            raise IndexError(i)
+        return PathRow(self, i % len(self.trees))
+
+    def __len__(self) -> int:
+        return len(self.trees)
+
+
+class PathRow:
+    """ sp_matrix[i][j] の形で経路を参照するための PathMatrix の行 """
+    def __init__(self, matrix: PathMatrix, i: int) -> None:
+        self.matrix = matrix
+        self.i = i
+
+    def __getitem__(self, j: int) -> list[int]:
+        if not -len(self.matrix) <= j < len(self.matrix):
+            raise IndexError(j)
+        return self.matrix.get_path(self.i, j % len(self.matrix))
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+def _run_rows(graph: tuple[np.ndarray, np.ndarray, np.ndarray], sources: list[int], targets: list[int], workers: int,
+              stats: SolverStats = None) -> list[tuple[list[float], tuple[np.ndarray, np.ndarray, np.ndarray]]]:
+    """ 始点ごとの探索を複数プロセスに分散し、_solve_rows の結果を始点の順に返す \n
+    Args:
+        graph (tuple[np.ndarray, np.ndarray, np.ndarray]): 探索するグラフの (offsets, targets, costs)
+        sources (list[int]): 始点の添字のリスト
+        targets (list[int]): 終点の添字のリスト
+        workers (int): プロセス数 (1 ならば同じプロセスで計算)
+        stats (SolverStats, optional): 各プロセスで数えたヒープ操作と弧の緩和の回数を合計する計測
+    Returns:
+        results (list[tuple[list[float], tuple[np.ndarray, np.ndarray, np.ndarray]]]): 始点ごとのコストの行と詰め直した最短経路木
+    """
+    n = len(sources)
+    instrument = stats is not None and stats.enabled
+    if workers <= 1 or n <= 1:
+        results, counters = _solve_rows((sources, targets, instrument), graph)
+        if instrument:
+            stats.merge(counters)
+        return results
+    # fork が使える場合はグラフを pickle せずに子プロセスへ引き継ぐ
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    chunk = max(1, n // (4 * workers))
+    batches = [(sources[i:i + chunk], targets, instrument) for i in range(0, n, chunk)]
+    results = []
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(graph,)) as executor:
+        for batch, counters in executor.map(_solve_rows, batches):
+            results.extend(batch)
+            if instrument:
+                stats.merge(counters)
+    return results
+
+def build_dist_matrix(N, V: list[int], workers: int = None, stats: SolverStats = None,
+                      cache: MatrixCache = None) -> tuple[np.ndarray, PathMatrix]:
+    """ 頂点集合 V の全ての組の最短経路のコストと最短経路木を、始点ごとの探索を複数プロセスに分散して求める \n
+    cache を指定した場合は、同じグラフで保存済みの組のコストを読み込み、新しい頂点の行は順方向の探索で、
+    保存済みの頂点から新しい頂点への列は逆向きのグラフでの探索で求め、求めた距離行列をキャッシュに併合する。
+    キャッシュから読んだ行は最短経路木を持たず、経路は参照したときに終点までを探索して求める。
+    Args:
+        N (Network): 道路ネットワーク
+        V (list[int]): 頂点の osmid のリスト
+        workers (int, optional): プロセス数、省略時は CPU 数 (1 ならば同じプロセスで計算)
+        stats (SolverStats, optional): 各プロセスで数えたヒープ操作と弧の緩和の回数を合計する計測
+        cache (MatrixCache, optional): グラフのハッシュ値ごとに距離行列を保存するキャッシュ
+    Returns:
+        dist_matrix (np.ndarray): dist_matrix[i][j] は V[i] から V[j] までの最短経路のコスト
+        sp_matrix (PathMatrix): sp_matrix[i][j] で V[i] から V[j] までの最短経路 (osmid のリスト) を復元
+    """
+    osmids, offsets, targets, costs = search_arrays(N)
+    stops = _stop_indices(N, osmids, V)
+    graph = (offsets, targets, costs)
+    n = len(V)
+    workers = min(os.cpu_count() or 1, n) if workers is None else workers
+
+    if cache is None:
+        results = _run_rows(graph, stops, stops, workers, stats)
+        dist_matrix = np.array([row for row, _ in results], dtype=np.float64).reshape(n, n)
+        trees = [tree for _, tree in results]
+    else:
+        fingerprint = matrix_fingerprint(N)
+        dist_matrix = cache.lookup(fingerprint, V)
+        missing = np.isnan(dist_matrix)
+        trees = [None] * n
+        hits = int(n * n - missing.sum())
+        # 保存されていない頂点の行は順方向に探索する
+        rows = np.flatnonzero(missing.all(axis=1)).tolist() if n else []
+        missing[rows] = False
+        cols = np.flatnonzero(missing.any(axis=0)).tolist()
+        sources = np.flatnonzero(missing.any(axis=1)).tolist()
+        if len(cols) >= len(sources):
+            # 列の探索の方が多くなる場合は残りも行として探索する
+            rows += sources
+            cols, sources = [], []
+        if rows:
+            for i, (row, tree) in zip(rows, _run_rows(graph, [stops[i] for i in rows], stops, workers, stats)):
+                dist_matrix[i] = row
+                trees[i] = tree
+        if cols:
+            # 逆向きのグラフで新しい頂点から探索すると、保存済みの頂点から新しい頂点へのコストの列が求まる
+            reverse = _reverse_arrays(offsets, targets, costs)
+            results = _run_rows(reverse, [stops[j] for j in cols], [stops[i] for i in sources], workers, stats)
+            for j, (column, _) in zip(cols, results):
+                dist_matrix[sources, j] = column
+        if stats is not None:
+            stats.count('matrix_cache.hits', hits)
+            stats.count('matrix_cache.rows', len(rows))
+            stats.count('matrix_cache.columns', len(cols))
+        if rows or cols:
+            cache.store(fingerprint, V, dist_matrix)
+        else:
+            cache.touch(fingerprint, V)
+
+    # 縮約したグラフでは経路を復元するときに展開する
+    pruned = N.graph if N.graph is not None and N.graph.via_offsets is not None else None
+    sp_matrix = PathMatrix(osmids, trees, pruned, graph, stops)
+    return dist_matrix, sp_matrix
+
+def repair_dist_matrix(N, V: list[int], dist_matrix: np.ndarray, sp_matrix: PathMatrix,
+                       applied: list[tuple[int, int, float, float]], eps: float = 1e-9) -> list[int]:
+    """ 弧のコストの変更の影響を受ける行だけを探索し直し、距離行列と最短経路行列をその場で更新 \n
+    コストが増えた弧は、その弧を最短経路木に含む始点の行だけが変わりうる。
+    コストが減った弧 (u, v) は、各始点から u までと v から各終点までの 2 回の探索で、
+    その弧を通ると短くなる組がある始点の行だけが変わりうる。
+    Args:
+        N (Network): 変更を反映済みの道路ネットワーク
+        V (list[int]): 頂点の osmid のリスト
+        dist_matrix (np.ndarray): build_dist_matrix で求めた距離行列
+        sp_matrix (PathMatrix): build_dist_matrix で求めた最短経路行列
+        applied (list[tuple[int, int, float, float]]): 変更した弧の (u, v, 変更前のコスト, 変更後のコスト)
+        eps (float, optional): 短くなったとみなすコストの減少量の下限
+    Returns:
+        rows (list[int]): 探索し直した行の添字
+    """
+    osmids, offsets, targets, costs = search_arrays(N)
+    stops = _stop_indices(N, osmids, V)
+    lookup = N.graph.index if N.graph is not None else {osmid: i for i, osmid in enumerate(osmids.tolist())}
+    rows = set()
+
+    increased = [(lookup[u], lookup[v]) for u, v, old, new in applied if new > old]
+    if increased:
+        n = len(osmids)
+        codes = np.array([u * n + v for u, v in increased], dtype=np.int64)
+        for i, tree in enumerate(sp_matrix.trees):
+            if tree is None:
+                # 最短経路木を持たない行は弧を含むか判定できないため探索し直す
+                rows.add(i)
+                continue
+            nodes, parents, _ = tree
+            child = np.flatnonzero(parents >= 0)
+            if np.isin(nodes[parents[child]] * n + nodes[child], codes).any():
+                rows.add(i)
+
+    decreased = [(lookup[u], lookup[v], new) for u, v, old, new in applied if new < old]
+    if decreased:
+        reverse = _reverse_arrays(offsets, targets, costs)
+        for u, v, new in decreased:
+            to_u, _ = one_to_many(u, stops, graph=reverse)
+            from_v, _ = one_to_many(v, stops, graph=(offsets, targets, costs))
+            candidate = np.add.outer(np.array(to_u) + new, np.array(from_v))
+            rows.update(np.flatnonzero((candidate < dist_matrix - eps).any(axis=1)).tolist())
+
+    # 最短経路木を持たない行の経路は変更後のグラフで探索する
+    sp_matrix.search = (offsets, targets, costs)
+    rows = sorted(rows)
+    if rows:
+        results, _ = _solve_rows(([stops[i] for i in rows], stops, False), (offsets, targets, costs))
+        for i, (row, tree) in zip(rows, results):
+            dist_matrix[i] = row
+            sp_matrix.trees[i] = tree
+    return rows
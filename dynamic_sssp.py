@@ -0,0 +1,132 @@
+import heapq
+import numpy as np
+from collections.abc import Callable, Iterable
+
+INF = float('inf')
+
+
+class DictTree:
+    """ 終点の osmid をキーとする辞書で表した最短経路木を、修復のために読み書きするクラス """
+    def __init__(self, cost: dict, prev: dict) -> None:
+        self.cost = cost
+        self.prev = prev
+
+    def dist(self, x) -> float:
+        return self.cost.get(x, INF)
+
+    def parent(self, x):
+        return self.prev.get(x)
+
+    def assign(self, x, d: float, p) -> None:
+        self.cost[x] = d
+        self.prev[x] = p
+
+    def unreach(self, x) -> None:
+        self.cost.pop(x, None)
+        self.prev.pop(x, None)
+
+    def subtree(self, roots: list) -> list:
+        """ roots を根とする部分木の頂点を全て返す (roots を含む) """
+        children: dict = {}
+        for x, p in self.prev.items():
+            children.setdefault(p, []).append(x)
+        seen = set(roots)
+        stack = list(roots)
+        while stack:
+            for y in children.get(stack.pop(), ()):
+                if y not in seen:
+                    seen.add(y)
+                    stack.append(y)
+        return list(seen)
+
+
+class ArrayTree:
+    """ 頂点の添字で並んだ配列で表した最短経路木を、修復のために読み書きするクラス (到達不能はコスト inf、直前の頂点 -1) """
+    def __init__(self, cost: np.ndarray, prev: np.ndarray) -> None:
+        self.cost = cost
+        self.prev = prev
+
+    def dist(self, x: int) -> float:
+        return float(self.cost[x])
+
+    def parent(self, x: int) -> int | None:
+        return int(self.prev[x]) if self.cost[x] != INF else None
+
+    def assign(self, x: int, d: float, p: int) -> None:
+        self.cost[x] = d
+        self.prev[x] = p
+
+    def unreach(self, x: int) -> None:
+        self.cost[x] = INF
+        self.prev[x] = -1
+
+    def subtree(self, roots: list[int]) -> list[int]:
+        """ roots を根とする部分木の頂点を、直前の頂点の配列から作った子の CSR 形式を幅優先にたどって返す """
+        parents = np.asarray(self.prev)
+        has_parent = np.flatnonzero(parents >= 0)
+        order = has_parent[np.argsort(parents[has_parent], kind='stable')]
+        ptr = np.zeros(len(parents) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parents[has_parent], minlength=len(parents)), out=ptr[1:])
+        marked = np.zeros(len(parents), dtype=bool)
+        frontier = np.unique(np.asarray(roots, dtype=np.int64))
+        while len(frontier):
+            marked[frontier] = True
+            lens = ptr[frontier + 1] - ptr[frontier]
+            if lens.sum() == 0:
+                break
+            # 各頂点の子の区間 [ptr[f], ptr[f+1]) をまとめて連結
+            starts = np.repeat(ptr[frontier] - np.concatenate(([0], np.cumsum(lens)[:-1])), lens)
+            kids = order[starts + np.arange(lens.sum())]
+            frontier = kids[~marked[kids]]
+        return np.flatnonzero(marked).tolist()
+
+
+def repair_tree(tree: DictTree | ArrayTree, changes: Iterable[tuple], in_arcs: Callable, out_arcs: Callable) -> int:
+    """ 弧のコストが変わった後の最短経路木を、影響を受ける頂点だけ探索し直して修復する \n
+    コストが増えた弧が木の辺であれば、その先の部分木の頂点を未確定に戻し、部分木の外からの弧で仮のコストを与える。
+    コストが減った弧は、その弧を通ると短くなる場合に終点のコストを更新する。
+    その後、更新した頂点からダイクストラ法と同様に改善を伝播させる。
+    Args:
+        tree (DictTree | ArrayTree): 修復する最短経路木 (その場で書き換える)
+        changes (Iterable[tuple]): (始点, 終点, 変更前のコスト, 変更後のコスト) の列、グラフには反映済みとする
+        in_arcs (Callable): 頂点 x を受け取り、x に入る弧の (始点, コスト) の列を返す関数
+        out_arcs (Callable): 頂点 x を受け取り、x から出る弧の (終点, コスト) の列を返す関数
+    Returns:
+        updated (int): コストもしくは直前の頂点を更新した回数 (修復の手間の目安)
+    """
+    changes = list(changes)
+    roots = [v for u, v, old, new in changes if new > old and tree.dist(v) != INF and tree.parent(v) == u]
+    q = []
+    updated = 0
+    if roots:
+        affected = tree.subtree(roots)
+        for x in affected:
+            tree.unreach(x)
+        for x in affected:
+            best, via = INF, None
+            for w, c in in_arcs(x):
+                d = tree.dist(w) + c
+                if d < best:
+                    best, via = d, w
+            if via is not None:
+                tree.assign(x, best, via)
+                q.append((best, x))
+        updated += len(affected)
+    for u, v, old, new in changes:
+        if new < old:
+            d = tree.dist(u) + new
+            if d < tree.dist(v):
+                tree.assign(v, d, u)
+                q.append((d, v))
+                updated += 1
+    heapq.heapify(q)
+    while q:
+        d, x = heapq.heappop(q)
+        if tree.dist(x) < d:
+            continue
+        for y, c in out_arcs(x):
+            if d + c < tree.dist(y):
+                tree.assign(y, d + c, x)
+                heapq.heappush(q, (d + c, y))
+                updated += 1
+    return updated
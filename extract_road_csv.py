@@ -2,6 +2,107 @@ import pandas as pd
 import numpy as np
 import constant as c
 
+DEFAULT_MAXSPEED = 40       # 最高速度が不明な辺に仮定する最高速度 [km/h]
+CHUNK_ROWS = 500_000        # csv を分割して読み込む際の 1 回あたりの行数
+# 型が決まっている列は明示し、osmid, oneway, reversed, maxspeed はまとめられた辺のリスト文字列を含みうるため推定に任せる
+NODE_DTYPES = {'osmid': np.int64, 'y': np.float64, 'x': np.float64, 'highway': object}
+EDGE_DTYPES = {'u': np.int64, 'v': np.int64, 'length': np.float64}
+EDGE_COLUMNS = ['u', 'v', 'osmid', 'oneway', 'reversed', 'length', 'maxspeed']
+
+def parse_maxspeed(values: pd.Series) -> np.ndarray:
+    """ 最高速度の列を数値に変換 \n
+    数値はそのまま、"['40', '50']" のようなリスト文字列は含まれる数値の平均、不明な値は DEFAULT_MAXSPEED とする。
+    Args:
+        values (pd.Series): maxspeed 列
+    Returns:
+        maxspeed (np.ndarray): 最高速度 [km/h]
+    """
+    speed = pd.to_numeric(values, errors='coerce')
+    rest = speed.isna() & values.notna()
+    if rest.any():
+        numbers = values[rest].astype(str).str.extractall(r'(\d+(?:\.\d+)?)')[0].astype(np.float64)
+        speed[rest] = numbers.groupby(level=0).mean()
+    return speed.fillna(DEFAULT_MAXSPEED).to_numpy(dtype=np.float64)
+
+def parse_bool(values: pd.Series) -> np.ndarray:
+    """ oneway や reversed の列を真偽値に変換 \n
+    "[False, True]" のようなリスト文字列は先頭の値を用い、欠損値は偽とする。
+    Args:
+        values (pd.Series): 真偽値もしくはその文字列の列
+    Returns:
+        flags (np.ndarray): 真偽値の配列
+    """
+    if values.dtype == bool:
+        return values.to_numpy()
+    first = values.astype(str).str.lstrip('[ ').str.split(',').str[0].str.strip().str.lower()
+    return first.isin(('true', '1', 'yes')).to_numpy()
+
+def parse_osmid(values: pd.Series) -> np.ndarray:
+    """ 辺の osmid の列を配列に変換 \n
+    全て整数ならば int64 の配列、リスト文字列を含む場合は整数と文字列が混在する object の配列を返す。
+    Args:
+        values (pd.Series): osmid 列
+    Returns:
+        osmids (np.ndarray): 辺の osmid
+    """
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notna().all():
+        return numbers.to_numpy(dtype=np.int64)
+    return np.where(numbers.notna(), numbers.astype('Int64').astype(object), values.astype(str)).astype(object)
+
+def _edge_chunks(edge_csv_file: str, chunksize: int = CHUNK_ROWS):
+    """ 辺の csv ファイルの必要な列だけを型を指定して分割して読み込み、列を変換した辞書を順に返す """
+    for df in pd.read_csv(edge_csv_file, usecols=EDGE_COLUMNS, dtype=EDGE_DTYPES, chunksize=chunksize):
+        yield {
+            'u': df['u'].to_numpy(),
+            'v': df['v'].to_numpy(),
+            'osmid': parse_osmid(df['osmid']),
+            'oneway': parse_bool(df['oneway']),
+            'reversed': parse_bool(df['reversed']),
+            'length': df['length'].to_numpy(),
+            'maxspeed': parse_maxspeed(df['maxspeed']),
+        }
+
+def read_node_arrays(node_csv_file: str, chunksize: int = CHUNK_ROWS) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ 頂点の csv ファイルを分割して読み込み、CSRGraph.from_arrays に渡す配列を返す  \n
+    Args:
+        node_csv_file (str): 頂点に関する情報を持つ csv ファイルの path
+        chunksize (int, optional): 1 回に読み込む行数
+    Returns:
+        osmid (np.ndarray): 頂点の osmid
+        x (np.ndarray): 頂点の経度
+        y (np.ndarray): 頂点の緯度
+        is_signal (np.ndarray): 交通信号機の頂点ならば真
+    """
+    chunks = [(df['osmid'].to_numpy(), df['x'].to_numpy(), df['y'].to_numpy(), (df['highway'] == 'traffic_signals').to_numpy())
+              for df in pd.read_csv(node_csv_file, usecols=list(NODE_DTYPES), dtype=NODE_DTYPES, chunksize=chunksize)]
+    if not chunks:
+        # ヘッダのみの csv ファイルでは分割した塊が無いため、型を揃えた空の配列を返す
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64),
+                np.zeros(0, dtype=bool))
+    return tuple(np.concatenate(column) for column in zip(*chunks))
+
+def read_edge_arrays(edge_csv_file: str, chunksize: int = CHUNK_ROWS) -> tuple[np.ndarray, ...]:
+    """ 辺の csv ファイルを分割して読み込み、コストを計算して CSRGraph.from_arrays に渡す配列を返す  \n
+    Args:
+        edge_csv_file (str): 辺に関する情報を持つ csv ファイルの path
+        chunksize (int, optional): 1 回に読み込む行数
+    Returns:
+        u (np.ndarray): 頂点 u の osmid
+        v (np.ndarray): 頂点 v の osmid
+        osmid (np.ndarray): 辺 (u, v) の osmid
+        cost (np.ndarray): 辺 (u, v) を移動するためにかかる時間 [min]
+        oneway (np.ndarray): 一方通行ならば真
+        reversed (np.ndarray): 終点から始点への一方通行ならば真
+    """
+    chunks = [(e['u'], e['v'], e['osmid'], (e['length'] / 1000) / (e['maxspeed'] / 60), e['oneway'], e['reversed'])
+              for e in _edge_chunks(edge_csv_file, chunksize)]
+    if not chunks:
+        # ヘッダのみの csv ファイルでは分割した塊が無いため、型を揃えた空の配列を返す
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.float64), np.zeros(0, dtype=bool), np.zeros(0, dtype=bool))
+    return tuple(np.concatenate(column) for column in zip(*chunks))
+
 def extract_node_datas(node_csv_file: str) -> list[dict]:
     """  頂点の情報を持つ csv ファイルから必要な情報のみを抽出して整形  \n
     Args:
@@ -12,9 +113,8 @@ def extract_node_datas(node_csv_file: str) -> list[dict]:
             'y': ある頂点 v の緯度
             'x': ある頂点 v の経度
     """
-    df = pd.read_csv(node_csv_file)
-    df.replace('nan', np.nan, inplace=True)
-    df['highway'].fillna('', inplace=True)
+    df = pd.read_csv(node_csv_file, usecols=list(NODE_DTYPES), dtype=NODE_DTYPES)
+    df['highway'] = df['highway'].fillna('')
     data = df[['osmid', 'y', 'x', 'highway']].to_dict('records')
     return data
 
@@ -32,10 +132,8 @@ def extract_edge_datas(edge_csv_file: str) -> list[dict]:
             'length': 辺の距離 [m]
             'maxspeed': 最高速度 [km/h]
     """
-    df = pd.read_csv(edge_csv_file)
-    df.replace('nan', np.nan, inplace=True)
-    df['maxspeed'].fillna(40, inplace=True)
-    data = df[['u', 'v', 'osmid', 'oneway', 'reversed', 'length', 'maxspeed']].to_dict('records')
+    df = pd.concat([pd.DataFrame(chunk) for chunk in _edge_chunks(edge_csv_file)], ignore_index=True)
+    data = df[EDGE_COLUMNS].to_dict('records')
     return data
 
 if __name__ == '__main__':
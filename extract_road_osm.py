@@ -1,7 +1,7 @@
-import osmnx as ox
+import sys
 import pandas as pd
-from geopy.distance import geodesic
 import constant as c
+from osm_import import clip_circle, import_osm_to_csv
 
 def extract_nodes_edges():
     """ osm から 2 つの地点 u, v の中心点を中心とする半径を持つ円内の道路ネットワークを取得し csv 形式で出力  \n
@@ -31,6 +31,8 @@ def extract_nodes_edges():
             highway:      Node に接続されている道路のタイプ  #! 使用する
             geometry:     Node の位置を示すオブジェクト 
     """
+    import osmnx as ox
+    from geopy.distance import geodesic
 
     # (u, v) を指定
     u = c.Spot.Coordinate.kgu
@@ -56,6 +58,19 @@ def extract_nodes_edges():
     # 道路ネットワークを可視化
     ox.plot_graph(G)
 
+def extract_nodes_edges_from_file(osm_file: str, snapshot: bool = True) -> None:
+    """ ダウンロードせずにローカルの osm ファイル (.osm, .osm.gz, .pbf) から extract_nodes_edges と同じ範囲の道路ネットワークを抽出し csv 形式で出力  \n
+    Args:
+        osm_file (str): osm ファイルの path
+        snapshot (bool, optional): 真ならば core='snapshot' で読み込むためのスナップショットも作成
+    """
+    center, radius = clip_circle(c.Spot.Coordinate.kgu, c.Spot.Coordinate.uddhichuo, c.MarginDist.get_road_network_radius)
+    n, m = import_osm_to_csv(osm_file, c.Path.node_csv, c.Path.edge_csv, center, radius, snapshot)
+    print(f'{n} nodes, {m} edges')
+
 if __name__ == "__main__":
-    extract_nodes_edges()
+    if len(sys.argv) > 1:
+        extract_nodes_edges_from_file(sys.argv[1])
+    else:
+        extract_nodes_edges()
     print(c.FontColor.YELLOW + 'Program ran successfully' + c.FontColor.END)
@@ -0,0 +1,191 @@
+import numpy as np
+from csr_graph import CSRGraph, encode_edge_osmids
+
+
+def graph_from_network(N) -> CSRGraph:
+    """ 道路ネットワークを CSR 形式のグラフで返す、辞書で保持している場合は変換する \n
+    Args:
+        N (Network): 道路ネットワーク
+    Returns:
+        graph (CSRGraph): N.graph もしくは N.nodes と N.edges から作ったグラフ
+    """
+    if N.graph is not None:
+        return N.graph
+    osmids = np.array(sorted(set(N.nodes) | set(N.edges)), dtype=np.int64)
+    nodes = [N.nodes.get(osmid, {}) for osmid in osmids.tolist()]
+    x = np.array([node.get('x', np.nan) for node in nodes], dtype=np.float64)
+    y = np.array([node.get('y', np.nan) for node in nodes], dtype=np.float64)
+    is_signal = np.array([node.get('highway') == 'traffic_signals' for node in nodes], dtype=bool)
+    index = {osmid: i for i, osmid in enumerate(osmids.tolist())}
+    arcs = sorted((index[u], index[v], edge['cost'], edge['osmid']) for u, adjacent in N.edges.items()
+                  for v, edge in adjacent.items())
+    src = np.array([a[0] for a in arcs], dtype=np.int64)
+    offsets = np.zeros(len(osmids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(osmids)), out=offsets[1:])
+    edge_osmids, names = encode_edge_osmids(np.array([a[3] for a in arcs], dtype=object))
+    return CSRGraph(osmids, x, y, is_signal, offsets, np.array([a[1] for a in arcs], dtype=np.int64),
+                    np.array([a[2] for a in arcs], dtype=np.float64), edge_osmids, edge_osmid_names=names)
+
+def reachable(offsets: np.ndarray, targets: np.ndarray, seeds) -> np.ndarray:
+    """ seeds から弧をたどって到達できる頂点を、前線をまとめて広げる幅優先探索で求める \n
+    Args:
+        offsets (np.ndarray): 頂点 i から出る弧は targets[offsets[i]:offsets[i+1]] に格納
+        targets (np.ndarray): 各弧の終点の添字
+        seeds (array_like): 探索を始める頂点の添字
+    Returns:
+        seen (np.ndarray): 到達できる頂点ならば真 (seeds を含む)
+    """
+    seen = np.zeros(len(offsets) - 1, dtype=bool)
+    frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+    seen[frontier] = True
+    while len(frontier):
+        lens = offsets[frontier + 1] - offsets[frontier]
+        total = int(lens.sum())
+        if total == 0:
+            break
+        # 各頂点の弧の区間 [offsets[f], offsets[f+1]) をまとめて連結
+        starts = np.repeat(offsets[frontier] - np.concatenate(([0], np.cumsum(lens)[:-1])), lens)
+        nxt = np.unique(targets[starts + np.arange(total)])
+        frontier = nxt[~seen[nxt]]
+        seen[frontier] = True
+    return seen
+
+def _csr(n: int, src: np.ndarray, dst: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ 弧の始点と終点の配列から CSR 形式の offsets と targets を作る """
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+    return offsets, dst[order]
+
+def strongly_connected(n: int, src: np.ndarray, dst: np.ndarray, seeds) -> np.ndarray:
+    """ seeds のいずれかと同じ強連結成分に属する頂点を求める \n
+    頂点 s の強連結成分は、s から到達できる頂点と s へ到達できる頂点の共通部分として求める。
+    Args:
+        n (int): 頂点数
+        src (np.ndarray): 各弧の始点の添字
+        dst (np.ndarray): 各弧の終点の添字
+        seeds (array_like): 残す強連結成分を指定する頂点の添字
+    Returns:
+        mask (np.ndarray): 残す頂点ならば真
+    """
+    forward = _csr(n, src, dst)
+    backward = _csr(n, dst, src)
+    mask = np.zeros(n, dtype=bool)
+    for s in np.unique(np.asarray(seeds, dtype=np.int64)).tolist():
+        if not mask[s]:
+            mask |= reachable(*forward, [s]) & reachable(*backward, [s])
+    return mask
+
+def _contractible(n: int, src: np.ndarray, dst: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    """ 縮約できる次数 2 の頂点を求める \n
+    入次数と出次数が 1 で入ってくる頂点と出ていく頂点が異なる頂点 (一方通行の途中) と、
+    入次数と出次数が 2 で隣接する 2 頂点との間を両方向に通行できる頂点 (対面通行の途中) を縮約する。
+    """
+    indeg = np.bincount(dst, minlength=n)
+    outdeg = np.bincount(src, minlength=n)
+    candidate = ~keep & (((indeg == 1) & (outdeg == 1)) | ((indeg == 2) & (outdeg == 2)))
+    ins: dict[int, set] = {}
+    outs: dict[int, set] = {}
+    for u, v in zip(src.tolist(), dst.tolist()):
+        if candidate[v]:
+            ins.setdefault(v, set()).add(u)
+        if candidate[u]:
+            outs.setdefault(u, set()).add(v)
+    contractible = np.zeros(n, dtype=bool)
+    for x in np.flatnonzero(candidate).tolist():
+        i, o = ins.get(x, set()), outs.get(x, set())
+        if indeg[x] == 1:
+            contractible[x] = i != o and len(i) == len(o) == 1
+        else:
+            contractible[x] = i == o and len(i) == 2
+    return contractible
+
+def prune_graph(graph: CSRGraph, keep: list[int] | None = None) -> tuple[CSRGraph, dict]:
+    """ 探索に不要な弧と頂点を取り除き、次数 2 の頂点の連なりを 1 本の弧に縮約したグラフを返す \n
+    1. コストが inf の弧 (一方通行の逆走方向) と自己ループを取り除く
+    2. keep を指定した場合は、keep のいずれかと同じ強連結成分に属する頂点だけを残す
+    3. keep 以外の次数 2 の頂点の連なりを 1 本の弧に縮約する (コストは合計し、経由する頂点を記録する)
+    頂点の添字は元のグラフと同じままとし、取り除いた頂点は弧を持たない頂点として残す。
+    同じ始点と終点の弧が複数できた場合はコストが最小のものだけを残す。
+    Args:
+        graph (CSRGraph): 元のグラフ
+        keep (list[int], optional): 縮約せずに残す頂点 (巡回路の頂点など) の osmid
+    Returns:
+        pruned (CSRGraph): 縮約したグラフ、via_offsets, via_nodes 及び active を設定する
+        summary (dict): 'nodes', 'arcs' (元の数), 'active_nodes', 'pruned_arcs' (縮約後の数), 'contracted_nodes'
+    """
+    n = graph.n
+    src = np.repeat(np.arange(n, dtype=np.int64), np.diff(graph.offsets))
+    dst = np.asarray(graph.targets, dtype=np.int64)
+    costs = np.asarray(graph.costs, dtype=np.float64)
+    edge_osmids = np.asarray(graph.edge_osmids)
+    usable = np.isfinite(costs) & (src != dst)
+    keep_index = np.zeros(0, dtype=np.int64) if keep is None else graph.index.lookup(list(keep))
+    if np.any(keep_index < 0):
+        raise KeyError('keep にグラフに存在しない osmid が含まれています')
+    if keep is not None:
+        component = strongly_connected(n, src[usable], dst[usable], keep_index)
+        usable &= component[src] & component[dst]
+    src, dst, costs, edge_osmids = src[usable], dst[usable], costs[usable], edge_osmids[usable]
+
+    keep_mask = np.zeros(n, dtype=bool)
+    keep_mask[keep_index] = True
+    contractible = _contractible(n, src, dst, keep_mask)
+    offsets, order = np.zeros(n + 1, dtype=np.int64), np.argsort(src, kind='stable')
+    np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+    out_targets, out_costs = dst[order].tolist(), costs[order].tolist()
+    out_osmids = edge_osmids[order]
+    starts = offsets.tolist()
+    flags = contractible.tolist()
+
+    # 縮約しない頂点から出る弧ごとに、縮約する頂点をたどって次の縮約しない頂点までを 1 本の弧にする
+    new_src, new_dst, new_cost, new_osmid, via_lens, via_nodes = [], [], [], [], [], []
+    for u in np.flatnonzero(~contractible & (np.diff(offsets) > 0)).tolist():
+        for k in range(starts[u], starts[u + 1]):
+            prev, v, cost, via = u, out_targets[k], out_costs[k], []
+            while flags[v]:
+                via.append(v)
+                a, b = starts[v], starts[v + 1]
+                # 対面通行の途中の頂点では来た頂点へ戻る弧を除く
+                j = a if b - a == 1 or out_targets[a] != prev else a + 1
+                prev, v, cost = v, out_targets[j], cost + out_costs[j]
+            if v == u:
+                continue
+            new_src.append(u)
+            new_dst.append(v)
+            new_cost.append(cost)
+            new_osmid.append(k)
+            via_lens.append(len(via))
+            via_nodes.extend(via)
+
+    new_src = np.array(new_src, dtype=np.int64)
+    new_dst = np.array(new_dst, dtype=np.int64)
+    new_cost = np.array(new_cost, dtype=np.float64)
+    via_lens = np.array(via_lens, dtype=np.int64)
+    via_offsets = np.zeros(len(via_lens) + 1, dtype=np.int64)
+    np.cumsum(via_lens, out=via_offsets[1:])
+    via_nodes = np.array(via_nodes, dtype=np.int64)
+
+    # 始点と終点が同じ弧はコストが最小のものだけを残し、始点の順に並べる
+    first = np.lexsort((new_cost, new_dst, new_src))
+    key = new_src[first] * n + new_dst[first]
+    first = first[np.concatenate(([True], key[1:] != key[:-1]))] if len(first) else first
+    pruned_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(new_src[first], minlength=n), out=pruned_offsets[1:])
+    lens = via_lens[first]
+    pruned_via_offsets = np.zeros(len(first) + 1, dtype=np.int64)
+    np.cumsum(lens, out=pruned_via_offsets[1:])
+    gather = np.repeat(via_offsets[first] - pruned_via_offsets[:-1], lens) + np.arange(int(lens.sum()))
+
+    pruned = CSRGraph(graph.osmids, graph.x, graph.y, graph.is_signal, pruned_offsets, new_dst[first], new_cost[first],
+                      out_osmids[np.array(new_osmid, dtype=np.int64)[first]], graph.index.order, graph.index.sorted_osmids,
+                      graph.edge_osmid_names)
+    pruned.via_offsets = pruned_via_offsets
+    pruned.via_nodes = via_nodes[gather]
+    pruned.active = np.zeros(n, dtype=bool)
+    pruned.active[new_src[first]] = True
+    pruned.active[new_dst[first]] = True
+    pruned.active[keep_index] = True
+    summary = {'nodes': n, 'arcs': graph.m, 'active_nodes': int(pruned.active.sum()), 'pruned_arcs': pruned.m,
+               'contracted_nodes': int(contractible.sum())}
+    return pruned, summary
@@ -0,0 +1,123 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import extract_road_csv as edc
+import constant as c
+from csr_graph import CSRGraph
+
+SNAPSHOT_VERSION = 3
+ARRAY_NAMES = ('osmids', 'order', 'sorted_osmids', 'x', 'y', 'is_signal', 'offsets', 'targets', 'costs', 'edge_osmids', 'edge_osmid_names')
+
+def default_snapshot_dir(edge_csv_file: str) -> str:
+    """ 辺の csv ファイルに対応するスナップショットの既定の保存先を返す \n
+    Args:
+        edge_csv_file (str): 辺に関する情報を格納した csv ファイルの path
+    Returns:
+        snapshot_dir (str): スナップショットを保存するディレクトリの path
+    """
+    return os.path.splitext(edge_csv_file)[0] + '.snapshot'
+
+def _source_stat(path: str) -> dict:
+    """ csv ファイルが変更されたかを判定するための情報を返す """
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def _file_digest(h, path: str) -> None:
+    """ ファイルの内容をハッシュに追加 """
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+def read_meta(snapshot_dir: str) -> dict | None:
+    """ スナップショットのメタ情報を読み込む \n
+    Args:
+        snapshot_dir (str): スナップショットを保存したディレクトリの path
+    Returns:
+        meta (dict | None): メタ情報、存在しないか壊れている場合は None
+    """
+    try:
+        with open(os.path.join(snapshot_dir, 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_fresh(node_csv_file: str, edge_csv_file: str, snapshot_dir: str) -> bool:
+    """ スナップショットが最新の csv ファイルから作られたものかを判定 \n
+    Args:
+        node_csv_file (str): 頂点に関する情報を格納した csv ファイルの path
+        edge_csv_file (str): 辺に関する情報を格納した csv ファイルの path
+        snapshot_dir (str): スナップショットを保存したディレクトリの path
+    Returns:
+        bool: バージョンと元の csv ファイルのサイズ・更新時刻が一致すれば真
+    """
+    meta = read_meta(snapshot_dir)
+    if meta is None or meta.get('version') != SNAPSHOT_VERSION:
+        return False
+    sources = meta.get('sources', {})
+    return sources.get('node_csv') == _source_stat(node_csv_file) and sources.get('edge_csv') == _source_stat(edge_csv_file)
+
+def compile_snapshot(node_csv_file: str, edge_csv_file: str, snapshot_dir: str = None) -> str:
+    """ 頂点・辺の csv ファイルを、辺のコストを計算済みの CSR 形式の .npy ファイル群に変換して保存 \n
+    Args:
+        node_csv_file (str): 頂点に関する情報を格納した csv ファイルの path
+        edge_csv_file (str): 辺に関する情報を格納した csv ファイルの path
+        snapshot_dir (str, optional): 保存先のディレクトリの path、省略時は辺の csv ファイルの隣
+    Returns:
+        snapshot_dir (str): スナップショットを保存したディレクトリの path
+    """
+    if snapshot_dir is None:
+        snapshot_dir = default_snapshot_dir(edge_csv_file)
+    sources = {'node_csv': _source_stat(node_csv_file), 'edge_csv': _source_stat(edge_csv_file)}
+    h = hashlib.sha256()
+    _file_digest(h, node_csv_file)
+    _file_digest(h, edge_csv_file)
+    graph = CSRGraph.from_arrays(*edc.read_node_arrays(node_csv_file), *edc.read_edge_arrays(edge_csv_file))
+    arrays = {name: getattr(graph, name) for name in ARRAY_NAMES if name not in ('order', 'sorted_osmids', 'edge_osmid_names')}
+    # osmid から添字への二分探索に用いる配列も保存し、読み込むたびにソートし直さない
+    arrays['order'] = graph.index.order
+    arrays['sorted_osmids'] = graph.index.sorted_osmids
+    # 辺の osmid は int64 のまま、複数の osmid がまとめられた辺の文字列の表は別に保存する (pickle を使わずに memmap できるようにする)
+    names = graph.edge_osmid_names
+    arrays['edge_osmid_names'] = np.zeros(0, dtype=str) if names is None else names
+
+    # 一時ディレクトリに書き出してから置き換え、読み込み中に中途半端な状態が見えないようにする
+    tmp_dir = snapshot_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(array))
+    meta = {'version': SNAPSHOT_VERSION, 'sources': sources, 'fingerprint': h.hexdigest(), 'n': graph.n, 'm': graph.m}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(tmp_dir, snapshot_dir)
+    return snapshot_dir
+
+def load_snapshot(node_csv_file: str, edge_csv_file: str, snapshot_dir: str = None, rebuild: bool = True) -> CSRGraph:
+    """ スナップショットをメモリマップで開き、コピーせずに CSR グラフとして返す \n
+    Args:
+        node_csv_file (str): 頂点に関する情報を格納した csv ファイルの path
+        edge_csv_file (str): 辺に関する情報を格納した csv ファイルの path
+        snapshot_dir (str, optional): スナップショットを保存したディレクトリの path、省略時は辺の csv ファイルの隣
+        rebuild (bool, optional): 真ならばスナップショットが存在しないか古い場合に作り直す
+    Returns:
+        graph (CSRGraph): 読み込んだグラフ (各配列は読み取り専用の memmap)
+    """
+    if snapshot_dir is None:
+        snapshot_dir = default_snapshot_dir(edge_csv_file)
+    if not is_fresh(node_csv_file, edge_csv_file, snapshot_dir):
+        if not rebuild:
+            raise FileNotFoundError(f'snapshot at {snapshot_dir} is missing or out of date')
+        compile_snapshot(node_csv_file, edge_csv_file, snapshot_dir)
+    arrays = {name: np.load(os.path.join(snapshot_dir, f'{name}.npy'), mmap_mode='r') for name in ARRAY_NAMES}
+    order, sorted_osmids, names = arrays.pop('order'), arrays.pop('sorted_osmids'), arrays.pop('edge_osmid_names')
+    graph = CSRGraph(**arrays, order=order, sorted_osmids=sorted_osmids, edge_osmid_names=names if len(names) else None)
+    graph.fingerprint = read_meta(snapshot_dir)['fingerprint']
+    return graph
+
+if __name__ == '__main__':
+    out = compile_snapshot(c.Path.node_csv, c.Path.edge_csv)
+    print(out)
+    print(c.FontColor.YELLOW + 'Program ran successfully' + c.FontColor.END)
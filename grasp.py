@@ -0,0 +1,75 @@
+import os
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from local_search import LocalSearch
+
+_shared: tuple | None = None   # ワーカープロセスが共有する読み取り専用の距離行列と探索の設定
+
+def generate_grasp_initial_tour(dist_matrix: np.ndarray, rng: np.random.Generator, rcl_size: int = 3) -> list[int]:
+    """ 直前の頂点から近い rcl_size 個の頂点のうち 1 つを無作為に選んでつなぐ、乱択最近傍法で初期巡回路を求める \n
+    Args:
+        dist_matrix (np.ndarray): 頂点間の距離行列
+        rng (np.random.Generator): 乱数生成器
+        rcl_size (int, optional): 候補リスト (restricted candidate list) の大きさ
+    Returns:
+        tour (list[int]): 頂点の添字を要素とした巡回路、始点と終点は同じ頂点
+    """
+    n = len(dist_matrix)
+    visited = np.zeros(n, dtype=bool)
+    tour = [int(rng.integers(n))]
+    visited[tour[0]] = True
+    for _ in range(n - 1):
+        d = np.where(visited, np.inf, dist_matrix[tour[-1]])
+        k = min(rcl_size, n - len(tour))
+        candidates = np.argpartition(d, k - 1)[:k]
+        next_city = int(rng.choice(candidates))
+        tour.append(next_city)
+        visited[next_city] = True
+    tour.append(tour[0])
+    return tour
+
+def _init_worker(shared: tuple) -> None:
+    """ ワーカープロセスで共有する距離行列と探索の設定を設定 """
+    global _shared
+    _shared = shared
+
+def _run_starts(starts: list[int]) -> tuple[float, int, list[int]]:
+    """ 複数の試行をワーカープロセスで処理し、その中で最良の (コスト, 試行番号, 巡回路) を返す """
+    dist_matrix, neighbors, seed, rcl_size, neighborhoods = _shared
+    best = (float('inf'), -1, [])
+    for start in starts:
+        rng = np.random.default_rng((seed, start))
+        ls = LocalSearch(dist_matrix, generate_grasp_initial_tour(dist_matrix, rng, rcl_size), neighbors)
+        tour = ls.vnd(neighborhoods)
+        best = min(best, (ls.tour_cost(), start, tour))
+    return best
+
+def multi_start(dist_matrix: np.ndarray, neighbors: np.ndarray, iterations: int = 100, workers: int = None, seed: int = 0,
+                rcl_size: int = 3, neighborhoods: tuple[str, ...] = ('2opt',)) -> tuple[list[int], float]:
+    """ 乱択の初期巡回路からの局所探索を複数プロセスで並列に繰り返す GRASP \n
+    試行 i の乱数は (seed, i) から作るため、結果はプロセス数によらず再現できる。
+    Args:
+        dist_matrix (np.ndarray): 頂点間の距離行列
+        neighbors (np.ndarray): 局所探索に用いる近傍リスト
+        iterations (int, optional): 試行回数
+        workers (int, optional): プロセス数、省略時は CPU 数 (1 ならば同じプロセスで計算)
+        seed (int, optional): 乱数の種
+        rcl_size (int, optional): 初期巡回路を作る際の候補リストの大きさ
+        neighborhoods (tuple[str, ...], optional): 局所探索に用いる近傍、LocalSearch.vnd を参照
+    Returns:
+        tour (list[int]): 全ての試行の中で最良の巡回路
+        cost (float): その巡回路の (到達不能を有限の値に置き換えた) 総コスト
+    """
+    shared = (np.asarray(dist_matrix, dtype=np.float64), neighbors, seed, rcl_size, neighborhoods)
+    workers = min(os.cpu_count() or 1, iterations) if workers is None else workers
+    if workers <= 1:
+        _init_worker(shared)
+        cost, _, tour = _run_starts(list(range(iterations)))
+        return tour, cost
+    # fork が使える場合は距離行列を pickle せずに子プロセスへ引き継ぐ
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    batches = [list(range(w, iterations, workers)) for w in range(workers)]
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(shared,)) as executor:
+        cost, _, tour = min(executor.map(_run_starts, batches))
+    return tour, cost
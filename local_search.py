@@ -0,0 +1,266 @@
+import numpy as np
+from collections import deque
+from solver_stats import SolverStats
+from solve_control import SolveControl
+
+def neighbor_lists(dist_matrix: np.ndarray, k: int) -> np.ndarray:
+    """ 各頂点について、往復の距離が近い順に k 個の頂点を候補として求める \n
+    Args:
+        dist_matrix (np.ndarray): 頂点間の距離行列
+        k (int): 候補の数
+    Returns:
+        neighbors (np.ndarray): neighbors[a] は頂点 a の候補の頂点を近い順に並べた配列
+    """
+    n = len(dist_matrix)
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return np.empty((n, 0), dtype=np.int64)
+    d = np.asarray(dist_matrix, dtype=np.float64)
+    d = d + d.T
+    np.fill_diagonal(d, np.inf)
+    near = np.argpartition(d, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(d, near, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(near, order, axis=1)
+
+
+class LocalSearch:
+    """ 距離行列上の巡回路を、近傍リストと don't-look bit を用いた局所探索で改善するクラス """
+    def __init__(self, dist_matrix, tour: list[int], neighbors: np.ndarray = None, k: int = 10,
+                 stats: SolverStats = None) -> None:
+        """ 局所探索に必要な変数を初期化 \n
+        Args:
+            dist_matrix (array_like): 頂点間の距離行列 (非対称でもよい)
+            tour (list[int]): 頂点の添字を要素とした巡回路、始点と終点は同じ頂点
+            neighbors (np.ndarray, optional): 近傍リスト、省略時は neighbor_lists で求める
+            k (int, optional): neighbors を省略したときの候補の数
+            stats (SolverStats, optional): 評価・適用した近傍の数とパス数を数える計測、省略時は数えない
+        Attributes:
+            n (int): 頂点数
+            cost (np.ndarray): 到達不能 (inf) を巡回路のどの総コストよりも大きい有限の値に置き換えた距離行列
+            tour (np.ndarray): 巡回路、tour[0] と tour[n] は同じ頂点で位置を固定する
+            pos (np.ndarray): pos[a] は頂点 a の巡回路上の位置
+            forward (np.ndarray): forward[k] は巡回路の先頭から位置 k までの順方向のコストの累積和
+            backward (np.ndarray): backward[k] は先頭から位置 k までの辺を逆向きにたどった場合のコストの累積和
+        """
+        d = np.asarray(dist_matrix, dtype=np.float64)
+        finite = np.isfinite(d)
+        big = (np.abs(d[finite]).max() if finite.any() else 1.0) * len(d) + 1.0
+        self.cost: np.ndarray = np.where(finite, d, big)
+        self.n: int = len(d)
+        self.tour: np.ndarray = np.asarray(tour, dtype=np.int64).copy()
+        self.pos: np.ndarray = np.empty(self.n, dtype=np.int64)
+        self.pos[self.tour[:-1]] = np.arange(self.n)
+        self.neighbors: np.ndarray = neighbor_lists(d, k) if neighbors is None else neighbors
+        self.forward: np.ndarray = np.zeros(self.n + 1)
+        self.backward: np.ndarray = np.zeros(self.n + 1)
+        self._update_prefix()
+        self.stats: SolverStats | None = stats if stats is not None and stats.enabled else None
+        if self.stats is not None:
+            # 計測するときだけ評価関数を数える関数で包み、計測しないときの探索には手を加えない
+            self.two_opt_gain = self._counted(self.two_opt_gain, 'local_search.moves_evaluated')
+            self.exchange_gain = self._counted(self.exchange_gain, 'local_search.moves_evaluated')
+
+    def _counted(self, gain, name: str):
+        """ 呼ばれた回数を計測に加算するように関数を包む """
+        counters = self.stats.counters
+
+        def _gain(*args):
+            counters[name] += 1
+            return gain(*args)
+        return _gain
+
+    def _update_prefix(self) -> None:
+        """ 順方向と逆方向のコストの累積和を計算し直す """
+        t = self.tour
+        np.cumsum(self.cost[t[:-1], t[1:]], out=self.forward[1:])
+        np.cumsum(self.cost[t[1:], t[:-1]], out=self.backward[1:])
+
+    def tour_cost(self) -> float:
+        """ 置き換え後の距離行列で巡回路の総コストを返す """
+        return float(self.forward[-1])
+
+    def _reverse(self, i: int, j: int) -> None:
+        """ 巡回路の位置 i から j までの区間をその場で反転 """
+        t = self.tour
+        t[i:j + 1] = t[i:j + 1][::-1].copy()
+        self.pos[t[i:j + 1]] = np.arange(i, j + 1)
+        self._update_prefix()
+
+    def two_opt_gain(self, i: int, j: int) -> float:
+        """ 区間 [i, j] を反転する 2-opt 近傍のコストの変化量を O(1) で求める \n
+        Args:
+            i (int): 反転する区間の先頭の位置
+            j (int): 反転する区間の末尾の位置
+        Returns:
+            delta (float): 反転後の総コストから反転前の総コストを引いた値 (区間内の辺の向きが変わる分を含む)
+        """
+        t, c = self.tour, self.cost
+        a, b, e, f = t[i - 1], t[i], t[j], t[j + 1]
+        inner = (self.backward[j] - self.backward[i]) - (self.forward[j] - self.forward[i])
+        return c[a, e] + c[b, f] - c[a, b] - c[e, f] + inner
+
+    def _try_two_opt(self, a: int, eps: float) -> tuple[int, ...] | None:
+        """ 頂点 a と近傍リストの頂点を結ぶ辺を作る 2-opt 近傍のうち改善するものを適用 \n
+        Returns:
+            touched (tuple[int, ...] | None): 適用した場合は端点が変わった頂点、改善しなければ None
+        """
+        for b in self.neighbors[a]:
+            lo, hi = sorted((int(self.pos[a]), int(self.pos[b])))
+            # 辺 (t[lo], t[hi]) を作る反転は、t[lo] を区間の直前に置く場合と区間の先頭に置く場合の 2 通り
+            for i, j in ((lo + 1, hi), (lo, hi - 1)):
+                if i < 1 or j > self.n - 1 or j <= i:
+                    continue
+                if self.two_opt_gain(i, j) < -eps:
+                    touched = tuple(int(x) for x in self.tour[[i - 1, i, j, j + 1]])
+                    self._reverse(i, j)
+                    return touched
+        return None
+
+    def exchange_gain(self, i: int, j: int, k: int) -> float:
+        """ 隣り合う区間 B = [i+1, j] と C = [j+1, k] を反転せずに入れ替える近傍のコストの変化量を O(1) で求める \n
+        A B C D の順を A C B D とするため、区間内の辺の向きは変わらない。
+        Args:
+            i (int): 区間 B の直前の位置
+            j (int): 区間 B の末尾の位置
+            k (int): 区間 C の末尾の位置
+        Returns:
+            delta (float): 入れ替え後の総コストから入れ替え前の総コストを引いた値
+        """
+        t, c = self.tour, self.cost
+        a, b, e, f, g, h = t[i], t[i + 1], t[j], t[j + 1], t[k], t[k + 1]
+        return c[a, f] + c[g, b] + c[e, h] - c[a, b] - c[e, f] - c[g, h]
+
+    def _exchange(self, i: int, j: int, k: int) -> tuple[int, ...]:
+        """ 区間 [i+1, j] と [j+1, k] をその場で入れ替え、端点が変わった頂点を返す """
+        t = self.tour
+        touched = tuple(int(x) for x in t[[i, i + 1, j, j + 1, k, k + 1]])
+        t[i + 1:k + 1] = np.concatenate((t[j + 1:k + 1], t[i + 1:j + 1]))
+        self.pos[t[i + 1:k + 1]] = np.arange(i + 1, k + 1)
+        self._update_prefix()
+        return touched
+
+    def _valid_exchange(self, i: int, j: int, k: int) -> bool:
+        """ 入れ替える 2 つの区間が空でなく、固定した巡回路の両端を含まないかを判定 """
+        return 0 <= i < j < k <= self.n - 1
+
+    def _try_or_opt(self, a: int, eps: float, max_len: int = 3) -> tuple[int, ...] | None:
+        """ 頂点 a を先頭もしくは末尾とする長さ max_len 以下の区間を、向きを保ったまま近傍リストの頂点の隣へ移す Or-opt 近傍 \n
+        Returns:
+            touched (tuple[int, ...] | None): 適用した場合は端点が変わった頂点、改善しなければ None
+        """
+        p = int(self.pos[a])
+        for length in range(1, max_len + 1):
+            for first in (p, p - length + 1):
+                last = first + length - 1
+                if first < 1 or last > self.n - 1:
+                    continue
+                for b in self.neighbors[a]:
+                    q = int(self.pos[b])
+                    # a が先頭ならば辺 (b, a) を、a が末尾ならば辺 (a, b) を作る挿入位置を選ぶ
+                    gap = q if first == p else q - 1
+                    if first - 1 <= gap <= last:
+                        continue
+                    if gap > last:
+                        i, j, k = first - 1, last, gap
+                    else:
+                        i, j, k = gap, first - 1, last
+                    if self._valid_exchange(i, j, k) and self.exchange_gain(i, j, k) < -eps:
+                        return self._exchange(i, j, k)
+                if length == 1:
+                    break
+        return None
+
+    def _try_or3(self, a: int, eps: float) -> tuple[int, ...] | None:
+        """ 頂点 a の直後で巡回路を切り、続く 2 つの区間を反転せずに入れ替える 3-opt 近傍 (or3) \n
+        新しい辺 (a, b) と (c, a の直後の頂点) の b, c を近傍リストから選ぶ。
+        Returns:
+            touched (tuple[int, ...] | None): 適用した場合は端点が変わった頂点、改善しなければ None
+        """
+        i = int(self.pos[a])
+        if i > self.n - 3:
+            return None
+        succ = self.tour[i + 1]
+        for b in self.neighbors[a]:
+            j = int(self.pos[b]) - 1
+            if j <= i:
+                continue
+            for c in self.neighbors[succ]:
+                k = int(self.pos[c])
+                if self._valid_exchange(i, j, k) and self.exchange_gain(i, j, k) < -eps:
+                    return self._exchange(i, j, k)
+        return None
+
+    def or_opt(self, eps: float = 1e-9) -> list[int]:
+        """ 改善する Or-opt 近傍が無くなるまで巡回路を改善 \n
+        Args:
+            eps (float, optional): 改善とみなすコストの減少量の下限
+        Returns:
+            tour (list[int]): 改善後の巡回路
+        """
+        return self.descend((self._try_or_opt,), eps)
+
+    def vnd(self, neighborhoods: tuple[str, ...] = ('2opt', 'oropt', 'or3'), eps: float = 1e-9,
+            control: SolveControl = None) -> list[int]:
+        """ 複数の近傍を順に試す可変近傍降下法で、どの近傍でも改善しなくなるまで巡回路を改善 \n
+        各頂点で前の近傍が改善しなかった場合に次の近傍を試し、改善した場合は最初の近傍から探索し直す。
+        Args:
+            neighborhoods (tuple[str, ...], optional): 用いる近傍の順序、'2opt', 'oropt', 'or3' から選ぶ
+            eps (float, optional): 改善とみなすコストの減少量の下限
+            control (SolveControl, optional): 打ち切る条件と途中経過の通知、descend を参照
+        Returns:
+            tour (list[int]): 改善後の巡回路
+        """
+        moves = {'2opt': self._try_two_opt, 'oropt': self._try_or_opt, 'or3': self._try_or3}
+        unknown = set(neighborhoods) - set(moves)
+        if unknown:
+            raise ValueError(f'unknown neighborhoods: {sorted(unknown)}')
+        return self.descend(tuple(moves[name] for name in neighborhoods), eps, control)
+
+    def two_opt(self, eps: float = 1e-9) -> list[int]:
+        """ 近傍リストと don't-look bit を用いて、改善する 2-opt 近傍が無くなるまで巡回路を改善 \n
+        Args:
+            eps (float, optional): 改善とみなすコストの減少量の下限
+        Returns:
+            tour (list[int]): 改善後の巡回路
+        """
+        return self.descend((self._try_two_opt,), eps)
+
+    def descend(self, moves: tuple, eps: float = 1e-9, control: SolveControl = None) -> list[int]:
+        """ don't-look bit が立っていない頂点から順に近傍を探索し、改善する近傍を適用する \n
+        近傍を適用したら端点の頂点の don't-look bit を下ろして再び探索の対象とする。
+        control を指定した場合は、頂点を探索する前に打ち切る条件を確かめ、近傍を適用するたびに途中経過を通知する。
+        Args:
+            moves (tuple): 頂点 a を受け取り、改善した場合は端点の頂点を、しなければ None を返す関数の列
+            eps (float, optional): 改善とみなすコストの減少量の下限
+            control (SolveControl, optional): 打ち切る条件と途中経過の通知
+        Returns:
+            tour (list[int]): 改善後の巡回路 (打ち切った場合はその時点の巡回路)
+        """
+        queue = deque(int(a) for a in self.tour[:-1])
+        active = np.ones(self.n, dtype=bool)
+        passes = applied = 0
+        # 1 パスでは、そのパスの開始時にキューにある頂点を順に探索する
+        while queue:
+            passes += 1
+            for _ in range(len(queue)):
+                if control is not None and control.should_stop():
+                    queue.clear()
+                    break
+                a = queue.popleft()
+                active[a] = False
+                for move in moves:
+                    touched = move(a, eps)
+                    if touched is not None:
+                        applied += 1
+                        if control is not None:
+                            control.moves += 1
+                            control.report(self.tour_cost())
+                        for x in touched + (a,):
+                            if not active[x]:
+                                active[x] = True
+                                queue.append(x)
+                        break
+        if self.stats is not None:
+            self.stats.count('local_search.passes', passes)
+            self.stats.count('local_search.moves_applied', applied)
+        return self.tour.tolist()
@@ -1,24 +1,38 @@
-import osmnx as ox
+import numpy as np
 import constant as c
 from spp import Dijkstra
 from tsp import TwoOpt
+from cluster_tsp import solve_clustered
 from my_network import Network
 
-def get_node_osmid(u: tuple) -> int:
-    """ 座標 u = (x, y) に最も近い Node の osmid を返す  \n
+def get_node_osmid(u: tuple, N: Network) -> int:
+    """ 座標 u に最も近い Node の osmid を、ネットワークの空間索引から返す  \n
     Args:
-        u (list[tuple] | tuple): 座標 u の経度と緯度を格納したタプル
+        u (tuple): 座標 u の緯度と経度を格納したタプル
+        N (Network): 探索対象の道路ネットワーク
     Returns:
         nearest_node (int): 座標 u に最も近い頂点の osmid の値
     """
-    G = ox.graph_from_point(u, dist=200, network_type='drive')
-    nearest_node = ox.nearest_nodes(G, u[0], u[1])
-    return nearest_node
+    return get_node_osmids([u], N)[0]
+
+def get_node_osmids(coords: list[tuple], N: Network) -> list[int]:
+    """ 複数の座標それぞれに最も近い Node の osmid をまとめて返す  \n
+    Args:
+        coords (list[tuple]): 緯度と経度を格納したタプルのリスト
+        N (Network): 探索対象の道路ネットワーク
+    Returns:
+        nearest_nodes (list[int]): 各座標に最も近い頂点の osmid のリスト
+    """
+    nearest_nodes = N.nearest_nodes(coords).tolist()
+    for u, osmid in zip(coords, nearest_nodes):
+        if osmid == -1:
+            raise ValueError(f'no node within {c.MarginDist.search_radius_for_nearest_node} m of {u}')
+    return nearest_nodes
 
 def main_get_node_osmid():
     """ 複数の座標に対して osmid を取得するメイン関数 """
-    print(get_node_osmid(c.Spot.Coordinate.kgu))
-    print(get_node_osmid(c.Spot.Coordinate.uddhichuo))
+    N = Network(c.Path.node_csv, c.Path.edge_csv)
+    print(get_node_osmids([c.Spot.Coordinate.kgu, c.Spot.Coordinate.uddhichuo], N))
 
 def main_draw_network():
     """ 道路ネットワークを描画するメイン関数 """
@@ -28,12 +42,12 @@ def main_draw_network():
 def main_spp():
     """ 最短経路問題を解くメイン関数 """
     spp_solver = Dijkstra(c.Path.node_csv, c.Path.edge_csv)
-    start_osmid = get_node_osmid(c.Spot.Coordinate.kgu)
-    goal_osmid = get_node_osmid(c.Spot.Coordinate.uddhichuo) 
-    min_costs = spp_solver.solve(start_osmid)
+    start_osmid = get_node_osmid(c.Spot.Coordinate.kgu, spp_solver)
+    goal_osmid = get_node_osmid(c.Spot.Coordinate.uddhichuo, spp_solver) 
+    min_cost = spp_solver.solve_pair(start_osmid, goal_osmid)
     shortest_path = spp_solver.get_shortest_path(start_osmid, goal_osmid)
     delay_time = len(shortest_path) * c.DelayCoefficient.node + spp_solver.ct_traffic_signals(shortest_path) * c.DelayCoefficient.traffic_light + 2 * c.DelayCoefficient.departure_and_stop
-    print(f'({c.Transportation.car}) {c.Spot.Name.kgu} -> {c.Spot.Name.uddhichuo}: {round(min_costs[goal_osmid] + delay_time, 2)} min')
+    print(f'({c.Transportation.car}) {c.Spot.Name.kgu} -> {c.Spot.Name.uddhichuo}: {round(min_cost + delay_time, 2)} min')
     spp_solver.draw(is_directed=True, paths=shortest_path)
 
 def main_tsp():
@@ -50,13 +64,23 @@ def main_tsp():
     tsp_solver = TwoOpt(c.Path.node_csv, c.Path.edge_csv, V)
     print(f'({c.Transportation.car}) 最近挿入法による推定巡回路移動時間: {round(tsp_solver.min_cost, 2)} min')
     tsp_solver.draw(is_directed=True, paths=tsp_solver.tour_paths)
-    tsp_solver.solve()
-    print(f'({c.Transportation.car}) 2-opt 法による推定巡回路移動時間: {round(tsp_solver.min_cost, 2)} min')  
+    tsp_solver.solve(neighborhoods=('2opt', 'oropt', 'or3'))
+    print(f'({c.Transportation.car}) 巡回路改善後 (頂点数が少なければ厳密解) の推定巡回路移動時間: {round(tsp_solver.min_cost, 2)} min')  
     tsp_solver.draw(is_directed=True, paths=tsp_solver.tour_paths)
 
+def main_tsp_clustered(n_stops: int = 2000, cluster_size: int = 200):
+    """ 頂点数の多い巡回セールスマン問題を、頂点をクラスタに分けて解くメイン関数 """
+    N = Dijkstra(c.Path.node_csv, c.Path.edge_csv, core='csr')
+    osmids = N.node_arrays()[0]
+    V = np.random.default_rng(0).choice(osmids, size=min(n_stops, len(osmids)), replace=False).tolist()
+    result = solve_clustered(N, V, cluster_size=cluster_size)
+    print(f'({c.Transportation.car}) クラスタに分けて求めた {len(V)} 地点の推定巡回路移動時間: {round(result["cost"], 2)} min')
+    N.draw(is_directed=True, paths=result['paths'])
+
 if __name__ == '__main__':
     # main_get_node_osmid()
     # main_draw_network()
     # main_spp()
+    # main_tsp_clustered()
     main_tsp()
     print(c.FontColor.YELLOW + 'Program ran successfully' + c.FontColor.END)
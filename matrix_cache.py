@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import numpy as np
+from contraction_hierarchy import network_arcs, graph_fingerprint
+
+CACHE_VERSION = 1
+
+
+def matrix_fingerprint(N) -> str:
+    """ 距離行列のキャッシュのキーとするグラフのハッシュ値を返す \n
+    保持形式によらず同じ道路ネットワークが同じキーとなるよう、通行可能な弧を端点の osmid の順に並べ、
+    同じ端点の組の弧はコストの最小のものだけを残してからハッシュ値を求める。
+    縮約したグラフや update_edges で変更したグラフは、弧が変わるため別のキーとなる。
+    Args:
+        N (Network): 道路ネットワーク
+    Returns:
+        fingerprint (str): グラフのハッシュ値
+    """
+    osmids, src, dst, cost = network_arcs(N)
+    u, v = osmids[src], osmids[dst]
+    order = np.lexsort((cost, v, u))
+    u, v, cost = u[order], v[order], cost[order]
+    first = np.ones(len(u), dtype=bool)
+    first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    return graph_fingerprint(np.sort(osmids), u[first], v[first], cost[first])
+
+
+class MatrixCache:
+    """ 頂点間の最短経路のコストを、グラフのハッシュ値ごとにディスクに保存するキャッシュ \n
+    グラフごとのディレクトリに頂点の osmid (stops.npy)、距離行列 (matrix.npy、未計算の組は nan) 及び
+    各頂点を最後に用いた時刻 (used.npy) を保存し、距離行列はメモリマップで開いて必要な部分だけを読む。
+    """
+    def __init__(self, directory: str, max_bytes: int = 1 << 30) -> None:
+        """ キャッシュを初期化 \n
+        Args:
+            directory (str): キャッシュを保存するディレクトリの path
+            max_bytes (int, optional): 保存する距離行列の合計の大きさの上限 [byte]
+                超える場合は、最後に用いた時刻の古いグラフから削除し、1 つのグラフで超える場合は古い頂点から削除する
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, fingerprint)
+
+    def _publish(self, staging: str, path: str) -> None:
+        """ 書き出し終えたディレクトリを保存先に置き換える \n
+        保存先が既にあれば一意な名前に退避してから置き換え、他のプロセスが同時に保存した場合は後に置き換えた方を残す。
+        """
+        for _ in range(8):
+            try:
+                os.replace(staging, path)
+                return
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+            old = f'{path}.{uuid.uuid4().hex}.old'
+            try:
+                os.replace(path, old)
+            except FileNotFoundError:
+                # 他のプロセスが先に退避した
+                continue
+            shutil.rmtree(old, ignore_errors=True)
+        raise OSError(f'could not replace {path}')
+
+    def load(self, fingerprint: str) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """ グラフの距離行列を読み込む \n
+        Args:
+            fingerprint (str): グラフのハッシュ値、matrix_fingerprint を参照
+        Returns:
+            stops (np.ndarray): 行と列の頂点の osmid
+            matrix (np.ndarray): 読み取り専用のメモリマップの距離行列 (未計算の組は nan)
+            used (np.ndarray): 各頂点を最後に用いた時刻
+            保存されていないか壊れている場合は None
+        """
+        path = self._path(fingerprint)
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                if json.load(f).get('version') != CACHE_VERSION:
+                    return None
+            stops = np.load(os.path.join(path, 'stops.npy'))
+            used = np.load(os.path.join(path, 'used.npy'))
+            matrix = np.load(os.path.join(path, 'matrix.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if matrix.shape != (len(stops), len(stops)) or len(used) != len(stops):
+            return None
+        return stops, matrix, used
+
+    def lookup(self, fingerprint: str, V: list[int]) -> np.ndarray:
+        """ 頂点集合 V の距離行列のうち保存されている部分を返す \n
+        Args:
+            fingerprint (str): グラフのハッシュ値
+            V (list[int]): 頂点の osmid のリスト
+        Returns:
+            dist_matrix (np.ndarray): V の順の距離行列、保存されていない組は nan
+        """
+        n = len(V)
+        dist_matrix = np.full((n, n), np.nan)
+        cached = self.load(fingerprint)
+        if cached is None:
+            return dist_matrix
+        stops, matrix, _ = cached
+        lookup = {osmid: i for i, osmid in enumerate(stops.tolist())}
+        known = [i for i, v in enumerate(V) if v in lookup]
+        rows = np.array([lookup[V[i]] for i in known], dtype=np.int64)
+        if len(known):
+            # メモリマップから必要な行だけを読み、その中から必要な列を取り出す
+            dist_matrix[np.ix_(known, known)] = matrix[rows][:, rows]
+        return dist_matrix
+
+    def touch(self, fingerprint: str, V: list[int]) -> None:
+        """ 距離行列を書き換えずに、V の頂点を最後に用いた時刻を更新 """
+        cached = self.load(fingerprint)
+        if cached is None:
+            return
+        stops, _, used = cached
+        used[np.isin(stops, np.asarray(V, dtype=np.int64))] = time.time()
+        path = self._path(fingerprint)
+        try:
+            # 他のプロセスと一時ファイルを取り合わないよう、一意な名前で書き出してから置き換える
+            fd, tmp = tempfile.mkstemp(suffix='.npy.tmp', dir=path)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, used)
+            os.replace(tmp, os.path.join(path, 'used.npy'))
+        except OSError:
+            # 他のプロセスが同時にグラフの保存先を置き換えた場合は、時刻の更新を諦める
+            pass
+
+    def store(self, fingerprint: str, V: list[int], dist_matrix: np.ndarray) -> None:
+        """ 頂点集合 V の距離行列を保存済みの距離行列に併合して保存し、大きさの上限を超えた分を削除 \n
+        Args:
+            fingerprint (str): グラフのハッシュ値
+            V (list[int]): 頂点の osmid のリスト
+            dist_matrix (np.ndarray): V の順の距離行列 (nan は未計算として扱う)
+        """
+        now = time.time()
+        cached = self.load(fingerprint)
+        if cached is None:
+            stops, used = np.zeros(0, dtype=np.int64), np.zeros(0)
+        else:
+            stops, _, used = cached
+        lookup = {osmid: i for i, osmid in enumerate(stops.tolist())}
+        new = [v for v in dict.fromkeys(V) if v not in lookup]
+        all_stops = np.concatenate((stops, np.array(new, dtype=np.int64)))
+        all_used = np.concatenate((used, np.full(len(new), now)))
+        lookup.update({v: len(stops) + i for i, v in enumerate(new)})
+        pos = np.array([lookup[v] for v in V], dtype=np.int64)
+        all_used[pos] = now
+
+        # 1 つのグラフで上限を超える場合は、V 以外の頂点を最後に用いた時刻の古い順に削除
+        keep = np.arange(len(all_stops))
+        limit = int(np.sqrt(max(self.max_bytes, 0) / 8))
+        if len(keep) > limit:
+            protected = np.zeros(len(all_stops), dtype=bool)
+            protected[pos] = True
+            order = np.lexsort((-all_used, ~protected))
+            keep = np.sort(order[:max(limit, int(protected.sum()))])
+
+        path = self._path(fingerprint)
+        os.makedirs(self.directory, exist_ok=True)
+        # 書き出し先はプロセスごとに一意なディレクトリとし、同時に保存する他のプロセスの書きかけを消さない
+        tmp = tempfile.mkdtemp(prefix=f'{fingerprint}.', suffix='.tmp', dir=self.directory)
+        try:
+            self._write(tmp, cached, stops, keep, pos, all_stops, all_used, dist_matrix)
+            cached = None
+            self._publish(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep=fingerprint)
+
+    def _write(self, tmp: str, cached, stops: np.ndarray, keep: np.ndarray, pos: np.ndarray, all_stops: np.ndarray,
+               all_used: np.ndarray, dist_matrix: np.ndarray) -> None:
+        """ 保存済みの距離行列の残す行と列に V の距離行列を併合し、頂点と時刻と合わせて tmp に書き出す """
+        matrix = np.lib.format.open_memmap(os.path.join(tmp, 'matrix.npy'), mode='w+', dtype=np.float64,
+                                           shape=(len(keep), len(keep)))
+        matrix[:] = np.nan
+        old = keep[keep < len(stops)]
+        if cached is not None and len(old):
+            # 保存済みの行を 1 行ずつ写し、大きな距離行列を一度にメモリに載せない
+            old_matrix = cached[1]
+            for r, i in enumerate(old.tolist()):
+                matrix[r, :len(old)] = old_matrix[i][old]
+            del old_matrix
+        cached = None
+        new_pos = np.full(len(all_stops), -1, dtype=np.int64)
+        new_pos[keep] = np.arange(len(keep))
+        at = new_pos[pos]
+        given = ~np.isnan(dist_matrix)
+        block = matrix[np.ix_(at, at)]
+        matrix[np.ix_(at, at)] = np.where(given, dist_matrix, block)
+        matrix.flush()
+        del matrix
+        np.save(os.path.join(tmp, 'stops.npy'), all_stops[keep])
+        np.save(os.path.join(tmp, 'used.npy'), all_used[keep])
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'n': int(len(keep))}, f)
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        """ 保存されているグラフごとの (ハッシュ値, 大きさ [byte], 最後に更新した時刻) のリストを返す """
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(('.tmp', '.old')) or not os.path.isdir(path):
+                continue
+            try:
+                files = [os.path.join(path, f) for f in os.listdir(path)]
+                result.append((name, sum(os.path.getsize(f) for f in files),
+                               max((os.path.getmtime(f) for f in files), default=0.0)))
+            except OSError:
+                # 他のプロセスが保存先を置き換えている途中
+                continue
+        return result
+
+    def evict(self, keep: str = None) -> list[str]:
+        """ 合計の大きさが上限以下になるまで、最後に更新した時刻の古いグラフから削除 \n
+        Args:
+            keep (str, optional): 削除しないグラフのハッシュ値
+        Returns:
+            removed (list[str]): 削除したグラフのハッシュ値
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for name, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._path(name), ignore_errors=True)
+            total -= size
+            removed.append(name)
+        return removed
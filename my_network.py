@@ -1,16 +1,28 @@
-import networkx as nx
 import matplotlib.pyplot as plt
+import numpy as np
 import extract_road_csv as edc
+import constant as c
+from csr_graph import CSRGraph
+from graph_snapshot import load_snapshot
+from graph_pruning import graph_from_network, prune_graph
+from spatial_index import NodeGrid
+from solver_stats import SolverStats
+from render import NetworkRenderer
 from typing import Dict
 import itertools
 
 class Network:
     """ ネットワークに頂点や辺を追加する機能や自身を描画する機能を持つクラス """
-    def __init__(self, node_csv_file: str, edge_csv_file: str) -> None:
+    def __init__(self, node_csv_file: str, edge_csv_file: str, core: str = 'dict', stats: SolverStats = None) -> None:
         """ ネットワークを初期化 \n
         Args:
             node_csv_file (str): 頂点に関する情報を格納した csv ファイルの path
             edge_csv_file (str): 辺に関する情報を格納した csv ファイルの path
+            core (str, optional): グラフの保持形式
+                'dict': 頂点や辺ごとに辞書で保持
+                'csr': 頂点を整数の添字に対応付け、隣接関係を CSR 形式の配列で保持 (nodes, edges は空のまま)
+                'snapshot': 'csr' と同じ形式を、csv から作成したバイナリのスナップショットからメモリマップで読み込む
+            stats (SolverStats, optional): 各段階の経過時間と探索の回数を記録する計測、省略時は計測しない
         Attributes:
             nodes (Dict[int, Dict[str, int]]): 各頂点の情報を格納
                 osmid (dict): 頂点の osmid 値に基づく情報を格納
@@ -21,11 +33,29 @@ class Network:
                     osmid (dict): 辺 (u, v) の情報を格納
                         'osmid': 辺の OSMID
                         'cost': 辺のコスト
+            core (str): グラフの保持形式
+            graph (CSRGraph | None): core が 'csr' または 'snapshot' のときの CSR 形式のグラフ
+            node_index (NodeGrid | None): 最近傍頂点の探索に用いる空間索引、初めて使うときに構築
+            renderer (NetworkRenderer | None): 描画に用いる辺の座標と背景の図、初めて描画するときに構築
+            stats (SolverStats): 計測、'load' に csv の読み込みとグラフの構築の時間を記録
         """
+        if core not in ('dict', 'csr', 'snapshot'):
+            raise ValueError(f"core must be 'dict', 'csr' or 'snapshot', not {core!r}")
+        self.core: str = core
         self.nodes: Dict[int, Dict[str, int]] = {}   
         self.edges: Dict[int, Dict[int, Dict[str, float]]] = {}
-        self._add_nodes(node_csv_file)
-        self._add_edges(edge_csv_file)
+        self.graph: CSRGraph | None = None
+        self.node_index: NodeGrid | None = None
+        self.renderer: NetworkRenderer | None = None
+        self.stats: SolverStats = stats if stats is not None else SolverStats(enabled=False)
+        with self.stats.phase('load'):
+            if core == 'csr':
+                self.graph = CSRGraph.from_arrays(*edc.read_node_arrays(node_csv_file), *edc.read_edge_arrays(edge_csv_file))
+            elif core == 'snapshot':
+                self.graph = load_snapshot(node_csv_file, edge_csv_file)
+            else:
+                self._add_nodes(node_csv_file)
+                self._add_edges(edge_csv_file)
 
     def __add_node(self, osmid: int, x: float, y: float, highway: str = None) -> None:
         """ 頂点を追加  \n
@@ -77,6 +107,69 @@ class Network:
             cost = (edge['length']/1000)/(edge['maxspeed']/60)  # 辺 (u, v) を移動するためにかかる時間 [min]
             self.__add_edge(edge['u'], edge['v'], edge['osmid'], cost, edge['oneway'], edge['reversed'])
         
+    def node_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ 全頂点の osmid と座標を配列で返す \n
+        Returns:
+            osmids (np.ndarray): 頂点の osmid
+            x (np.ndarray): 頂点の経度
+            y (np.ndarray): 頂点の緯度
+        """
+        if self.graph is not None:
+            return self.graph.osmids, self.graph.x, self.graph.y
+        osmids = np.fromiter(self.nodes.keys(), dtype=np.int64, count=len(self.nodes))
+        x = np.fromiter((node['x'] for node in self.nodes.values()), dtype=np.float64, count=len(self.nodes))
+        y = np.fromiter((node['y'] for node in self.nodes.values()), dtype=np.float64, count=len(self.nodes))
+        return osmids, x, y
+
+    def nearest_nodes(self, coords: list[tuple] | tuple, max_dist: float = c.MarginDist.search_radius_for_nearest_node) -> np.ndarray:
+        """ 座標に最も近い頂点の osmid をネットワークから一括で求める \n
+        Args:
+            coords (list[tuple] | tuple): (緯度, 経度) のタプルもしくはそれを格納したリスト
+            max_dist (float, optional): 頂点とみなす最大距離 [m]
+        Returns:
+            osmids (np.ndarray): 各座標に最も近い頂点の osmid、max_dist 以内に頂点が無ければ -1
+        """
+        if self.node_index is None or self.node_index.cell_size < max_dist:
+            osmids, x, y = self.node_arrays()
+            if self.graph is not None and self.graph.active is not None:
+                # 縮約したグラフでは探索に残した頂点だけを候補とする
+                osmids, x, y = osmids[self.graph.active], x[self.graph.active], y[self.graph.active]
+            self.node_index = NodeGrid(osmids, x, y, cell_size=max(max_dist, c.MarginDist.search_radius_for_nearest_node))
+        osmids, _ = self.node_index.nearest(coords, max_dist)
+        return osmids
+
+    def prune(self, keep: list[int] = None) -> dict:
+        """ 探索の前処理として、通行できない弧と keep を含まない強連結成分を取り除き、次数 2 の頂点の連なりを縮約 \n
+        縮約したグラフは CSR 形式で保持し、core が 'dict' の場合は 'csr' に変換する (nodes, edges は空にする)。
+        頂点の添字と座標、交通信号機の情報は元のまま残すため、経路を展開すれば ct_traffic_signals や draw はそのまま使える。
+        縮約した頂点は探索で到達しないため、経路の端点にする頂点は keep に含める。
+        並行する縮約した弧のうちコストが最小でないものと自己ループになる連なりは取り除くため、draw でも描画しない。詳細は graph_pruning.prune_graph を参照。
+        Args:
+            keep (list[int], optional): 縮約せずに残す頂点の osmid、指定すればそれらを含む強連結成分だけを残す
+        Returns:
+            summary (dict): 縮約前後の頂点数と弧の数、prune_graph を参照
+        """
+        with self.stats.phase('prune'):
+            self.graph, summary = prune_graph(graph_from_network(self), keep)
+        if self.core == 'dict':
+            self.core = 'csr'
+            self.nodes, self.edges = {}, {}
+        self.node_index = None
+        self.renderer = None
+        self.stats.count('prune.removed_arcs', summary['arcs'] - summary['pruned_arcs'])
+        return summary
+
+    def expand_path(self, path: list[int]) -> list[int]:
+        """ 縮約したグラフ上の経路を、縮約した頂点を含む経路に展開 \n
+        Args:
+            path (list[int]): 頂点の osmid の経路
+        Returns:
+            path (list[int]): 縮約前のグラフでの頂点の osmid の経路 (縮約していなければそのまま)
+        """
+        if self.graph is None or self.graph.via_offsets is None or len(path) < 2:
+            return path
+        return self.graph.osmids[self.graph.expand_path(self.graph.index.lookup(path).tolist())].tolist()
+
     def ct_traffic_signals(self, nodes: list[int] | list[list[int]]) -> int:
         """ 交通信号機の数をカウント \n
         Args:
@@ -85,47 +178,39 @@ class Network:
             count (int): 交差点が交通信号機であるような頂点の個数
         """
         count = 0
+        if not nodes:
+            # 到達できない終点への経路は空のリスト
+            return 0
         if isinstance(nodes[0], list):
             nodes = list(itertools.chain(*nodes))
+        if self.graph is not None:
+            return sum(bool(self.graph.is_signal[self.graph.index[node]]) for node in nodes)
         for node in nodes:
             if self.nodes[node]['highway'] == 'traffic_signals':
                 count += 1
         return count
         
-    def draw(self, is_directed = False, paths: list[int] | list[list[int]] = None) -> None:
+    def draw(self, is_directed = False, paths: list[int] | list[list[int]] = None, out_file: str = None,
+             bbox: tuple[float, float, float, float] = None, margin: float = 0.1) -> str | None:
         """ ネットワークを描画  \n
+        辺は 1 つの LineCollection にまとめて描画する。out_file を指定した場合は画面を使わずにファイルへ書き出し、
+        同じ範囲の背景 (道路ネットワーク) は NetworkRenderer に保持して次の描画で使い回す。
         Args:
-            is_directed (bool, optional): 有向グラフならば真
+            is_directed (bool, optional): 有向グラフならば真 (互換のために残している、弧の向きは描画しない)
             paths (list[int] | list[list[int]], optional): 頂点の osmid を要素としそれらを繋いだ強調したい経路もしくはそれを格納したリスト
+            out_file (str, optional): 書き出すファイルの path (.png, .svg, .geojson など)、省略時は画面に表示
+            bbox (tuple[float, float, float, float], optional): 表示範囲 (x の最小値, y の最小値, x の最大値, y の最大値)、
+                省略時は out_file を指定すれば経路を囲む範囲、そうでなければ全体
+            margin (float, optional): 経路を囲む範囲の余白の割合
+        Returns:
+            out_file (str | None): 書き出したファイルの path
         """
-        normal_node_size = 10
-        normal_node_color = 'skyblue'
-        emphasize_node_size = 8 * normal_node_size
-        emphasize_node_color = '#ff7100'
-        emphasize_edge_color = 'red'
-        if is_directed:
-            G = nx.DiGraph()
-        else:
-            G = nx.Graph()
-        # edge_labels = {}
-        for u_osmid, edges in self.edges.items():
-            for v_osmid, edge in edges.items():
-                if edge['cost'] == float('inf'):
-                    continue
-                G.add_edge(u_osmid, v_osmid, weight=edge['cost'])
-                # edge_labels[(u_osmid, v_osmid)] = round(edge_info['cost'],1)
-        pos = {osmid: (node['x'], node['y']) for osmid, node in self.nodes.items()} 
-        nx.draw(G, pos, with_labels=False, node_size=normal_node_size, node_color=normal_node_color)
-        # nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels)
-        def _draw_path(_G, _pos, _path, _emphasize_node_size, _emphasize_node_color, _emphasize_edge_color):
-            start_node = _path[0]
-            end_node = _path[-1]
-            nx.draw_networkx_nodes(_G, _pos, nodelist=[start_node, end_node], node_size=_emphasize_node_size, node_color=_emphasize_node_color)
-            edges_in_path = [(_path[i], _path[i+1]) for i in range(len(_path)-1)]
-            nx.draw_networkx_edges(_G, _pos, edgelist=edges_in_path, edge_color=_emphasize_edge_color, width=2)
-        if paths is not None and isinstance(paths[0], int):
-            _draw_path(G, pos, paths, emphasize_node_size, emphasize_node_color, emphasize_edge_color)
-        if paths is not None and isinstance(paths[0], list):
-            for p in paths:
-                _draw_path(G, pos, p, emphasize_node_size, emphasize_node_color, emphasize_edge_color)
+        if self.renderer is None:
+            self.renderer = NetworkRenderer(self)
+        if out_file is not None:
+            return self.renderer.render(out_file, paths, bbox, margin)
+        _, ax = plt.subplots()
+        self.renderer.draw_background(ax, bbox)
+        self.renderer.draw_paths(ax, paths)
         plt.show()
+        return None
@@ -0,0 +1,286 @@
+import bz2
+import gzip
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+import numpy as np
+import pandas as pd
+import constant as c
+from graph_snapshot import compile_snapshot
+
+EARTH_RADIUS = 6371008.8    # 地球の平均半径 [m]
+NODE_BATCH = 1_000_000      # 頂点を読み込む際にまとめて絞り込む個数
+# osmnx の network_type='drive' に相当する、車が通行できる道路の種類
+DRIVE_HIGHWAYS = frozenset({
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link', 'secondary', 'secondary_link',
+    'tertiary', 'tertiary_link', 'unclassified', 'residential', 'living_street', 'road', 'service',
+})
+EXCLUDED_SERVICES = frozenset({'alley', 'driveway', 'emergency_access', 'parking', 'parking_aisle', 'private'})
+NO_ACCESS = frozenset({'no', 'private'})
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """ 2 点間の大円距離を求める \n
+    Args:
+        lat1, lon1, lat2, lon2 (array_like): 2 点の緯度と経度 [deg]
+    Returns:
+        dist (np.ndarray): 2 点間の距離 [m]
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(h))
+
+def clip_circle(u: tuple, v: tuple, margin_dist: float = c.MarginDist.get_road_network_radius) -> tuple[tuple, float]:
+    """ extract_road_osm.extract_nodes_edges と同じく、2 地点の中点を中心とし 2 地点を含む円を求める \n
+    Args:
+        u (tuple): ある地点の緯度経度
+        v (tuple): ある地点の緯度経度
+        margin_dist (float, optional): 始点や終点に最も近い頂点を含めるための余分な距離 [m]
+    Returns:
+        center (tuple): 円の中心の緯度経度
+        radius (float): 円の半径 [m]
+    """
+    center = ((u[0] + v[0]) / 2, (u[1] + v[1]) / 2)
+    radius = (float(haversine(u[0], u[1], v[0], v[1])) + margin_dist) / 2
+    return center, radius
+
+def is_drivable(tags: dict) -> bool:
+    """ way のタグから車が通行できる道路かを判定 """
+    if tags.get('highway') not in DRIVE_HIGHWAYS or tags.get('area') == 'yes':
+        return False
+    if tags.get('service') in EXCLUDED_SERVICES:
+        return False
+    return not any(tags.get(key) in NO_ACCESS for key in ('access', 'motor_vehicle', 'motorcar'))
+
+def parse_oneway(tags: dict) -> int:
+    """ way のタグから一方通行の向きを求める \n
+    Returns:
+        direction (int): way の向きに一方通行ならば 1、逆向きに一方通行ならば -1、双方向ならば 0
+    """
+    oneway = tags.get('oneway', '').lower()
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway in ('-1', 'reverse'):
+        return -1
+    if oneway == 'no':
+        return 0
+    return 1 if tags.get('junction') == 'roundabout' or tags.get('highway') == 'motorway' else 0
+
+def parse_maxspeed(value: str | None) -> float:
+    """ maxspeed タグを km/h の数値に変換 \n
+    "40", "40 km/h", "25 mph" のような値に対応し、"40;50" のように複数ある場合は平均をとる。
+    Returns:
+        maxspeed (float): 最高速度 [km/h]、解釈できなければ nan
+    """
+    if not value:
+        return np.nan
+    speeds = []
+    for part in value.replace(',', ';').split(';'):
+        number = part.strip().split(' ')[0].replace('mph', '')
+        try:
+            speeds.append(float(number) * (1.609344 if 'mph' in part else 1.0))
+        except ValueError:
+            continue
+    return float(np.mean(speeds)) if speeds else np.nan
+
+def _open(path: str):
+    """ 拡張子に応じて圧縮された osm ファイルも読めるように開く """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+def _iter_xml(path: str, kind: str):
+    """ .osm (XML) ファイルを iterparse で逐次読み込み、読み終えた要素は破棄してメモリ使用量を抑える \n
+    Args:
+        path (str): osm ファイルの path
+        kind (str): 'node' ならば (id, 緯度, 経度, タグ)、'way' ならば (id, 頂点の参照, タグ) を順に返す
+    """
+    with _open(path) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end' or elem.tag not in ('node', 'way', 'relation'):
+                continue
+            if elem.tag == kind:
+                tags = {t.get('k'): t.get('v') for t in elem.iter('tag')}
+                if kind == 'node':
+                    yield int(elem.get('id')), float(elem.get('lat')), float(elem.get('lon')), tags
+                else:
+                    yield int(elem.get('id')), [int(nd.get('ref')) for nd in elem.iter('nd')], tags
+            root.clear()
+
+def _iter_pbf(path: str, kind: str):
+    """ .pbf ファイルを pyosmium で逐次読み込む、_iter_xml と同じ形式で返す """
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError('.pbf ファイルの読み込みには pyosmium (pip install osmium) が必要です') from e
+    entity = osmium.osm.NODE if kind == 'node' else osmium.osm.WAY
+    for obj in osmium.FileProcessor(path, entity):
+        if kind == 'node' and obj.is_node():
+            yield obj.id, obj.location.lat, obj.location.lon, dict(obj.tags)
+        elif kind == 'way' and obj.is_way():
+            yield obj.id, [n.ref for n in obj.nodes], dict(obj.tags)
+
+def _iter_osm(path: str, kind: str):
+    """ ファイルの形式に応じて node もしくは way を逐次読み込む """
+    return _iter_pbf(path, kind) if path.endswith('.pbf') else _iter_xml(path, kind)
+
+def _read_ways(path: str) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ 1 回目の走査で車が通行できる way だけを読み込み、頂点の参照を 1 つの配列に詰めて保持 \n
+    Returns:
+        way_ids (np.ndarray): way の osmid
+        offsets (np.ndarray): way i の頂点の参照は refs[offsets[i]:offsets[i+1]]
+        refs (np.ndarray): 頂点の osmid
+        oneway (np.ndarray): 一方通行の向き、parse_oneway を参照
+        maxspeed (np.ndarray): 最高速度 [km/h] (不明ならば nan)
+    """
+    way_ids, offsets, refs, oneway, maxspeed = array('q'), array('q', [0]), array('q'), array('b'), array('d')
+    for way_id, nodes, tags in _iter_osm(path, 'way'):
+        if len(nodes) < 2 or not is_drivable(tags):
+            continue
+        way_ids.append(way_id)
+        refs.extend(nodes)
+        offsets.append(len(refs))
+        oneway.append(parse_oneway(tags))
+        maxspeed.append(parse_maxspeed(tags.get('maxspeed')))
+    return tuple(np.frombuffer(a, dtype=a.typecode) for a in (way_ids, offsets, refs, oneway, maxspeed))
+
+def _read_nodes(path: str, needed: np.ndarray, center: tuple, radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ 2 回目の走査で way が参照し、かつ円の内側にある頂点の座標と信号機の有無だけを読み込む \n
+    Args:
+        needed (np.ndarray): way が参照する頂点の osmid (昇順)
+        center (tuple): 円の中心の緯度経度
+        radius (float): 円の半径 [m]
+    Returns:
+        osmids, lat, lon, is_signal (np.ndarray): 残した頂点の osmid (昇順), 緯度, 経度, 交通信号機ならば真
+    """
+    kept = [[], [], [], []]
+    batch = (array('q'), array('d'), array('d'), array('b'))
+
+    def _flush():
+        ids, lat, lon, signal = (np.array(a, dtype=a.typecode) for a in batch)
+        mask = np.isin(ids, needed, assume_unique=True) & (haversine(center[0], center[1], lat, lon) <= radius)
+        for column, values in zip(kept, (ids, lat, lon, signal.astype(bool))):
+            column.append(values[mask])
+        for a in batch:
+            del a[:]
+
+    for node_id, lat, lon, tags in _iter_osm(path, 'node'):
+        batch[0].append(node_id)
+        batch[1].append(lat)
+        batch[2].append(lon)
+        batch[3].append(tags.get('highway') == 'traffic_signals')
+        if len(batch[0]) >= NODE_BATCH:
+            _flush()
+    _flush()
+    osmids, lat, lon, is_signal = (np.concatenate(column) for column in kept)
+    order = np.argsort(osmids, kind='stable')
+    return osmids[order], lat[order], lon[order], is_signal[order]
+
+def import_osm(osm_file: str, center: tuple, radius: float) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """ ローカルの osm ファイルから、円の内側の車が通行できる道路ネットワークを抽出 \n
+    way は円の外の頂点で分割し、交差点、行き止まり及び交通信号機の頂点だけを残して間の頂点をまとめた辺とする。
+    ファイルは way と node の 2 回に分けて走査し、保持するのは残す道路の情報だけとする。
+    Args:
+        osm_file (str): .osm, .osm.gz, .osm.bz2 もしくは .pbf ファイルの path
+        center (tuple): 円の中心の緯度経度
+        radius (float): 円の半径 [m]
+    Returns:
+        nodes (pd.DataFrame): extract_road_csv が読む形式の頂点 (osmid, y, x, street_count, highway)
+        edges (pd.DataFrame): extract_road_csv が読む形式の辺 (u, v, key, osmid, oneway, reversed, length, maxspeed)
+    """
+    way_ids, offsets, refs, oneway, maxspeed = _read_ways(osm_file)
+    osmids, lat, lon, is_signal = _read_nodes(osm_file, np.unique(refs), center, radius)
+
+    # 参照を頂点の添字に変換し、円の外の頂点は -1 とする
+    idx = np.full(len(refs), -1, dtype=np.int64)
+    if len(osmids):
+        pos = np.minimum(np.searchsorted(osmids, refs), len(osmids) - 1)
+        found = osmids[pos] == refs
+        idx[found] = pos[found]
+    # 複数回参照される頂点 (交差点) と信号機の頂点を残す
+    keep = np.bincount(idx[idx >= 0], minlength=len(osmids)) >= 2
+    keep |= is_signal
+
+    rows = {'u': [], 'v': [], 'osmid': [], 'oneway': [], 'length': [], 'maxspeed': []}
+    for w in range(len(way_ids)):
+        way = idx[offsets[w]:offsets[w + 1]]
+        inside = way >= 0
+        # 円の内側で連続する区間ごとに辺を作る
+        bounds = np.flatnonzero(np.diff(np.concatenate(([False], inside, [False])).astype(np.int8)))
+        for a, b in zip(bounds[::2], bounds[1::2]):
+            run = way[a:b]
+            if len(run) < 2:
+                continue
+            seg = haversine(lat[run[:-1]], lon[run[:-1]], lat[run[1:]], lon[run[1:]])
+            cum = np.concatenate(([0.0], np.cumsum(seg)))
+            cut = np.flatnonzero(keep[run])
+            cut = np.unique(np.concatenate(([0], cut, [len(run) - 1])))
+            for i, j in zip(cut[:-1], cut[1:]):
+                u, v = int(run[i]), int(run[j])
+                if oneway[w] == -1:
+                    u, v = v, u
+                rows['u'].append(u)
+                rows['v'].append(v)
+                rows['osmid'].append(int(way_ids[w]))
+                rows['oneway'].append(bool(oneway[w]))
+                rows['length'].append(float(cum[j] - cum[i]))
+                rows['maxspeed'].append(float(maxspeed[w]))
+
+    edges = pd.DataFrame(rows).astype({'u': np.int64, 'v': np.int64, 'osmid': np.int64, 'oneway': bool,
+                                       'length': np.float64, 'maxspeed': np.float64})
+    if edges.empty:
+        return (pd.DataFrame(columns=['osmid', 'y', 'x', 'street_count', 'highway']),
+                pd.DataFrame(columns=['u', 'v', 'key', 'osmid', 'oneway', 'reversed', 'length', 'maxspeed']))
+    used = np.unique(np.concatenate((edges['u'].to_numpy(dtype=np.int64), edges['v'].to_numpy(dtype=np.int64))))
+    # 双方向の辺は osmnx と同じく逆向きの行も reversed=True として出力
+    forward = edges.assign(reversed=False)
+    backward = edges[~edges['oneway']].rename(columns={'u': 'v', 'v': 'u'}).assign(reversed=True)
+    edges = pd.concat([forward, backward], ignore_index=True)
+    edges['key'] = edges.groupby(['u', 'v']).cumcount()
+    pairs = np.unique(np.sort(edges[['u', 'v']].to_numpy(), axis=1), axis=0)
+    street_count = np.bincount(pairs[pairs[:, 0] != pairs[:, 1]].ravel(), minlength=len(osmids))
+    edges['u'] = osmids[edges['u'].to_numpy()]
+    edges['v'] = osmids[edges['v'].to_numpy()]
+    edges['length'] = edges['length'].round(3)
+    nodes = pd.DataFrame({
+        'osmid': osmids[used],
+        'y': lat[used],
+        'x': lon[used],
+        'street_count': street_count[used],
+        'highway': np.where(is_signal[used], 'traffic_signals', ''),
+    })
+    return nodes, edges[['u', 'v', 'key', 'osmid', 'oneway', 'reversed', 'length', 'maxspeed']]
+
+def import_osm_to_csv(osm_file: str, node_csv_file: str, edge_csv_file: str, center: tuple, radius: float,
+                      snapshot: bool = False) -> tuple[int, int]:
+    """ osm ファイルから道路ネットワークを抽出し、Network が読む csv ファイルとして出力 \n
+    Args:
+        osm_file (str): osm ファイルの path
+        node_csv_file (str): 出力する頂点の csv ファイルの path
+        edge_csv_file (str): 出力する辺の csv ファイルの path
+        center (tuple): 円の中心の緯度経度
+        radius (float): 円の半径 [m]
+        snapshot (bool, optional): 真ならば core='snapshot' で読み込むためのスナップショットも作成
+    Returns:
+        n (int): 頂点数
+        m (int): 辺の行数
+    """
+    nodes, edges = import_osm(osm_file, center, radius)
+    nodes.to_csv(node_csv_file, index=False)
+    edges.to_csv(edge_csv_file, index=False)
+    if snapshot:
+        compile_snapshot(node_csv_file, edge_csv_file)
+    return len(nodes), len(edges)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python osm_import.py <file.osm|file.osm.gz|file.pbf> [node_csv edge_csv]')
+        sys.exit(1)
+    center, radius = clip_circle(c.Spot.Coordinate.kgu, c.Spot.Coordinate.uddhichuo)
+    node_csv, edge_csv = sys.argv[2:4] if len(sys.argv) >= 4 else (c.Path.node_csv, c.Path.edge_csv)
+    n, m = import_osm_to_csv(sys.argv[1], node_csv, edge_csv, center, radius, snapshot=True)
+    print(f'{n} nodes, {m} edges -> {node_csv}, {edge_csv}')
+    print(c.FontColor.YELLOW + 'Program ran successfully' + c.FontColor.END)
@@ -0,0 +1,215 @@
+import os
+import json
+import numpy as np
+from collections import OrderedDict
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+
+NORMAL_EDGE_COLOR = '#9e9e9e'
+NORMAL_NODE_COLOR = 'skyblue'
+EMPHASIZE_NODE_COLOR = '#ff7100'
+EMPHASIZE_EDGE_COLOR = 'red'
+GEOJSON_SUFFIXES = ('.geojson', '.json')
+
+BBox = tuple[float, float, float, float]   # (x の最小値, y の最小値, x の最大値, y の最大値)
+
+
+def network_segments(N) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ 通行可能な辺の両端の座標と頂点の座標を配列で返す \n
+    逆向きの弧を持つ辺は 1 本の線分にまとめる。通行止め (コスト inf) の弧は含めない。
+    Args:
+        N (Network): 道路ネットワーク
+    Returns:
+        segments (np.ndarray): 形状 (辺の数, 2, 2) の線分の端点の座標 (x, y)
+        osmids (np.ndarray): 頂点の osmid
+        x (np.ndarray): 頂点の x 座標
+        y (np.ndarray): 頂点の y 座標
+    """
+    osmids, x, y = N.node_arrays()
+    osmids, x, y = np.asarray(osmids), np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if N.graph is not None:
+        # 縮約したグラフでは弧を経由する頂点に展開して描画する
+        src, dst = N.graph.expanded_arcs()
+    else:
+        lookup = {osmid: i for i, osmid in enumerate(osmids.tolist())}
+        pairs = [(lookup[u], lookup[v]) for u, edges in N.edges.items() for v, edge in edges.items()
+                 if edge['cost'] != float('inf')]
+        src, dst = np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+    # 向きを無視して重複を除く
+    n = max(len(osmids), 1)
+    codes = np.unique(np.minimum(src, dst) * n + np.maximum(src, dst))
+    a, b = codes // n, codes % n
+    segments = np.stack((np.column_stack((x[a], y[a])), np.column_stack((x[b], y[b]))), axis=1)
+    return segments, osmids, x, y
+
+
+def clip_segments(segments: np.ndarray, bbox: BBox) -> np.ndarray:
+    """ 外接矩形が bbox と重なる線分だけを返す """
+    xmin, ymin, xmax, ymax = bbox
+    sx, sy = segments[:, :, 0], segments[:, :, 1]
+    keep = (sx.max(axis=1) >= xmin) & (sx.min(axis=1) <= xmax) & (sy.max(axis=1) >= ymin) & (sy.min(axis=1) <= ymax)
+    return segments[keep]
+
+
+class NetworkRenderer:
+    """ 道路ネットワークと経路を、画面を使わずに画像もしくは GeoJSON に書き出すクラス \n
+    全ての辺の座標を配列で前計算し、1 つの LineCollection で描画する。
+    表示範囲ごとに背景 (道路ネットワーク) を描いた図を保持し、経路を描き替えるときは経路の層だけを作り直す。
+    """
+    def __init__(self, N, figsize: tuple[float, float] = (8, 8), dpi: int = 150, node_size: float = 10,
+                 max_backgrounds: int = 4) -> None:
+        """ 辺と頂点の座標を前計算 \n
+        Args:
+            N (Network): 道路ネットワーク
+            figsize (tuple[float, float], optional): 図の大きさ [inch]
+            dpi (int, optional): PNG の解像度
+            node_size (float, optional): 頂点の大きさ、0 ならば頂点を描かない
+            max_backgrounds (int, optional): 保持する背景の図の数の上限
+        Attributes:
+            segments (np.ndarray): 形状 (辺の数, 2, 2) の線分の端点の座標
+            coords (dict[int, int]): 頂点の osmid から座標の配列の添字への対応
+            backgrounds (OrderedDict[BBox, tuple[Figure, Axes]]): 表示範囲をキー、背景を描いた図を値とする (最近使った順)
+        """
+        self.network = N
+        self.figsize = figsize
+        self.dpi = dpi
+        self.node_size = node_size
+        self.max_backgrounds = max_backgrounds
+        self.segments, self.osmids, self.x, self.y = network_segments(N)
+        self.coords: dict[int, int] = {osmid: i for i, osmid in enumerate(self.osmids.tolist())}
+        self.backgrounds: OrderedDict = OrderedDict()
+
+    def _path_coords(self, path: list[int]) -> np.ndarray:
+        """ 経路の頂点の座標を形状 (頂点数, 2) の配列で返す """
+        i = np.fromiter((self.coords[osmid] for osmid in path), dtype=np.int64, count=len(path))
+        return np.column_stack((self.x[i], self.y[i]))
+
+    @staticmethod
+    def _as_paths(paths: list[int] | list[list[int]] | None) -> list[list[int]]:
+        """ 1 本の経路もしくは経路のリストを経路のリストに揃える """
+        if not paths:
+            return []
+        return [paths] if isinstance(paths[0], (int, np.integer)) else [p for p in paths if p]
+
+    def viewport(self, paths: list[int] | list[list[int]] | None = None, margin: float = 0.1) -> BBox:
+        """ 経路を囲む表示範囲を返す、経路が無ければネットワーク全体 \n
+        Args:
+            paths (list[int] | list[list[int]], optional): 経路もしくはそれを格納したリスト
+            margin (float, optional): 経路の外接矩形の幅と高さに対する余白の割合
+        Returns:
+            bbox (BBox): (x の最小値, y の最小値, x の最大値, y の最大値)
+        """
+        paths = self._as_paths(paths)
+        if paths:
+            xy = np.concatenate([self._path_coords(p) for p in paths])
+        else:
+            xy = np.column_stack((self.x, self.y))
+        (xmin, ymin), (xmax, ymax) = xy.min(axis=0), xy.max(axis=0)
+        # 経路が 1 点や直線の場合も範囲がつぶれないようにする
+        pad = max(xmax - xmin, ymax - ymin, 1e-4) * margin
+        return (float(xmin - pad), float(ymin - pad), float(xmax + pad), float(ymax + pad))
+
+    def draw_background(self, ax, bbox: BBox | None = None) -> None:
+        """ 表示範囲に重なる辺と頂点を ax に描画 """
+        segments = self.segments if bbox is None else clip_segments(self.segments, bbox)
+        ax.add_collection(LineCollection(segments, colors=NORMAL_EDGE_COLOR, linewidths=0.6, zorder=1))
+        if self.node_size > 0:
+            x, y = self.x, self.y
+            if bbox is not None:
+                inside = (x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3])
+                x, y = x[inside], y[inside]
+            ax.scatter(x, y, s=self.node_size, c=NORMAL_NODE_COLOR, linewidths=0, zorder=2)
+        if bbox is not None:
+            ax.set_xlim(bbox[0], bbox[2])
+            ax.set_ylim(bbox[1], bbox[3])
+        else:
+            ax.autoscale_view()
+        ax.set_aspect('equal', adjustable='box')
+        ax.set_axis_off()
+
+    def draw_paths(self, ax, paths: list[int] | list[list[int]] | None) -> list:
+        """ 経路と各経路の始点及び終点を強調して ax に描画し、追加した Artist のリストを返す """
+        paths = self._as_paths(paths)
+        if not paths:
+            return []
+        lines = LineCollection([self._path_coords(p) for p in paths], colors=EMPHASIZE_EDGE_COLOR, linewidths=2, zorder=3)
+        ends = self._path_coords([v for p in paths for v in (p[0], p[-1])])
+        return [ax.add_collection(lines),
+                ax.scatter(ends[:, 0], ends[:, 1], s=8 * max(self.node_size, 10), c=EMPHASIZE_NODE_COLOR, zorder=4)]
+
+    def background(self, bbox: BBox) -> tuple[Figure, object]:
+        """ 表示範囲 bbox の背景を描いた図を返す \n
+        bbox を含み、面積が bbox の 4 倍以下の範囲の背景を保持していれば、表示範囲だけを変えて使い回す。
+        """
+        area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+        for key, (fig, ax) in self.backgrounds.items():
+            contains = key[0] <= bbox[0] and key[1] <= bbox[1] and key[2] >= bbox[2] and key[3] >= bbox[3]
+            if contains and (key[2] - key[0]) * (key[3] - key[1]) <= 4 * area:
+                self.backgrounds.move_to_end(key)
+                break
+        else:
+            fig = Figure(figsize=self.figsize, dpi=self.dpi)
+            FigureCanvasAgg(fig)
+            ax = fig.add_axes((0, 0, 1, 1))
+            self.draw_background(ax, bbox)
+            self.backgrounds[bbox] = (fig, ax)
+            while len(self.backgrounds) > self.max_backgrounds:
+                self.backgrounds.popitem(last=False)
+        ax.set_xlim(bbox[0], bbox[2])
+        ax.set_ylim(bbox[1], bbox[3])
+        return fig, ax
+
+    def render(self, out_file: str, paths: list[int] | list[list[int]] | None = None, bbox: BBox | None = None,
+               margin: float = 0.1) -> str:
+        """ ネットワークと経路をファイルに書き出す \n
+        拡張子が .geojson もしくは .json ならば GeoJSON、それ以外は拡張子に応じた画像 (.png, .svg, .pdf など) を書き出す。
+        Args:
+            out_file (str): 書き出すファイルの path
+            paths (list[int] | list[list[int]], optional): 強調する経路もしくはそれを格納したリスト
+            bbox (BBox, optional): 表示範囲、省略時は経路を囲む範囲 (経路が無ければ全体)
+            margin (float, optional): 表示範囲を省略した場合の余白の割合、viewport を参照
+        Returns:
+            out_file (str): 書き出したファイルの path
+        """
+        if bbox is None:
+            bbox = self.viewport(paths, margin)
+        if out_file.lower().endswith(GEOJSON_SUFFIXES):
+            with open(out_file, 'w', encoding='utf-8') as f:
+                json.dump(self.to_geojson(paths, bbox), f)
+            return out_file
+        fig, ax = self.background(bbox)
+        artists = self.draw_paths(ax, paths)
+        try:
+            fig.savefig(out_file, format=os.path.splitext(out_file)[1][1:].lower() or 'png')
+        finally:
+            # 背景の図を使い回すため、経路の層だけを取り除く
+            for artist in artists:
+                artist.remove()
+        return out_file
+
+    def to_geojson(self, paths: list[int] | list[list[int]] | None = None, bbox: BBox | None = None,
+                   include_network: bool = True) -> dict:
+        """ ネットワークと経路を GeoJSON の FeatureCollection で返す \n
+        Args:
+            paths (list[int] | list[list[int]], optional): 経路もしくはそれを格納したリスト
+            bbox (BBox, optional): 辺を絞り込む範囲、省略時は全ての辺
+            include_network (bool, optional): 偽ならば経路と始点及び終点だけを含める
+        Returns:
+            geojson (dict): 辺は 'kind': 'edge'、経路は 'kind': 'path' と 'index'、始点及び終点は 'kind': 'stop' の Feature
+        """
+        features = []
+        if include_network:
+            segments = self.segments if bbox is None else clip_segments(self.segments, bbox)
+            features += [{'type': 'Feature', 'properties': {'kind': 'edge'},
+                          'geometry': {'type': 'LineString', 'coordinates': segment}} for segment in segments.tolist()]
+        for k, path in enumerate(self._as_paths(paths)):
+            xy = self._path_coords(path)
+            features.append({'type': 'Feature', 'properties': {'kind': 'path', 'index': k},
+                             'geometry': {'type': 'LineString', 'coordinates': xy.tolist()}})
+            for osmid, point in ((path[0], xy[0]), (path[-1], xy[-1])):
+                features.append({'type': 'Feature', 'properties': {'kind': 'stop', 'osmid': int(osmid), 'index': k},
+                                 'geometry': {'type': 'Point', 'coordinates': point.tolist()}})
+        if bbox is not None:
+            return {'type': 'FeatureCollection', 'bbox': list(bbox), 'features': features}
+        return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,74 @@
+import time
+import threading
+from typing import Callable
+
+
+class SolveControl:
+    """ 巡回路の改善を打ち切る条件と途中経過の通知を保持し、別のスレッドからの中止を受け付けるクラス \n
+    局所探索は改善する近傍を 1 つ適用するごとに巡回路が常に有効な状態にあるため、打ち切った時点の巡回路がそれまでで最良の巡回路となる。
+    """
+    def __init__(self, time_limit: float = None, max_moves: int = None, callback: Callable[[dict], None] = None,
+                 interval: float = 0.5) -> None:
+        """ 打ち切る条件と通知の設定を初期化 \n
+        Args:
+            time_limit (float, optional): 改善を打ち切るまでの経過時間 [s]、省略時は制限しない
+            max_moves (int, optional): 適用する改善の近傍の数の上限、省略時は制限しない
+            callback (Callable[[dict], None], optional): 途中経過を受け取る関数、探索しているスレッドで呼ばれる
+                引数は 'cost' (現在の巡回路のコスト), 'moves' (適用した近傍の数), 'elapsed' (経過時間 [s]),
+                'stopped' (打ち切った理由、打ち切っていなければ None) をキーとする辞書
+            interval (float, optional): 途中経過を通知する間隔 [s]
+        Attributes:
+            moves (int): start からの適用した近傍の数
+            stopped (str | None): 打ち切った理由、'cancelled', 'moves' もしくは 'time'
+        """
+        self.time_limit = time_limit
+        self.max_moves = max_moves
+        self.callback = callback
+        self.interval = interval
+        self.moves: int = 0
+        self.stopped: str | None = None
+        self._cancel = threading.Event()
+        self._start: float = time.perf_counter()
+        self._deadline: float | None = None
+        self._next_report: float = self._start
+
+    def start(self) -> None:
+        """ 経過時間と適用した近傍の数を数え始める、start より前に cancel した場合は中止したままとする """
+        self._start = time.perf_counter()
+        self._deadline = None if self.time_limit is None else self._start + self.time_limit
+        self._next_report = self._start + self.interval
+        self.moves = 0
+        self.stopped = None
+
+    def cancel(self) -> None:
+        """ 探索の中止を要求する、別のスレッドから呼んでよい """
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        """ start からの経過時間 [s] """
+        return time.perf_counter() - self._start
+
+    def should_stop(self) -> bool:
+        """ 中止の要求、近傍の数の上限もしくは経過時間の上限に達していれば理由を stopped に記録して真を返す """
+        if self.stopped is None:
+            if self._cancel.is_set():
+                self.stopped = 'cancelled'
+            elif self.max_moves is not None and self.moves >= self.max_moves:
+                self.stopped = 'moves'
+            elif self._deadline is not None and time.perf_counter() >= self._deadline:
+                self.stopped = 'time'
+        return self.stopped is not None
+
+    def report(self, cost: float, force: bool = False) -> None:
+        """ 前回の通知から interval 以上経過していれば (force が真ならば常に) 途中経過を callback に渡す """
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if force or now >= self._next_report:
+            self._next_report = now + self.interval
+            self.callback({'cost': float(cost), 'moves': self.moves, 'elapsed': now - self._start, 'stopped': self.stopped})
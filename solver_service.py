@@ -0,0 +1,313 @@
+import json
+import math
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import constant as c
+from main import get_node_osmids
+from spp import Dijkstra
+from tsp import TwoOpt
+from solve_control import SolveControl
+from cluster_tsp import solve_clustered
+
+_solver: Dijkstra | None = None   # ワーカープロセスが fork で引き継ぐ読み込み済みの道路ネットワーク
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+class ServiceError(Exception):
+    """ 要求に応えられない理由と、応答する HTTP のステータスコードを持つ例外 """
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+def _init_worker(solver: Dijkstra) -> None:
+    """ ワーカープロセスで共有する道路ネットワークを設定 """
+    global _solver
+    _solver = solver
+
+def _ping() -> None:
+    """ ワーカープロセスを起動させるための何もしない関数 """
+
+def _json_safe(value):
+    """ inf と nan を null に置き換え、JSON の規格の範囲の値にする (到達不能な組のコストなど) """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _json_safe(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    return value
+
+def _solve_tsp(V: list[int], dist_matrix, options: dict) -> dict:
+    """ ワーカープロセスで、親プロセスが求めた距離行列から巡回路を求める \n
+    最短経路の探索は行わず、継承した道路ネットワークの最短経路木のキャッシュ (とその排他制御) にも触れない。
+    Args:
+        V (list[int]): 巡回路に含む頂点の osmid のリスト
+        dist_matrix (np.ndarray): V の距離行列
+        options (dict): 'neighborhoods', 'grasp', 'seed', 'exact_threshold', 'time_limit', 'max_moves'
+            'time_limit' [s] もしくは 'max_moves' を指定した場合は局所探索をその上限で打ち切り、GRASP は行わない
+    Returns:
+        dict: TwoOpt.solve と同じ形式の 'tour_osmid', 'cost' ('paths' は None)
+    """
+    tsp_solver = TwoOpt.from_network(_solver, V, workers=1, exact_threshold=options.get('exact_threshold', 16),
+                                     dist_matrix=dist_matrix)
+    control = None
+    if 'time_limit' in options or 'max_moves' in options:
+        control = SolveControl(options.get('time_limit'), options.get('max_moves'))
+    result = tsp_solver.solve(neighborhoods=tuple(options.get('neighborhoods', ('2opt', 'oropt', 'or3'))), control=control,
+                              paths=False)
+    if options.get('grasp', 0) > 0 and control is None:
+        result = tsp_solver.grasp(options['grasp'], workers=1, seed=options.get('seed', 0),
+                                  neighborhoods=tuple(options.get('neighborhoods', ('2opt',))), paths=False)
+    return result
+
+def _solve_tsp_clustered(V: list[int], options: dict) -> dict:
+    """ ワーカープロセスで、頂点をクラスタに分けて巡回路を求める (cluster_tsp.solve_clustered を参照) \n
+    クラスタごとの距離行列と経路はこのワーカープロセスの中で順に求め、他の要求のために残りのワーカープロセスを空けておく。
+    """
+    return solve_clustered(_solver, V, options['cluster_size'], workers=1, exact_threshold=options.get('exact_threshold', 16),
+                           neighborhoods=tuple(options.get('neighborhoods', ('2opt', 'oropt', 'or3'))))
+
+
+class SolverService:
+    """ 道路ネットワークを一度だけ読み込み、JSON で受け取った SPP 及び TSP の要求に応える常駐サービス """
+    def __init__(self, node_csv_file: str, edge_csv_file: str, core: str = 'snapshot', workers: int = None,
+                 threads: int = None, cache_entries: int = 1024, cache_bytes: int = None) -> None:
+        """ 道路ネットワークを読み込み、ワーカープロセスを起動 \n
+        Args:
+            node_csv_file (str): 頂点に関する情報を格納した csv ファイルの path
+            edge_csv_file (str): 辺に関する情報を格納した csv ファイルの path
+            core (str, optional): グラフの保持形式、Network を参照
+            workers (int, optional): TSP を解くプロセス数、省略時は CPU 数
+            threads (int, optional): SPP を解くスレッド数、省略時は ThreadPoolExecutor の既定値
+            cache_entries (int, optional): 要求の間で共有する最短経路木の数の上限
+            cache_bytes (int, optional): 要求の間で共有する最短経路木のメモリ使用量の上限 [byte]
+        Attributes:
+            solver (Dijkstra): 読み込み済みの道路ネットワーク、SPP の最短経路木は全ての要求で共有する
+            process_pool (ProcessPoolExecutor): TSP の巡回路を求めるワーカープロセス、道路ネットワークは fork で引き継ぐ
+            thread_pool (ThreadPoolExecutor): SPP と TSP の距離行列を解くスレッド、最短経路木のキャッシュはスレッド間で排他制御する
+            requests (int): 受け付けた要求の数
+        """
+        self.solver = Dijkstra(node_csv_file, edge_csv_file, core, cache_entries=cache_entries, cache_bytes=cache_bytes)
+        self.workers = workers
+        self._pool_lock = threading.Lock()
+        # スレッドを作る前に fork して、読み込み済みのネットワークを子プロセスへ引き継ぐ
+        self.process_pool = self._start_process_pool()
+        self.thread_pool = ThreadPoolExecutor(threads)
+        self.requests: int = 0
+
+    def _start_process_pool(self) -> ProcessPoolExecutor:
+        """ 読み込み済みの道路ネットワークを引き継いだワーカープロセスを起動 """
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker, initargs=(self.solver,))
+        pool.submit(_ping).result()
+        return pool
+
+    def _restart_process_pool(self, broken: ProcessPoolExecutor) -> None:
+        """ 異常終了したワーカープロセスのプールを作り直す、同時に失敗した他の要求が既に作り直していれば何もしない \n
+        作り直すときはスレッドが動いているが、ワーカープロセスは最短経路木のキャッシュの排他制御を用いないため fork してよい。
+        """
+        with self._pool_lock:
+            if self.process_pool is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.process_pool = self._start_process_pool()
+
+    def resolve(self, points: list) -> list[int]:
+        """ osmid もしくは [緯度, 経度] で指定された地点を頂点の osmid に変換 \n
+        Args:
+            points (list): 要素は osmid (int) もしくは緯度と経度の組
+        Returns:
+            osmids (list[int]): 各地点に対応する頂点の osmid
+        """
+        coords = [tuple(p) for p in points if not isinstance(p, int)]
+        nearest = iter(get_node_osmids(coords, self.solver) if coords else [])
+        return [p if isinstance(p, int) else next(nearest) for p in points]
+
+    def check_nodes(self, osmids: list[int]) -> None:
+        """ 道路ネットワークに存在しない osmid があれば、ステータスコード 404 の ServiceError を送出 """
+        g = self.solver.graph
+        if g is not None:
+            missing = [v for v in osmids if v not in g.index]
+        else:
+            missing = [v for v in osmids if v not in self.solver.edges and v not in self.solver.nodes]
+        if missing:
+            raise ServiceError(404, f'unknown node osmid: {missing}')
+
+    def solve_spp(self, body: dict) -> dict:
+        """ 最短経路問題を解く \n
+        同じ始点の最短経路木は要求の間で共有し、キャッシュに残っていれば探索しない。
+        Args:
+            body (dict): 'start' と 'goal' に osmid もしくは [緯度, 経度]
+        Returns:
+            dict: 'start', 'goal' (osmid), 'cost', 'path', 'signals'
+        Raises:
+            ServiceError: 存在しない頂点を指定した場合 (404) と、終点に到達できない場合 (422)
+        """
+        start, goal = self.resolve([body['start'], body['goal']])
+        self.check_nodes([start, goal])
+        # 辞書で保持したグラフでは到達できない頂点はコストの辞書に含まれない
+        cost = self.solver.solve(start).get(goal, float('inf'))
+        if cost == float('inf'):
+            raise ServiceError(422, f'goal {goal} is unreachable from start {start}')
+        path = self.solver.get_shortest_path(start, goal)
+        return {'start': start, 'goal': goal, 'cost': cost, 'path': path, 'signals': self.solver.ct_traffic_signals(path)}
+
+    async def handle_spp(self, body: dict) -> dict:
+        """ SPP の要求をスレッドで解く """
+        return await asyncio.get_running_loop().run_in_executor(self.thread_pool, self.solve_spp, body)
+
+    def tsp_matrix(self, V: list[int]) -> np.ndarray:
+        """ TSP の距離行列を SPP と共有する最短経路木から求める \n
+        各頂点を始点とする最短経路木は、キャッシュに残っていれば探索せず、無ければ求めてキャッシュに追加する。
+        頂点数が cache_entries を超える要求は、他の要求の最短経路木をキャッシュから追い出す。
+        Args:
+            V (list[int]): 巡回路に含む頂点の osmid のリスト
+        Returns:
+            dist_matrix (np.ndarray): dist_matrix[i][j] は V[i] から V[j] までの最短経路のコスト (到達不能ならば inf)
+        """
+        dist_matrix = np.empty((len(V), len(V)))
+        for i, s in enumerate(V):
+            cost = self.solver.solve(s)
+            # 辞書で保持したグラフでは到達できない頂点はコストの辞書に含まれない
+            dist_matrix[i] = [cost.get(t, float('inf')) for t in V]
+        return dist_matrix
+
+    def tsp_paths(self, tour: list[int]) -> list[list[int]]:
+        """ 巡回路の各エッジの最短経路を共有する最短経路木から復元 (到達できないエッジは空のリスト) """
+        return [self.solver.get_shortest_path(a, b) for a, b in zip(tour, tour[1:])]
+
+    async def _run_in_process(self, fn, *args):
+        """ ワーカープロセスで fn を実行する \n
+        ワーカープロセスが異常終了した場合はプールを作り直して 1 度だけ実行し直し、再び失敗すれば 503 とする。
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self.process_pool
+            try:
+                return await loop.run_in_executor(pool, fn, *args)
+            except BrokenProcessPool as e:
+                await loop.run_in_executor(self.thread_pool, self._restart_process_pool, pool)
+                if attempt == 1:
+                    raise ServiceError(503, f'TSP worker process terminated abruptly: {e}') from e
+
+    async def handle_tsp(self, body: dict) -> dict:
+        """ TSP の要求を解く \n
+        距離行列と経路はスレッドで SPP と共有する最短経路木から求め、巡回路の改善だけをワーカープロセスで行う。
+        'cluster_size' を指定して頂点数がそれを超える場合は、頂点をクラスタに分けて 1 つのワーカープロセスで解く。
+        この場合は全ての組の距離行列を作らず、最短経路木も共有しない。
+        Args:
+            body (dict): 'stops' に osmid もしくは [緯度, 経度] のリスト、
+                省略可能な 'neighborhoods', 'grasp', 'seed', 'exact_threshold', 'time_limit', 'max_moves', 'cluster_size'
+                ('cluster_size' は cluster_tsp.MIN_CLUSTER_SIZE 以上、'grasp', 'time_limit', 'max_moves' は用いない)
+        Returns:
+            dict: TwoOpt.solve と同じ形式の 'tour_osmid', 'cost', 'paths' (到達できない組を含めばコストは null)
+        Raises:
+            ServiceError: 存在しない頂点を指定した場合 (404) と、ワーカープロセスが続けて異常終了した場合 (503)
+        """
+        loop = asyncio.get_running_loop()
+        V = await loop.run_in_executor(self.thread_pool, self.resolve, body['stops'])
+        self.check_nodes(V)
+        options = {key: body[key] for key in ('neighborhoods', 'grasp', 'seed', 'exact_threshold', 'time_limit', 'max_moves',
+                                              'cluster_size') if key in body}
+        if 'cluster_size' in options and len(V) > options['cluster_size']:
+            return await self._run_in_process(_solve_tsp_clustered, V, options)
+        dist_matrix = await loop.run_in_executor(self.thread_pool, self.tsp_matrix, V)
+        result = await self._run_in_process(_solve_tsp, V, dist_matrix, options)
+        result['paths'] = await loop.run_in_executor(self.thread_pool, self.tsp_paths, result['tour_osmid'])
+        return result
+
+    async def handle_stats(self, body: dict) -> dict:
+        """ 受け付けた要求の数と最短経路木のキャッシュの統計情報を返す """
+        return {'requests': self.requests, 'trees': self.solver.trees.stats()}
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple[int, dict]:
+        """ HTTP の要求を処理し、ステータスコードと応答の JSON を返す \n
+        要求の誤りは 400、存在しない経路や頂点は 404、到達できない終点は 422、それ以外のソルバの例外は 500 とする。
+        """
+        routes = {('POST', '/spp'): self.handle_spp, ('POST', '/tsp'): self.handle_tsp, ('GET', '/stats'): self.handle_stats}
+        handler = routes.get((method, path))
+        if handler is None:
+            return 404, {'error': f'no route for {method} {path}'}
+        self.requests += 1
+        try:
+            return 200, _json_safe(await handler(json.loads(body) if body else {}))
+        except ServiceError as e:
+            return e.status, {'error': str(e)}
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {'error': f'{type(e).__name__}: {e}'}
+        except Exception as e:
+            # ワーカープロセスの異常終了などでも、接続を切らずに応答を返す
+            return 500, {'error': f'{type(e).__name__}: {e}'}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ 1 つの接続で 1 つの HTTP/1.1 の要求を読み、JSON で応答して接続を閉じる """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if len(request_line) < 2:
+                status, result = 400, {'error': 'malformed request line'}
+            else:
+                status, result = await self.dispatch(request_line[0], request_line[1], body)
+        except (asyncio.IncompleteReadError, ValueError) as e:
+            status, result = 400, {'error': f'{type(e).__name__}: {e}'}
+        except Exception as e:
+            status, result = 500, {'error': f'{type(e).__name__}: {e}'}
+        try:
+            payload = json.dumps(result, allow_nan=False).encode()
+        except ValueError as e:
+            status, payload = 500, json.dumps({'error': f'{type(e).__name__}: {e}'}).encode()
+        try:
+            writer.write(f'HTTP/1.1 {status} {REASONS.get(status, "Error")}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080, unix_path: str = None) -> None:
+        """ HTTP サーバを起動し、停止されるまで要求を受け付ける \n
+        Args:
+            host (str, optional): 待ち受けるアドレス
+            port (int, optional): 待ち受けるポート番号
+            unix_path (str, optional): 指定した場合は TCP ではなくこの path の Unix ドメインソケットで待ち受ける
+        """
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        """ ワーカープロセスとスレッドを終了 """
+        self.process_pool.shutdown()
+        self.thread_pool.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='道路ネットワークを常駐させて SPP と TSP の要求に応えるサーバ')
+    parser.add_argument('--node-csv', default=c.Path.node_csv)
+    parser.add_argument('--edge-csv', default=c.Path.edge_csv)
+    parser.add_argument('--core', default='snapshot', choices=('dict', 'csr', 'snapshot'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', default=None, help='Unix ドメインソケットの path')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-entries', type=int, default=1024)
+    args = parser.parse_args()
+    service = SolverService(args.node_csv, args.edge_csv, args.core, args.workers, cache_entries=args.cache_entries)
+    print(c.FontColor.GREEN + f'serving on {args.unix or f"{args.host}:{args.port}"}' + c.FontColor.END)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -0,0 +1,124 @@
+import io
+import time
+import heapq
+import pstats
+import cProfile
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+_NULL_PHASE = nullcontext()
+
+
+class SolverStats:
+    """ 各段階の経過時間と探索の回数を記録する計測用のクラス、無効の場合は何も記録しない """
+    def __init__(self, enabled: bool = True, profile: bool = False) -> None:
+        """ 計測を初期化 \n
+        Args:
+            enabled (bool, optional): 偽ならば計測しない (計測箇所は何もしない関数や定数に置き換わる)
+            profile (bool, optional): 真ならば段階ごとに cProfile でプロファイルを取る
+        Attributes:
+            timers (Counter[str, float]): 段階の名前をキー、経過時間の合計 [s] を値とする
+            calls (Counter[str, int]): 段階の名前をキー、計測した回数を値とする
+            counters (Counter[str, int]): 'dijkstra.heap_pops' のような名前をキー、回数を値とする
+            profiles (dict[str, cProfile.Profile]): 段階の名前をキー、その段階のプロファイルを値とする
+        """
+        self.enabled: bool = enabled
+        self.profile: bool = profile and enabled
+        self.timers: Counter = Counter()
+        self.calls: Counter = Counter()
+        self.counters: Counter = Counter()
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self._profiling: bool = False
+
+    def phase(self, name: str):
+        """ with 文で囲んだ区間の経過時間を段階 name に加算するコンテキストマネージャを返す \n
+        profile が真ならば、入れ子になっていない段階について cProfile でプロファイルを取る。
+        Args:
+            name (str): 段階の名前
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return self._phase(name)
+
+    @contextmanager
+    def _phase(self, name: str):
+        profiler = None
+        if self.profile and not self._profiling:
+            profiler = self.profiles.setdefault(name, cProfile.Profile())
+            self._profiling = True
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - start
+            self.calls[name] += 1
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+
+    def count(self, name: str, k: int = 1) -> None:
+        """ 回数 name に k を加算 """
+        if self.enabled:
+            self.counters[name] += k
+
+    def merge(self, counters: dict) -> None:
+        """ 別のプロセスで数えた回数を加算 """
+        if self.enabled:
+            self.counters.update(counters)
+
+    def reset(self) -> None:
+        """ 記録した経過時間、回数及びプロファイルを全て破棄 """
+        self.timers.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.profiles.clear()
+
+    def as_dict(self) -> dict:
+        """ 記録した内容を JSON に変換できる辞書で返す \n
+        Returns:
+            stats (dict): 'timers', 'calls', 'counters'
+        """
+        return {'timers': dict(self.timers), 'calls': dict(self.calls), 'counters': dict(self.counters)}
+
+    def profile_report(self, name: str, sort: str = 'cumulative', limit: int = 20) -> str:
+        """ 段階 name のプロファイルを pstats の形式の文字列で返す \n
+        Args:
+            name (str): 段階の名前
+            sort (str, optional): 並べ替えの基準、pstats.Stats.sort_stats を参照
+            limit (int, optional): 表示する関数の数
+        Returns:
+            report (str): プロファイルの結果
+        """
+        out = io.StringIO()
+        pstats.Stats(self.profiles[name], stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def __repr__(self) -> str:
+        timers = ', '.join(f'{name}={seconds:.3f}s' for name, seconds in self.timers.items())
+        counters = ', '.join(f'{name}={k}' for name, k in self.counters.items())
+        return f'SolverStats({timers}; {counters})' if self.enabled else 'SolverStats(disabled)'
+
+def heap_ops(stats: SolverStats | None, prefix: str):
+    """ 優先度付きキューの操作を返す、計測が有効ならば回数を数える関数で包む \n
+    弧の緩和の回数は push しない緩和も含むため、距離を比較する呼び出し側で数える。
+    Args:
+        stats (SolverStats | None): 計測、None もしくは無効ならば heapq の関数をそのまま返す
+        prefix (str): 回数の名前の接頭辞
+    Returns:
+        push, pop: heapq.heappush, heapq.heappop と同じ引数をとる関数
+    """
+    if stats is None or not stats.enabled:
+        return heapq.heappush, heapq.heappop
+    counters = stats.counters
+    pushes, pops = f'{prefix}.heap_pushes', f'{prefix}.heap_pops'
+
+    def push(q: list, item) -> None:
+        counters[pushes] += 1
+        heapq.heappush(q, item)
+
+    def pop(q: list):
+        counters[pops] += 1
+        return heapq.heappop(q)
+
+    return push, pop
@@ -0,0 +1,199 @@
+import sys
+import threading
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Iterator
+from csr_graph import NodeArrayView, OsmidIndex
+
+def tree_nbytes(tree: Mapping) -> int:
+    """ 最短経路木のコストもしくは直前の頂点を格納したマッピングのおおよそのメモリ使用量を返す \n
+    Args:
+        tree (Mapping): 終点の osmid をキーとする辞書もしくは NodeArrayView
+    Returns:
+        nbytes (int): メモリ使用量の見積もり [byte]
+    """
+    if isinstance(tree, NodeArrayView):
+        return tree.values.nbytes
+    # 辞書本体に加えて、キーと値の int / float オブジェクトの分を見積もる
+    return sys.getsizeof(tree) + 2 * 32 * len(tree)
+
+def to_array_tree(index: OsmidIndex, cost: dict[int, float], prev: dict[int, int]) -> tuple[NodeArrayView, NodeArrayView]:
+    """ 辞書で表した最短経路木を、頂点の添字で並んだ配列に詰め直す \n
+    Args:
+        index (OsmidIndex): 全頂点の osmid と添字の対応
+        cost (dict[int, float]): 終点の osmid をキー、始点からのコストを値とする辞書
+        prev (dict[int, int]): 終点の osmid をキー、直前の頂点の osmid を値とする辞書
+    Returns:
+        cost (NodeArrayView): コストのビュー (到達していない頂点は inf)
+        prev (NodeArrayView): 直前の頂点のビュー (始点と到達していない頂点は -1)
+    """
+    keys = index.lookup(list(cost))
+    values = np.full(len(index), np.inf)
+    values[keys] = list(cost.values())
+    parents = np.full(len(index), -1, dtype=np.int64)
+    prev_keys = index.lookup(list(prev))
+    prev_values = np.array(list(prev.values()), dtype=np.int64)
+    has_parent = prev_values != -1
+    parents[prev_keys[has_parent]] = index.lookup(prev_values[has_parent])
+    return NodeArrayView(index, values), NodeArrayView(index, parents, as_osmid=True)
+
+
+class TreeCache:
+    """ 始点ごとの最短経路木を、エントリ数とメモリ使用量の上限の範囲で LRU 方式で保持するキャッシュ """
+    def __init__(self, max_entries: int = None, max_bytes: int = None) -> None:
+        """ キャッシュを初期化 \n
+        Args:
+            max_entries (int, optional): 保持する最短経路木の数の上限、省略時は上限なし
+            max_bytes (int, optional): 保持する最短経路木のメモリ使用量の上限 [byte]、省略時は上限なし
+        Attributes:
+            trees (OrderedDict[int, tuple[Mapping, Mapping, int]]): 始点の osmid をキー、(コスト, 直前の頂点, メモリ使用量) を値とし、最近使った順に並べたもの
+            nbytes (int): 保持している最短経路木のメモリ使用量の合計 [byte]
+            hits (int): キャッシュに最短経路木があった回数
+            misses (int): キャッシュに最短経路木が無かった回数
+            evictions (int): 上限を超えたために破棄した最短経路木の数
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.trees: OrderedDict[int, tuple[Mapping, Mapping, int]] = OrderedDict()
+        self.nbytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.lock = threading.Lock()
+
+    def get(self, start: int) -> tuple[Mapping, Mapping] | None:
+        """ 始点の最短経路木を取り出し、最近使ったものとして記録 \n
+        Args:
+            start (int): 始点の osmid
+        Returns:
+            tree (tuple[Mapping, Mapping] | None): (コスト, 直前の頂点)、無ければ None
+        """
+        with self.lock:
+            entry = self.trees.get(start)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.trees.move_to_end(start)
+            return entry[0], entry[1]
+
+    def put(self, start: int, cost: Mapping, prev: Mapping) -> None:
+        """ 始点の最短経路木を追加し、上限を超えた分を古いものから破棄 \n
+        Args:
+            start (int): 始点の osmid
+            cost (Mapping): 終点の osmid をキー、始点からのコストを値とするマッピング
+            prev (Mapping): 終点の osmid をキー、直前の頂点の osmid を値とするマッピング
+        """
+        nbytes = tree_nbytes(cost) + tree_nbytes(prev)
+        with self.lock:
+            if start in self.trees:
+                self.nbytes -= self.trees.pop(start)[2]
+            self.trees[start] = (cost, prev, nbytes)
+            self.nbytes += nbytes
+            while len(self.trees) > 1 and (
+                    (self.max_entries is not None and len(self.trees) > self.max_entries)
+                    or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                _, (_, _, evicted) = self.trees.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def __contains__(self, start: int) -> bool:
+        return start in self.trees
+
+    def items(self) -> list[tuple[int, Mapping, Mapping]]:
+        """ 保持している最短経路木を、最近使った順を変えずに (始点, コスト, 直前の頂点) のリストで返す """
+        with self.lock:
+            return [(start, cost, prev) for start, (cost, prev, _) in self.trees.items()]
+
+    def clear(self) -> None:
+        """ 全ての最短経路木を破棄 """
+        with self.lock:
+            self.trees.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """ キャッシュの統計情報を返す \n
+        Returns:
+            stats (dict): 'entries', 'nbytes', 'hits', 'misses', 'evictions', 'hit_rate'
+        """
+        total = self.hits + self.misses
+        return {'entries': len(self.trees), 'nbytes': self.nbytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / total if total else 0.0}
+
+
+class PathCache:
+    """ 始点と終点の組ごとの最短経路を、エントリ数とメモリ使用量の上限の範囲で LRU 方式で保持するキャッシュ """
+    def __init__(self, max_entries: int = None, max_bytes: int = None) -> None:
+        """ キャッシュを初期化 \n
+        Args:
+            max_entries (int, optional): 保持する経路の数の上限、省略時は上限なし
+            max_bytes (int, optional): 保持する経路のメモリ使用量の上限 [byte]、省略時は上限なし
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.paths: OrderedDict[tuple[int, int], tuple[list[int], int]] = OrderedDict()
+        self.nbytes: int = 0
+        self.evictions: int = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple[int, int]) -> list[int] | None:
+        """ 始点と終点の組の経路を取り出し、最近使ったものとして記録 (無ければ None) """
+        with self.lock:
+            entry = self.paths.get(key)
+            if entry is None:
+                return None
+            self.paths.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple[int, int], path: list[int]) -> None:
+        """ 始点と終点の組の経路を追加し、上限を超えた分を古いものから破棄 """
+        # リスト本体に加えて、要素の int オブジェクトの分を見積もる
+        nbytes = sys.getsizeof(path) + 32 * len(path)
+        with self.lock:
+            if key in self.paths:
+                self.nbytes -= self.paths.pop(key)[1]
+            self.paths[key] = (path, nbytes)
+            self.nbytes += nbytes
+            while len(self.paths) > 1 and (
+                    (self.max_entries is not None and len(self.paths) > self.max_entries)
+                    or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                _, (_, evicted) = self.paths.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def __contains__(self, key: tuple[int, int]) -> bool:
+        return key in self.paths
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def clear(self) -> None:
+        """ 全ての経路を破棄 """
+        with self.lock:
+            self.paths.clear()
+            self.nbytes = 0
+
+
+class TreeField(Mapping):
+    """ TreeCache のコストまたは直前の頂点を、始点の osmid をキーとする読み取り専用の辞書として見せるビュー """
+    def __init__(self, cache: TreeCache, field: int) -> None:
+        """ ビューを初期化 \n
+        Args:
+            cache (TreeCache): 最短経路木のキャッシュ
+            field (int): 0 ならばコスト、1 ならば直前の頂点
+        """
+        self.cache = cache
+        self.field = field
+
+    def __getitem__(self, start: int) -> Mapping:
+        return self.cache.trees[start][self.field]
+
+    def __contains__(self, start) -> bool:
+        return start in self.cache.trees
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self.cache.trees))
+
+    def __len__(self) -> int:
+        return len(self.cache.trees)
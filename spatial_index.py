@@ -0,0 +1,96 @@
+import numpy as np
+import constant as c
+
+EARTH_RADIUS = 6371008.8    # 地球の平均半径 [m]
+
+class NodeGrid:
+    """ 頂点の緯度経度を一様な格子に振り分け、座標から最も近い頂点をまとめて求める空間索引 """
+    def __init__(self, osmids, x, y, cell_size: float = c.MarginDist.search_radius_for_nearest_node) -> None:
+        """ 格子を構築 \n
+        Args:
+            osmids (array_like): 頂点の osmid
+            x (array_like): 頂点の経度
+            y (array_like): 頂点の緯度
+            cell_size (float, optional): 格子の一辺の長さ [m]、最大探索半径以上にする
+        Attributes:
+            lat0 (float): 平面に投影する際の基準緯度
+            px, py (np.ndarray): 各頂点を基準緯度で平面に投影した座標 [m]
+            nx, ny (int): 格子の列数と行数
+            cell_keys (np.ndarray): 頂点を格子番号の昇順に並べたときの格子番号
+            cell_order (np.ndarray): 頂点を格子番号の昇順に並べる添字
+        """
+        self.osmids = np.asarray(osmids, dtype=np.int64)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.lat0 = float(y.mean()) if len(y) else 0.0
+        self.px, self.py = self._project(x, y)
+        self.x0 = float(self.px.min()) if len(x) else 0.0
+        self.y0 = float(self.py.min()) if len(y) else 0.0
+        cx, cy = self._cell(self.px, self.py)
+        self.nx = int(cx.max()) + 1 if len(x) else 1
+        self.ny = int(cy.max()) + 1 if len(y) else 1
+        keys = cx * self.ny + cy
+        self.cell_order = np.argsort(keys, kind='stable')
+        self.cell_keys = keys[self.cell_order]
+
+    def _project(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ 経度緯度を基準緯度まわりの正距円筒図法で平面座標 [m] に変換 """
+        k = np.pi / 180 * EARTH_RADIUS
+        return x * k * np.cos(np.radians(self.lat0)), y * k
+
+    def _cell(self, px: np.ndarray, py: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ 平面座標が属する格子の列番号と行番号を返す """
+        cx = np.floor((px - self.x0) / self.cell_size).astype(np.int64)
+        cy = np.floor((py - self.y0) / self.cell_size).astype(np.int64)
+        return cx, cy
+
+    def nearest(self, coords, max_dist: float = c.MarginDist.search_radius_for_nearest_node) -> tuple[np.ndarray, np.ndarray]:
+        """ 複数の座標それぞれに最も近い頂点を一括で求める \n
+        Args:
+            coords (array_like): (緯度, 経度) の組を並べた配列、constant.Spot.Coordinate と同じ順序
+            max_dist (float, optional): 頂点とみなす最大距離 [m]、格子の一辺の長さ以下
+        Returns:
+            osmids (np.ndarray): 各座標に最も近い頂点の osmid、max_dist 以内に頂点が無ければ -1
+            dists (np.ndarray): 各座標から選ばれた頂点までの距離 [m]、見つからなければ inf
+        """
+        if max_dist > self.cell_size:
+            raise ValueError(f'max_dist ({max_dist} m) must not exceed the grid cell size ({self.cell_size} m)')
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        q = len(coords)
+        qx, qy = self._project(coords[:, 1], coords[:, 0])
+        qcx, qcy = self._cell(qx, qy)
+
+        # 周囲 3x3 の格子に含まれる頂点を候補として列挙
+        cand_q, cand_v = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cx, cy = qcx + dx, qcy + dy
+                valid = (cx >= 0) & (cx < self.nx) & (cy >= 0) & (cy < self.ny)
+                keys = cx * self.ny + cy
+                lo = np.searchsorted(self.cell_keys, keys, side='left')
+                hi = np.searchsorted(self.cell_keys, keys, side='right')
+                counts = np.where(valid, hi - lo, 0)
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                qi = np.repeat(np.arange(q), counts)
+                start = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+                cand_q.append(qi)
+                cand_v.append(self.cell_order[start + np.arange(total)])
+
+        osmids = np.full(q, -1, dtype=np.int64)
+        dists = np.full(q, np.inf)
+        if not cand_q:
+            return osmids, dists
+        qi = np.concatenate(cand_q)
+        vi = np.concatenate(cand_v)
+        d = np.hypot(self.px[vi] - qx[qi], self.py[vi] - qy[qi])
+        # 座標ごとに距離が最小の候補を選ぶ
+        order = np.lexsort((d, qi))
+        first = np.unique(qi[order], return_index=True)[1]
+        best = order[first]
+        hit = d[best] <= max_dist
+        osmids[qi[best][hit]] = self.osmids[vi[best][hit]]
+        dists[qi[best][hit]] = d[best][hit]
+        return osmids, dists
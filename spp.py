@@ -1,32 +1,82 @@
-import heapq
+import os
+import copy
+import numpy as np
 from my_network import Network 
-from typing import Dict
+from csr_graph import NodeArrayView, OsmidIndex
+from sp_cache import PathCache, TreeCache, TreeField, to_array_tree
+from contraction_hierarchy import ContractionHierarchy, network_arcs, graph_fingerprint
+from solver_stats import SolverStats, heap_ops
+from dynamic_sssp import ArrayTree, DictTree, repair_tree
+from typing import Dict, Mapping
 
 class Dijkstra(Network):
     """ 継承元が Network クラスである最短経路問題をダイクストラ法で解くクラス """
-    def __init__(self, node_csv_file: str, edge_csv_file: str) -> None:
+    def __init__(self, node_csv_file: str, edge_csv_file: str, core: str = 'dict',
+                 cache_entries: int = None, cache_bytes: int = None, compact_trees: bool = False,
+                 stats: SolverStats = None) -> None:
         """ ネットワーク及び最短経路を求めるために必要な変数を初期化 \n
         Args:
             node_csv_file (str): 頂点に関する情報を格納した csv ファイルの path
             edge_csv_file (str): 辺に関する情報を格納した csv ファイルの path
+            core (str, optional): グラフの保持形式、'dict', 'csr' または 'snapshot'
+            cache_entries (int, optional): 保持する最短経路木の数の上限、超えた分は最も長く使われていないものから破棄
+                solve_pair で求めた経路も別にこの数まで保持する
+            cache_bytes (int, optional): 保持する最短経路木のメモリ使用量の上限 [byte]、solve_pair で求めた経路も別にこの大きさまで保持する
+            compact_trees (bool, optional): 真ならば core が 'dict' でも最短経路木を辞書ではなく配列で保持
+            stats (SolverStats, optional): 'dijkstra' の時間とヒープ操作・弧の緩和の回数を記録する計測、Network を参照
         Attributes:
-            cost (Dict[int, Dict[int, float]]): 各頂点から各頂点までのコストを格納
+            trees (TreeCache): 始点ごとの最短経路木のキャッシュ
+            cost (Mapping[int, Mapping[int, float]]): 各頂点から各頂点までのコストを格納 (trees の読み取り専用のビュー)
                 key (int): 始点の osmid
                 value (dict): 始点からのコストを格納する辞書
                     key (int): 終点の osmid
                     value (float): 始点から終点までのコスト
-            prev (Dict[int, Dict[int, int]]): 最短経路において、各頂点の直前の頂点を格納
+            prev (Mapping[int, Mapping[int, int]]): 最短経路において、各頂点の直前の頂点を格納 (trees の読み取り専用のビュー)
                 key (int): 始点の osmid
                 value (dict): 最短経路の直前の頂点を格納する辞書
                     key (int): 終点の osmid
                     value (int): 最短経路において、終点の前の頂点の osmid
+            pair_paths (PathCache): solve_pair で求めた始点と終点の組ごとの最短経路のキャッシュ
+            reverse_graph (CSRGraph | None): 双方向探索の後ろ向き探索に用いる弧を反転したグラフ、初めて使うときに構築
+            hierarchy (ContractionHierarchy | None): use_hierarchy で前処理した縮約階層、設定されていれば solve_pair で用いる
+            tree_index (OsmidIndex | None): compact_trees が真のときに最短経路木の配列の添字に用いる対応表
+            base_costs (Dict[tuple[int, int], float]): update_edges で変更した弧の元のコスト
+            shares_costs (bool): 真ならば辺のコストと最短経路木のキャッシュを他のインスタンスと共有しており、
+                update_edges で初めて書き換える前に複製する (TwoOpt.from_network を参照)
         """
-        super().__init__(node_csv_file, edge_csv_file)
-        self.cost: Dict[int, Dict[int, float]] = {}
-        self.prev: Dict[int, Dict[int, float]] = {}
+        super().__init__(node_csv_file, edge_csv_file, core, stats)
+        self.trees = TreeCache(cache_entries, cache_bytes)
+        self.cost = TreeField(self.trees, 0)
+        self.prev = TreeField(self.trees, 1)
+        self.tree_index: OsmidIndex | None = None
+        if compact_trees and self.graph is None:
+            self.tree_index = OsmidIndex(np.array(sorted(set(self.nodes) | set(self.edges)), dtype=np.int64))
+        self.pair_paths = PathCache(cache_entries, cache_bytes)
+        self.reverse_graph = None
+        self.hierarchy: ContractionHierarchy | None = None
+        self.base_costs: Dict[tuple[int, int], float] = {}
+        self._edge_arcs: Dict[int, list[tuple[int, int]]] | None = None
+        self.shares_costs: bool = False
+
+    def prune(self, keep: list[int] = None) -> dict:
+        """ グラフを縮約し、縮約前のグラフに基づく最短経路木などを破棄する、Network.prune を参照 """
+        summary = super().prune(keep)
+        self.trees = TreeCache(self.trees.max_entries, self.trees.max_bytes)
+        self.cost = TreeField(self.trees, 0)
+        self.prev = TreeField(self.trees, 1)
+        self.tree_index = None
+        self.pair_paths = PathCache(self.pair_paths.max_entries, self.pair_paths.max_bytes)
+        self.reverse_graph = None
+        self.hierarchy = None
+        self.base_costs = {}
+        self._edge_arcs = None
+        # 縮約したグラフと最短経路木のキャッシュは作り直したため、他のインスタンスとは共有しない
+        self.shares_costs = False
+        return summary
 
     def solve(self, start: int) -> list[float]:
         """ ダイクストラ法を用いて最短経路とその時のコストを求める \n
+        同じ始点の最短経路木がキャッシュに残っていれば、探索せずにそれを返す。
         Args:
             start (int): 最短経路問題における始点の osmid
         Return:
@@ -34,33 +84,381 @@ class Dijkstra(Network):
                 key: 終点の osmid
                 value: 始点から全ての頂点までの最短経路のコスト
         """
-        self.cost[start] = {start: 0}
-        self.prev[start] = {start: -1}
-        q = []
-        heapq.heappush(q, (0, start))
+        return self._tree(start)[0]
+
+    def _tree(self, start: int) -> tuple[Mapping, Mapping]:
+        """ 始点の最短経路木をキャッシュから取り出し、無ければダイクストラ法で求めてキャッシュに追加 \n
+        他のスレッドが同時にキャッシュを更新しても、返した最短経路木は破棄されずに使える。
+        Args:
+            start (int): 最短経路問題における始点の osmid
+        Return:
+            cost (Mapping[int, float]): 終点の osmid をキー、始点からの最短経路のコストを値とするマッピング
+            prev (Mapping[int, int]): 終点の osmid をキー、最短経路の直前の頂点の osmid を値とするマッピング
+        """
+        cached = self.trees.get(start)
+        if cached is not None:
+            return cached
+        with self.stats.phase('dijkstra'):
+            self.stats.count('dijkstra.searches')
+            self.stats.count('dijkstra.heap_pushes')
+            if self.graph is not None:
+                cost, prev = self._solve_csr(start)
+            else:
+                cost, prev = self._solve_dict(start)
+        self.trees.put(start, cost, prev)
+        return cost, prev
+
+    def _solve_dict(self, start: int) -> tuple[Mapping, Mapping]:
+        """ 辞書で保持したグラフ上でダイクストラ法を用いて最短経路とその時のコストを求める \n
+        Args:
+            start (int): 最短経路問題における始点の osmid
+        Return:
+            cost (Mapping[int, float]): 終点の osmid をキー、始点からの最短経路のコストを値とするマッピング
+            prev (Mapping[int, int]): 終点の osmid をキー、最短経路の直前の頂点の osmid を値とするマッピング
+        """
+        push, pop = heap_ops(self.stats, 'dijkstra')
+        cost = {start: 0}
+        prev = {start: -1}
+        q = [(0, start)]
+        relaxed = 0
         while q != []:
-            d, u = heapq.heappop(q)
-            if(self.cost[start][u] < d):
+            d, u = pop(q)
+            if(cost[u] < d):
                 continue
-            for v in self.edges[u]:
-                if (v not in self.cost[start]) or (self.cost[start][v] > self.cost[start][u] + self.edges[u][v]['cost']):
-                    self.cost[start][v] = self.cost[start][u] + self.edges[u][v]['cost']
-                    self.prev[start][v] = u
-                    heapq.heappush(q, (self.cost[start][v], v))
-        return self.cost[start]
+            relaxed += len(self.edges[u])
+            for v, edge in self.edges[u].items():
+                # 通行止めの弧はたどらず、到達できない頂点をコストの辞書に含めない
+                if edge['cost'] == float('inf'):
+                    continue
+                if (v not in cost) or (cost[v] > cost[u] + edge['cost']):
+                    cost[v] = cost[u] + edge['cost']
+                    prev[v] = u
+                    push(q, (cost[v], v))
+        self.stats.count('dijkstra.relaxations', relaxed)
+        if self.tree_index is not None:
+            cost, prev = to_array_tree(self.tree_index, cost, prev)
+        return cost, prev
+
+    def _solve_csr(self, start: int) -> tuple[NodeArrayView, NodeArrayView]:
+        """ CSR 形式のグラフ上でダイクストラ法を用いて最短経路とその時のコストを求める \n
+        Args:
+            start (int): 最短経路問題における始点の osmid
+        Return:
+            cost (NodeArrayView): 終点の osmid をキー、始点からの最短経路のコストを値とするビュー (到達不能ならば inf)
+            prev (NodeArrayView): 終点の osmid をキー、最短経路の直前の頂点の osmid を値とするビュー
+        """
+        push, pop = heap_ops(self.stats, 'dijkstra')
+        g = self.graph
+        s = g.index[start]
+        dist = [float('inf')] * g.n
+        prev = [-1] * g.n
+        dist[s] = 0
+        q = [(0, s)]
+        relaxed = 0
+        while q:
+            d, u = pop(q)
+            if dist[u] < d:
+                continue
+            targets, costs = g.arcs(u)
+            relaxed += len(targets)
+            for v, c in zip(targets, costs):
+                if dist[v] > d + c:
+                    dist[v] = d + c
+                    prev[v] = u
+                    push(q, (dist[v], v))
+        self.stats.count('dijkstra.relaxations', relaxed)
+        return (NodeArrayView(g.index, np.array(dist, dtype=np.float64)),
+                NodeArrayView(g.index, np.array(prev, dtype=np.int64), as_osmid=True))
+
+    def use_hierarchy(self, path: str = None, settle_limit: int = 500) -> ContractionHierarchy:
+        """ 縮約階層を前処理し、以降の solve_pair で用いる \n
+        path に同じグラフから作った縮約階層が保存されていれば読み込み、無ければ構築して保存する。
+        Args:
+            path (str, optional): 縮約階層を保存する .npz ファイルの path、省略時は保存しない
+            settle_limit (int, optional): 証人探索で確定させる頂点数の上限
+        Returns:
+            hierarchy (ContractionHierarchy): 用いる縮約階層
+        """
+        if path is not None and os.path.exists(path):
+            hierarchy = ContractionHierarchy.load(path)
+            if hierarchy.fingerprint == graph_fingerprint(*network_arcs(self)):
+                self.hierarchy = hierarchy
+                return hierarchy
+        self.hierarchy = ContractionHierarchy.build(self, settle_limit)
+        if path is not None:
+            self.hierarchy.save(path)
+        return self.hierarchy
+
+    def solve_pair(self, start: int, goal: int) -> float:
+        """ 始点と終点の両側から探索する双方向ダイクストラ法で 2 点間の最短経路とその時のコストを求める \n
+        両方向の探索の先頭のコストの和が暫定の最短経路のコスト以上になった時点で探索を打ち切る。
+        後ろ向きの探索は弧を反転して行うため、一方通行の逆走方向 (コストが inf の弧) は通らない。
+        Args:
+            start (int): 最短経路問題における始点の osmid
+            goal (int): 最短経路問題における終点の osmid
+        Return:
+            cost (float): 始点から終点までの最短経路のコスト (到達不能ならば inf)
+        """
+        with self.stats.phase('solve_pair'):
+            return self._solve_pair(start, goal)
+
+    def _solve_pair(self, start: int, goal: int) -> float:
+        """ solve_pair の本体 """
+        if self.hierarchy is not None:
+            cost = self.hierarchy.query(start, goal)
+            self.pair_paths.put((start, goal), self.expand_path(self.hierarchy.get_shortest_path(start, goal)))
+            return cost
+        if self.graph is not None:
+            if self.reverse_graph is None:
+                self.reverse_graph = self.graph.reverse()
+            s, t = self.graph.index[start], self.graph.index[goal]
+            expand = (self.graph.arcs, self.reverse_graph.arcs)
+        else:
+            s, t = start, goal
+            def _forward(u):
+                return list(self.edges[u]), [edge['cost'] for edge in self.edges[u].values()]
+            def _backward(v):
+                # edges は両方向の弧を持つため、v の隣接頂点 u が弧 (u, v) の始点の候補となる
+                return list(self.edges[v]), [self.edges[u][v]['cost'] for u in self.edges[v]]
+            expand = (_forward, _backward)
+
+        push, pop = heap_ops(self.stats, 'solve_pair')
+        self.stats.count('solve_pair.heap_pushes', 2)
+        dist = ({s: 0}, {t: 0})
+        prev = ({s: -1}, {t: -1})
+        q = ([(0, s)], [(0, t)])
+        best = 0 if s == t else float('inf')
+        meet = s if s == t else None
+        relaxed = 0
+        while q[0] and q[1] and q[0][0][0] + q[1][0][0] < best:
+            side = 0 if q[0][0][0] <= q[1][0][0] else 1
+            d, u = pop(q[side])
+            if dist[side][u] < d:
+                continue
+            targets, costs = expand[side](u)
+            relaxed += len(targets)
+            for v, c in zip(targets, costs):
+                if c == float('inf'):
+                    continue
+                if d + c < dist[side].get(v, float('inf')):
+                    dist[side][v] = d + c
+                    prev[side][v] = u
+                    push(q[side], (d + c, v))
+                # 両方向の探索が出会った頂点を経由する経路で暫定解を更新
+                if v in dist[1 - side] and dist[side][v] + dist[1 - side][v] < best:
+                    best = dist[side][v] + dist[1 - side][v]
+                    meet = v
+        self.stats.count('solve_pair.relaxations', relaxed)
+
+        path = []
+        if meet is not None:
+            u = meet
+            while u != -1:
+                path.append(u)
+                u = prev[0][u]
+            path.reverse()
+            u = prev[1][meet]
+            while u != -1:
+                path.append(u)
+                u = prev[1][u]
+            if self.graph is not None:
+                path = self.graph.osmids[self.graph.expand_path(path)].tolist()
+        self.pair_paths.put((start, goal), path)
+        return best
+
+    def _arc_position(self, graph, u: int, v: int) -> int:
+        """ CSR 形式のグラフで添字 u から v への弧の位置を返す """
+        a, b = graph.offsets[u], graph.offsets[u + 1]
+        hit = np.flatnonzero(graph.targets[a:b] == v)
+        if len(hit) == 0:
+            raise KeyError((u, v))
+        return int(a + hit[0])
+
+    def arc_cost(self, u: int, v: int) -> float:
+        """ 弧 (u, v) の現在のコストを返す \n
+        Args:
+            u (int): 弧の始点の osmid
+            v (int): 弧の終点の osmid
+        Returns:
+            cost (float): 弧のコスト (通行できなければ inf)
+        """
+        if self.graph is None:
+            return self.edges[u][v]['cost']
+        g = self.graph
+        return float(g.costs[self._arc_position(g, g.index[u], g.index[v])])
+
+    def _set_arc_cost(self, u: int, v: int, cost: float) -> None:
+        """ 弧 (u, v) のコストを書き換える、CSR 形式の場合は転置グラフも合わせて書き換える """
+        if self.graph is None:
+            self.edges[u][v]['cost'] = cost
+            return
+        g = self.graph
+        if not g.costs.flags.writeable:
+            # スナップショットの読み取り専用のメモリマップは、初めて書き換えるときに複製する
+            g.costs = np.array(g.costs)
+        i, j = g.index[u], g.index[v]
+        g.costs[self._arc_position(g, i, j)] = cost
+        if self.reverse_graph is not None:
+            self.reverse_graph.costs[self._arc_position(self.reverse_graph, j, i)] = cost
+
+    def _resolve_arcs(self, key: int | tuple[int, int]) -> list[tuple[int, int]]:
+        """ 弧 (u, v) もしくは辺の osmid を、変更する弧の (u, v) のリストに変換 \n
+        辺の osmid の場合は、元のコストが有限の弧 (一方通行の逆走方向を除く) を全て返す。
+        Raises:
+            KeyError: 弧もしくは辺がグラフに存在しない場合
+            ValueError: prune で縮約もしくは削除した頂点を端点とする弧を指定した場合
+        """
+        if isinstance(key, tuple):
+            try:
+                self.arc_cost(*key)
+            except KeyError:
+                g = self.graph
+                if g is not None and g.active is not None and all(x in g.index for x in key) \
+                        and not all(g.active[g.index[x]] for x in key):
+                    raise ValueError(f'弧 {key} は prune で縮約もしくは削除した頂点を端点とするため変更できません'
+                                     '、縮約した弧の両端の頂点を指定するか prune の前に変更してください') from None
+                raise
+            return [key]
+        if self._edge_arcs is None:
+            self._edge_arcs = {}
+            if self.graph is None:
+                for u, adjacent in self.edges.items():
+                    for v, edge in adjacent.items():
+                        if self.base_costs.get((u, v), edge['cost']) != float('inf'):
+                            self._edge_arcs.setdefault(edge['osmid'], []).append((u, v))
+            else:
+                g = self.graph
+                src = np.repeat(g.osmids, np.diff(g.offsets))
+                dst = g.osmids[g.targets]
+                for k in np.flatnonzero(np.isfinite(g.costs)):
+                    self._edge_arcs.setdefault(g.edge_osmid(k), []).append((int(src[k]), int(dst[k])))
+        if key not in self._edge_arcs:
+            raise KeyError(key)
+        return self._edge_arcs[key]
+
+    def _own_costs(self) -> None:
+        """ 他のインスタンスと共有している辺のコストと最短経路木のキャッシュを、書き換える前に複製する \n
+        辞書で保持したグラフは辺の属性の辞書を、CSR 形式のグラフはコストの配列を複製し、最短経路木のキャッシュは空にする。
+        """
+        if not self.shares_costs:
+            return
+        if self.graph is None:
+            self.edges = {u: {v: dict(edge) for v, edge in adjacent.items()} for u, adjacent in self.edges.items()}
+        else:
+            self.graph = copy.copy(self.graph)
+            self.graph.costs = np.array(self.graph.costs)
+            if self.reverse_graph is not None:
+                self.reverse_graph = copy.copy(self.reverse_graph)
+                self.reverse_graph.costs = np.array(self.reverse_graph.costs)
+        self.trees = TreeCache(self.trees.max_entries, self.trees.max_bytes)
+        self.cost = TreeField(self.trees, 0)
+        self.prev = TreeField(self.trees, 1)
+        self.pair_paths = PathCache(self.pair_paths.max_entries, self.pair_paths.max_bytes)
+        self.base_costs = dict(self.base_costs)
+        self._edge_arcs = None
+        self.shares_costs = False
+
+    def update_edges(self, changes: Mapping, scale: bool = False) -> list[tuple[int, int, float, float]]:
+        """ 辺のコストを変更し、キャッシュにある最短経路木のうち変更の影響を受ける部分だけを修復 \n
+        双方向探索の結果、縮約階層及び描画用の辺の座標は変更後のグラフと一致しなくなるため破棄する (縮約階層は use_hierarchy で作り直す)。
+        shares_costs が真ならば、共有している辺のコストを書き換えずに複製してから変更する。
+        Args:
+            changes (Mapping): キーは弧の端点の osmid の組 (u, v) もしくは辺の osmid、値は新しいコスト (inf で通行止め)
+                辺の osmid を指定した場合は、その辺の通行可能な全ての向きの弧を変更する
+            scale (bool, optional): 真ならば値を元のコストに掛ける倍率とみなす (渋滞の度合いなど)
+        Returns:
+            applied (list[tuple[int, int, float, float]]): 実際に変更した弧の (u, v, 変更前のコスト, 変更後のコスト)
+        """
+        applied = []
+        with self.stats.phase('update_edges'):
+            self._own_costs()
+            for key, value in changes.items():
+                for u, v in self._resolve_arcs(key):
+                    old = self.arc_cost(u, v)
+                    base = self.base_costs.setdefault((u, v), old)
+                    new = base * value if scale else float(value)
+                    if new != old:
+                        self._set_arc_cost(u, v, new)
+                        applied.append((u, v, old, new))
+            if applied:
+                self.pair_paths.clear()
+                self.hierarchy = None
+                self.renderer = None
+                self.stats.count('update_edges.arcs', len(applied))
+                self.stats.count('update_edges.tree_updates', self._repair_trees(applied))
+        return applied
+
+    def close_edges(self, keys: list) -> list[tuple[int, int, float, float]]:
+        """ 辺を通行止めにする \n
+        Args:
+            keys (list): 弧の端点の osmid の組 (u, v) もしくは辺の osmid のリスト
+        Returns:
+            applied (list[tuple[int, int, float, float]]): update_edges を参照
+        """
+        return self.update_edges({key: float('inf') for key in keys})
+
+    def restore_edges(self, keys: list = None) -> list[tuple[int, int, float, float]]:
+        """ update_edges で変更した辺のコストを元に戻す \n
+        Args:
+            keys (list, optional): 弧の端点の osmid の組 (u, v) もしくは辺の osmid のリスト、省略時は全て
+        Returns:
+            applied (list[tuple[int, int, float, float]]): update_edges を参照
+        """
+        arcs = list(self.base_costs) if keys is None else [arc for key in keys for arc in self._resolve_arcs(key)]
+        return self.update_edges({arc: self.base_costs[arc] for arc in arcs if arc in self.base_costs})
+
+    def _repair_trees(self, applied: list[tuple[int, int, float, float]]) -> int:
+        """ キャッシュにある全ての最短経路木を、弧のコストの変更に合わせて修復 \n
+        Returns:
+            updated (int): 修復で更新した頂点の延べ数
+        """
+        updated = 0
+        if self.graph is not None:
+            g = self.graph
+            if self.reverse_graph is None:
+                self.reverse_graph = g.reverse()
+            changes = [(g.index[u], g.index[v], old, new) for u, v, old, new in applied]
+            in_arcs = lambda x: zip(*self.reverse_graph.arcs(x))
+            out_arcs = lambda x: zip(*g.arcs(x))
+        elif self.tree_index is not None:
+            index, osmids = self.tree_index, self.tree_index.osmids
+            changes = [(index[u], index[v], old, new) for u, v, old, new in applied]
+            in_arcs = lambda x: [(index[w], self.edges[w][osmids[x]]['cost']) for w in self.edges.get(int(osmids[x]), {})]
+            out_arcs = lambda x: [(index[y], edge['cost']) for y, edge in self.edges.get(int(osmids[x]), {}).items()]
+        else:
+            changes = applied
+            in_arcs = lambda x: [(w, self.edges[w][x]['cost']) for w in self.edges.get(x, {})]
+            out_arcs = lambda x: [(y, edge['cost']) for y, edge in self.edges.get(x, {}).items()]
+        for _, cost, prev in self.trees.items():
+            if isinstance(cost, NodeArrayView):
+                tree = ArrayTree(cost.values, prev.values)
+            else:
+                tree = DictTree(cost, prev)
+            updated += repair_tree(tree, changes, in_arcs, out_arcs)
+        return updated
 
     def get_shortest_path(self, start: int, goal: int) -> list[int]:
         """ 最短経路を求める  \n
+        solve_pair で求めた組であればその経路を、そうでなければ solve で求めた最短経路木から経路を返す。
+        始点の最短経路木がキャッシュから破棄されている場合は solve で求め直す。
         Args:
             start (int): 最短経路問題における始点の osmid
             goal (int): 最短経路問題における終点の osmid
         Returns:
-            path (list[int]): 要素は各頂点の osmid で、始点から終点までの最短経路を表すリストを返す
+            path (list[int]): 要素は各頂点の osmid で、始点から終点までの最短経路を表すリストを返す (到達できなければ空のリスト)
         """
+        if start not in self.prev:
+            path = self.pair_paths.get((start, goal))
+            if path is not None:
+                return list(path)
+        cost, prev = self._tree(start)
+        if cost.get(goal, float('inf')) == float('inf'):
+            # 保持形式によらず、到達できない終点は solve_pair と同じく空の経路とする
+            return []
         path = []
         u = goal
         while u != -1:
             path.append(u)
-            u = self.prev[start][u]
+            u = prev[u]
         path.reverse()
-        return path
+        return self.expand_path(path)
@@ -1,18 +1,28 @@
+import numpy as np
 from spp import Dijkstra
+from dist_matrix import build_dist_matrix, repair_dist_matrix, PathMatrix
+from matrix_cache import MatrixCache
+from solve_control import SolveControl
+from local_search import LocalSearch, neighbor_lists
+from grasp import multi_start
+from solver_stats import SolverStats
 
 class CHI:
     """ 最近挿入法で距離行列から最適な巡回路を求めるクラス """
-    def __init__(self, dist_matrix):
+    def __init__(self, dist_matrix, stats: SolverStats = None):
         """ 最近挿入法を用いるために必要な変数の初期化 \n
         Args:
             dist_matrix (_type_): 頂点間の距離行列
+            stats (SolverStats, optional): 挿入の評価回数を数える計測
         Attributes:
             n (int): 頂点数
-            dist_matrix (list[list[float]]): 頂点間の距離行列
+            dist_matrix (np.ndarray): 頂点間の距離行列
             tour (list[int]): 最適な巡回路を表すリスト
+            stats (SolverStats | None): 計測
         """
+        self.stats: SolverStats | None = stats
         self.n: int = len(dist_matrix)
-        self.dist_matrix: list[list[float]] = dist_matrix
+        self.dist_matrix: np.ndarray = np.asarray(dist_matrix, dtype=np.float64)
         self.tour: list[int] = self.__find_initial_tour()
 
     def __find_initial_tour(self) -> list[int]:
@@ -20,15 +30,12 @@ class CHI:
         Returns:
             initial_tour (list[int]): 初期部分巡回路
         """
-        max_dist = -1
         initial_pair = (0, 0)
-        for i in range(self.n):
-            for j in range(i+1, self.n):
-                tour_cost = self.dist_matrix[i][j] + self.dist_matrix[j][i]
-                if tour_cost > max_dist:
-                    max_dist = tour_cost
-                    initial_pair = (i, j)
-        initial_tour = [initial_pair[0], initial_pair[1], initial_pair[0]]
+        if self.n > 1:
+            tour_cost = self.dist_matrix + self.dist_matrix.T
+            tour_cost[np.tril_indices(self.n)] = -np.inf   # i < j の組のみを対象とする
+            initial_pair = np.unravel_index(int(np.argmax(tour_cost)), tour_cost.shape)
+        initial_tour = [int(initial_pair[0]), int(initial_pair[1]), int(initial_pair[0])]
         return initial_tour
 
     def calc_cost(self) -> float:
@@ -38,92 +45,248 @@ class CHI:
             cost += self.dist_matrix[self.tour[i]][self.tour[i + 1]]
         return cost
 
-    def __find_best_insertion(self) -> tuple[int, int]:
-        """ 追加コスト比を評価して部分巡回路に追加する頂点の最適な挿入位置を決定
+    def __ratios(self, i, j, k) -> np.ndarray:
+        """ 辺 (i, j) の間に頂点 k を挿入するときの追加コスト比 (cik + ckj) / cij を求める \n
+        Args:
+            i, j, k (int | np.ndarray): 辺の始点, 辺の終点, 挿入する頂点 (配列の場合はブロードキャストする)
         Returns:
-            best_city (int): 最適な挿入位置に追加する頂点
-            best_i (int): 最適な挿入位置のインデックス 
+            ratio (np.ndarray): 追加コスト比、cij が 0 もしくは比が定まらない場合は inf
         """
-        best_ratio = float('inf')
-        best_city = None
-        best_i = None
-
-        for k in range(self.n):
-            if k in self.tour:
-                continue
-            for i in range(len(self.tour) - 1):
-                j = i + 1
-                cik = self.dist_matrix[self.tour[i]][k]
-                ckj = self.dist_matrix[k][self.tour[j]]
-                cij = self.dist_matrix[self.tour[i]][self.tour[j]]
-                if cij == 0:
-                    ratio = float('inf')
-                else:
-                    ratio = (cik + ckj) / cij
-                if ratio < best_ratio:
-                    best_ratio = ratio
-                    best_city = k
-                    best_i = i
-        return best_city, best_i
+        d = self.dist_matrix
+        cij = d[i, j]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = (d[i, k] + d[k, j]) / cij
+        return np.where((cij == 0) | np.isnan(ratio), np.inf, ratio)
 
     def solve(self) -> list[int]:
         """ 最近挿入法で最適な巡回路を求める \n
+        巡回路外の各頂点について最良の挿入先の辺とその追加コスト比を保持し、挿入で辺が変わるたびに
+        新しい 2 辺との比較だけで更新する。最良の挿入先だった辺が無くなった頂点は、元の比を下界として残し、
+        挿入する頂点の候補に選ばれたときにだけ全ての辺を再評価する。
+        Returns:
+            tour (list[int]): 最適な巡回路を表すリスト
+        """
+        if len(self.tour) >= self.n + 1:
+            return self.tour
+        start, other = self.tour[0], self.tour[1]
+        # 巡回路は各頂点の次の頂点で表し、辺はその始点で識別する
+        nxt = np.full(self.n, -1, dtype=np.int64)
+        nxt[start], nxt[other] = other, start
+        in_tour = np.zeros(self.n, dtype=bool)
+        in_tour[[start, other]] = True
+        best_ratio = np.full(self.n, np.inf)
+        best_from = np.full(self.n, start, dtype=np.int64)
+        stale = np.zeros(self.n, dtype=bool)
+        rest = np.flatnonzero(~in_tour)
+        self.__update(rest, np.array([start, other]), nxt, best_ratio, best_from)
+
+        for _ in range(self.n - 2):
+            rest = np.flatnonzero(~in_tour)
+            while True:
+                k = int(rest[np.argmin(best_ratio[rest])])
+                if not stale[k]:
+                    break
+                best_ratio[k] = np.inf
+                stale[k] = False
+                self.__update(np.array([k]), np.flatnonzero(in_tour), nxt, best_ratio, best_from)
+            a = int(best_from[k])
+            b = int(nxt[a])
+            nxt[a], nxt[k] = k, b
+            in_tour[k] = True
+            rest = np.flatnonzero(~in_tour)
+            if len(rest) == 0:
+                break
+            # 辺 (a, b) が無くなったため、そこを最良の挿入先としていた頂点は再評価が必要
+            stale[rest[best_from[rest] == a]] = True
+            self.__update(rest, np.array([a, k]), nxt, best_ratio, best_from)
+
+        tour = [start]
+        for _ in range(self.n):
+            tour.append(int(nxt[tour[-1]]))
+        self.tour = tour
+        return self.tour
+
+    def __update(self, cities: np.ndarray, froms: np.ndarray, nxt: np.ndarray, best_ratio: np.ndarray, best_from: np.ndarray) -> None:
+        """ 巡回路外の頂点 cities について、始点が froms の辺への挿入で最良の挿入先を更新 """
+        if len(cities) == 0:
+            return
+        ratio = self.__ratios(froms[:, None], nxt[froms][:, None], cities[None, :])
+        if self.stats is not None:
+            self.stats.count('chi.insertion_evaluations', ratio.size)
+        i = np.argmin(ratio, axis=0)
+        r = ratio[i, np.arange(len(cities))]
+        better = r < best_ratio[cities]
+        best_ratio[cities[better]] = r[better]
+        best_from[cities[better]] = froms[i[better]]
+
+
+class HeldKarp:
+    """ 部分集合を要素数ごとにまとめて NumPy で計算する動的計画法 (Held-Karp 法) で距離行列から厳密な最適巡回路を求めるクラス """
+    def __init__(self, dist_matrix, start: int = 0):
+        """ Held-Karp 法を用いるために必要な変数の初期化 \n
+        Args:
+            dist_matrix (_type_): 頂点間の距離行列 (非対称でもよい)
+            start (int, optional): 巡回路の始点とする頂点
+        Attributes:
+            n (int): 頂点数
+            dist_matrix (np.ndarray): 到達不能 (inf) を巡回路のどの総コストよりも大きい有限の値に置き換えた距離行列
+            start (int): 巡回路の始点
+            tour (list[int]): 最適な巡回路を表すリスト
+        """
+        d = np.asarray(dist_matrix, dtype=np.float64)
+        finite = np.isfinite(d)
+        big = (np.abs(d[finite]).max() if finite.any() else 1.0) * len(d) + 1.0
+        self.n: int = len(d)
+        self.dist_matrix: np.ndarray = np.where(finite, d, big)
+        self.start: int = start
+        self.tour: list[int] = []
+
+    def solve(self) -> list[int]:
+        """ Held-Karp 法で最適な巡回路を求める \n
+        cost[S][j] を、始点から部分集合 S の頂点を全て通り j で終わる経路の最小コストとし、
+        要素数の小さい S から順に cost[S][j] = min_i cost[S - {j}][i] + d(i, j) を配列演算で求める。
+        計算量は O(2^n n^2)、メモリは O(2^n n) のため頂点数の少ない場合に用いる。
         Returns:
             tour (list[int]): 最適な巡回路を表すリスト
         """
-        while len(self.tour) < self.n + 1:
-            best_city, best_i = self.__find_best_insertion()
-            self.tour.insert(best_i + 1, best_city)
+        if self.n <= 2:
+            self.tour = [self.start] + [v for v in range(self.n) if v != self.start] + [self.start]
+            return self.tour
+        cities = np.array([v for v in range(self.n) if v != self.start])
+        m = len(cities)
+        d = self.dist_matrix[np.ix_(cities, cities)]
+        size = 1 << m
+        cost = np.full((size, m), np.inf)
+        parent = np.zeros((size, m), dtype=np.int8)
+        bits = 1 << np.arange(m)
+        cost[bits, np.arange(m)] = self.dist_matrix[self.start, cities]
+
+        masks = np.arange(size)
+        popcount = ((masks[:, None] & bits[None, :]) != 0).sum(axis=1)
+        for layer in range(2, m + 1):
+            layer_masks = masks[popcount == layer]
+            for j in range(m):
+                sub = layer_masks[(layer_masks & bits[j]) != 0]
+                prev = sub ^ bits[j]
+                candidates = cost[prev] + d[:, j][None, :]
+                best = np.argmin(candidates, axis=1)
+                cost[sub, j] = candidates[np.arange(len(sub)), best]
+                parent[sub, j] = best
+
+        full = size - 1
+        j = int(np.argmin(cost[full] + self.dist_matrix[cities, self.start]))
+        order = []
+        mask = full
+        for _ in range(m):
+            order.append(j)
+            j, mask = int(parent[mask, j]), mask ^ int(bits[j])
+        self.tour = [self.start] + [int(cities[i]) for i in reversed(order)] + [self.start]
         return self.tour
-    
+
 
 class TwoOpt(Dijkstra):
     """ 継承元が最短経路を解くクラスである巡回セールスマン問題を 2-opt 法で解くためのクラス """
-    def __init__(self, node_csv_file: str, edge_csv_file: str, V: list[int]) -> None:
+    def __init__(self, node_csv_file: str, edge_csv_file: str, V: list[int], core: str = 'dict', workers: int = None,
+                 neighbor_k: int = 10, exact_threshold: int = 16, stats: SolverStats = None, prune: bool = False,
+                 matrix_cache: MatrixCache | str = None) -> None:
         """ ネットワーク及び TSP を解くのに必要な変数を初期化 \n
         Args:
             V (list[int]): 巡回路に含む頂点の osmid を格納したリスト
+            core (str, optional): グラフの保持形式、'dict', 'csr' または 'snapshot'
+            workers (int, optional): 距離行列の計算に用いるプロセス数、省略時は CPU 数
+            neighbor_k (int, optional): 2-opt 近傍の候補とする近傍リストの頂点数
+            exact_threshold (int, optional): 頂点数がこれ未満ならば solve で Held-Karp 法による厳密解を求める
+            stats (SolverStats, optional): 各段階の経過時間と探索の回数を記録する計測、Network を参照
+            prune (bool, optional): 真ならば V を残してグラフを縮約してから距離行列を求める、Network.prune を参照
+            matrix_cache (MatrixCache | str, optional): 距離行列のキャッシュもしくはそれを保存するディレクトリの path
         Attributes:
             n (int): 頂点数
             V (list[int]): 巡回路の頂点の osmid を格納したリスト
-            dist_matrix (list[list[float]]): 頂点間の距離行列
-            sp_matrix (list[list[list[int]]]): 頂点間の最短経路行列
+            workers (int | None): 距離行列の計算に用いるプロセス数
+            matrix_cache (MatrixCache | None): 距離行列のキャッシュ
+            dist_matrix (np.ndarray): 頂点間の距離行列
+            sp_matrix (PathMatrix): 頂点間の最短経路行列、始点ごとの最短経路木のみを保持し経路は参照時に復元
+            neighbors (np.ndarray): 各頂点について距離行列で近い順に neighbor_k 個の頂点を並べた近傍リスト
+            exact_threshold (int): Held-Karp 法を用いる頂点数の上限 (この値未満)
+            neighbor_k (int): 近傍リストの頂点数
             tour (list[int]): 頂点の index を格納して表現した最適な巡回路、初期解は最近挿入法を用いる
-            !未使用 tours (list[list[int]]): 巡回路のリスト、初期解は GRASP を用いる
             min_cost (float): 巡回路の最小コスト
             tour_osmid (list[int]): 頂点の osmid を格納して表現した最適な巡回路
-            tour_paths (list[list[int]]): 巡回路の各エッジにおける最短経路を格納したリスト
+            tour_paths (list[list[int]]): 巡回路の各エッジにおける最短経路を格納したリスト、参照時に復元
         """
-        super().__init__(node_csv_file, edge_csv_file)
+        super().__init__(node_csv_file, edge_csv_file, core, stats=stats)
+        if prune:
+            self.prune(V)
+        self._init_tour(V, workers, neighbor_k, exact_threshold, matrix_cache)
+
+    @classmethod
+    def from_network(cls, N: Dijkstra, V: list[int], workers: int = None, neighbor_k: int = 10,
+                     exact_threshold: int = 16, prune: bool = False, matrix_cache: MatrixCache | str = None,
+                     dist_matrix: np.ndarray = None) -> 'TwoOpt':
+        """ 読み込み済みのネットワークを共有して TSP を解くインスタンスを作成 \n
+        csv の読み込みやグラフの構築を行わず、N の頂点、辺、グラフ、最短経路木のキャッシュ及び計測をそのまま用いる。
+        update_edges で辺のコストを変更する場合は、変更する前に辺のコストを複製し、最短経路木のキャッシュを空にするため N は変わらない。
+        Args:
+            N (Dijkstra): 読み込み済みの道路ネットワーク
+            V (list[int]): 巡回路に含む頂点の osmid を格納したリスト
+            workers (int, optional): 距離行列の計算に用いるプロセス数、省略時は CPU 数
+            neighbor_k (int, optional): 2-opt 近傍の候補とする近傍リストの頂点数
+            exact_threshold (int, optional): 頂点数がこれ未満ならば solve で Held-Karp 法による厳密解を求める
+            prune (bool, optional): 真ならば V を残して縮約したグラフを用いる (N のグラフとキャッシュは変更しない)
+            matrix_cache (MatrixCache | str, optional): 距離行列のキャッシュもしくはそれを保存するディレクトリの path
+            dist_matrix (np.ndarray, optional): 求め済みの V の距離行列、指定した場合は探索せずに用い、
+                経路は tour_paths で参照したときに N の最短経路木から求める
+        Returns:
+            tsp_solver (TwoOpt): 初期巡回路を求めた状態のインスタンス
+        """
+        tsp_solver = cls.__new__(cls)
+        tsp_solver.__dict__.update(N.__dict__)
+        tsp_solver.shares_costs = True
+        if prune:
+            tsp_solver.prune(V)
+        tsp_solver._init_tour(V, workers, neighbor_k, exact_threshold, matrix_cache, dist_matrix)
+        return tsp_solver
+
+    def _init_tour(self, V: list[int], workers: int, neighbor_k: int, exact_threshold: int,
+                   matrix_cache: MatrixCache | str = None, dist_matrix: np.ndarray = None) -> None:
+        """ 距離行列と近傍リストを求め、最近挿入法で初期巡回路を求める """
         self.n: int = len(V)
         self.V: list[int] = V
-        self.dist_matrix: list[list[float]] = [[0] * self.n for _ in range(self.n)]
-        self.sp_matrix: list[list[list[int]]] = [[[]] * self.n for _ in range(self.n)]
-        self._make_dist_matrix()
-        self.tour = (_ := CHI(self.dist_matrix)).solve()
+        self.workers: int | None = workers
+        self.matrix_cache: MatrixCache | None = MatrixCache(matrix_cache) if isinstance(matrix_cache, str) else matrix_cache
+        self.exact_threshold: int = exact_threshold
+        self.neighbor_k: int = neighbor_k
+        self.dist_matrix: np.ndarray = np.zeros((self.n, self.n))
+        self.sp_matrix: PathMatrix | None = None
+        if dist_matrix is not None:
+            self.dist_matrix = np.asarray(dist_matrix, dtype=np.float64)
+        else:
+            with self.stats.phase('dist_matrix'):
+                self._make_dist_matrix()
+        self.neighbors: np.ndarray = neighbor_lists(self.dist_matrix, neighbor_k)
+        with self.stats.phase('chi'):
+            self.tour = (_ := CHI(self.dist_matrix, self.stats if self.stats.enabled else None)).solve()
         self.min_cost: float = self.calc_cost(self.tour)
         self.tour_osmid: list[int] = [self.V[i] for i in self.tour]
-        self.tour_paths = [self.sp_matrix[self.tour[i]][self.tour[i+1]] for i in range(self.n - 1)]
 
-    def _make_dist_matrix(self) -> None:
-        """ 頂点間の距離行列を計算する関数 """
-        for v in self.V:
-            min_cost = super().solve(v)
-            for u in self.V:
-                self.dist_matrix[self.V.index(v)][self.V.index(u)] = min_cost[u]
-                self.sp_matrix[self.V.index(v)][self.V.index(u)] = self.get_shortest_path(v, u)
-
-    def _two_opt_swap(self, i: int, j: int) -> list[int]:
-        """ 2-OPT のエッジ交換操作を行う関数 \n
-        Args:
-            i (int): 交換するエッジのインデックス
-            j (int): 交換するエッジのインデックス
+    @property
+    def tour_paths(self) -> list[list[int]]:
+        """ 巡回路の各エッジにおける最短経路を最短経路木から復元 \n
+        距離行列を与えて作った場合は、ネットワークの最短経路木のキャッシュから get_shortest_path で求める。
         Returns:
-            new_tour (list[int]): エッジ交換後の巡回路
+            tour_paths (list[list[int]]): 巡回路の各エッジにおける最短経路を格納したリスト
+        """
+        if self.sp_matrix is None:
+            return [self.get_shortest_path(self.V[a], self.V[b]) for a, b in zip(self.tour, self.tour[1:])]
+        return [self.sp_matrix.get_path(self.tour[i], self.tour[i+1]) for i in range(len(self.tour) - 1)]
+
+    def _make_dist_matrix(self) -> None:
+        """ 頂点間の距離行列を計算する関数 \n
+        始点ごとの探索は全ての巡回路の頂点が確定した時点で打ち切り、複数プロセスに分散して行う
+        matrix_cache を指定した場合は、保存済みの組を読み込み、足りない行と列だけを探索する
         """
-        new_tour = self.tour[:i] + self.tour[i:j][::-1] + self.tour[j:]
-        return new_tour
-    
+        self.dist_matrix, self.sp_matrix = build_dist_matrix(self, self.V, self.workers, self.stats, self.matrix_cache)
+
     def calc_cost(self, tour) -> float:
         """ 巡回路の総コストを計算 \n
         Args:
@@ -136,8 +299,17 @@ class TwoOpt(Dijkstra):
             cost += self.dist_matrix[tour[i]][tour[i+1]]
         return cost
 
-    def solve(self) -> float:
+    def solve(self, neighborhoods: tuple[str, ...] = ('2opt',), control: SolveControl = None, paths: bool = True) -> dict:
         """ 2-opt 法を用いて最適な巡回路とその時のコストを求める \n
+        近傍の評価は累積和を用いて O(1) で行い、候補は近傍リストに絞り、don't-look bit で探索する頂点を選ぶ
+        頂点数が exact_threshold 未満の場合は、代わりに Held-Karp 法で厳密な最適巡回路を求める
+        control を指定した場合は、経過時間や適用した近傍の数が上限に達するか中止を要求された時点で改善を打ち切り、
+        それまでで最良の巡回路を返す (Held-Karp 法は途中で打ち切らず、始める前に打ち切る条件を確かめる)
+        Args:
+            neighborhoods (tuple[str, ...], optional): 用いる近傍の順序、'2opt', 'oropt' (区間の移動), 'or3' (反転しない 3-opt) から選ぶ
+                複数指定すると可変近傍降下法となり、一方通行の多い非対称な距離行列で 2-opt だけの場合より良い解が得られる
+            control (SolveControl, optional): 打ち切る条件、途中経過の通知及び別のスレッドからの中止、SolveControl を参照
+            paths (bool, optional): 偽ならば経路を復元せず 'paths' を None とする
         Return:
             dict:
                 key (str): 'tour_osmid'
@@ -147,58 +319,78 @@ class TwoOpt(Dijkstra):
                 key (str): 'paths'
                 value (list[list[int]]): 巡回路の各エッジにおける最短経路リスト
         """
-        improved = True
-        while improved:
-            improved = False
-            for i in range(1, self.n - 1):
-                for j in range(i + 1, self.n):
-                    # 2-opt 近傍を探索
-                    new_tour = self._two_opt_swap(i, j)
-                    new_cost = self.calc_cost(new_tour)
-                    if new_cost < self.min_cost:
-                        self.tour = new_tour
-                        self.min_cost = new_cost
-                        improved = True  # 改善解の発見により近傍を再評価
-                        break 
-                if improved:
-                    break
+        if control is not None:
+            control.start()
+        # 始める前に中止を要求された場合は改善せずに現在の巡回路を返す
+        stopped = control is not None and control.should_stop()
+        if not stopped and 3 <= self.n < self.exact_threshold:
+            with self.stats.phase('held_karp'):
+                new_tour = HeldKarp(self.dist_matrix, self.tour[0]).solve()
+            new_cost = self.calc_cost(new_tour)
+            if new_cost <= self.min_cost:
+                self.tour = new_tour
+                self.min_cost = new_cost
+        elif not stopped and self.n > 3:
+            with self.stats.phase('local_search'):
+                new_tour = LocalSearch(self.dist_matrix, self.tour, self.neighbors,
+                                       stats=self.stats if self.stats.enabled else None).vnd(neighborhoods, control=control)
+            new_cost = self.calc_cost(new_tour)
+            if new_cost <= self.min_cost:
+                self.tour = new_tour
+                self.min_cost = new_cost
+        if control is not None:
+            self.stats.count(f'solve.stopped.{control.stopped}' if control.stopped else 'solve.converged')
+            control.report(self.min_cost, force=True)
         self.tour_osmid = [self.V[i] for i in self.tour]
-        self.tour_paths = [self.sp_matrix[self.tour[i]][self.tour[i+1]] for i in range(self.n)]
-        return {'tour_osmid': self.tour_osmid, 'cost': self.min_cost, 'paths': self.tour_paths}
-    
-
-"""
-def grasp(self, iterations: int = 100) -> dict:
-        best_tour = None
-        best_cost = float('inf')
-        
-        for _ in range(iterations):
-            self.tour = self._generate_grasp_initial_tour()
-            self.min_cost = self.calc_cost(self.tour)
-            self.solve()
-            if self.min_cost < best_cost:
-                best_cost = self.min_cost
-                best_tour = self.tour.copy()
-        
-        self.tour = best_tour
-        self.min_cost = best_cost
+        return {'tour_osmid': self.tour_osmid, 'cost': self.min_cost, 'paths': self.tour_paths if paths else None}
+
+    def update_edges(self, changes, scale: bool = False,
+                     neighborhoods: tuple[str, ...] = ('2opt', 'oropt', 'or3')) -> list[tuple[int, int, float, float]]:
+        """ 辺のコストを変更し、距離行列の影響を受ける行だけを更新して現在の巡回路から改善し直す \n
+        最短経路木の修復は Dijkstra.update_edges を参照。最近挿入法からは作り直さず、現在の巡回路を初期解として solve を行う。
+        Args:
+            changes (Mapping): キーは弧の端点の osmid の組 (u, v) もしくは辺の osmid、値は新しいコスト (inf で通行止め)
+            scale (bool, optional): 真ならば値を元のコストに掛ける倍率とみなす
+            neighborhoods (tuple[str, ...], optional): 改善に用いる近傍、solve を参照
+        Returns:
+            applied (list[tuple[int, int, float, float]]): 実際に変更した弧の (u, v, 変更前のコスト, 変更後のコスト)
+        """
+        applied = super().update_edges(changes, scale)
+        if applied:
+            with self.stats.phase('dist_matrix'):
+                if self.sp_matrix is None:
+                    # 与えられた距離行列は修復に用いる最短経路木を持たないため、全ての行を求め直す
+                    self._make_dist_matrix()
+                    rows = list(range(self.n))
+                else:
+                    rows = repair_dist_matrix(self, self.V, self.dist_matrix, self.sp_matrix, applied)
+            self.stats.count('update_edges.matrix_rows', len(rows))
+            if rows:
+                self.neighbors = neighbor_lists(self.dist_matrix, self.neighbor_k)
+                self.min_cost = self.calc_cost(self.tour)
+                self.solve(neighborhoods)
+        return applied
+
+    def grasp(self, iterations: int = 100, workers: int = None, seed: int = 0, rcl_size: int = 3,
+              neighborhoods: tuple[str, ...] = ('2opt',), paths: bool = True) -> dict:
+        """ 乱択最近傍法による初期巡回路からの局所探索を複数プロセスで繰り返す GRASP で巡回路を求める \n
+        全ての試行の中で最良の巡回路が現在の巡回路より良ければ置き換える。
+        Args:
+            iterations (int, optional): 試行回数
+            workers (int, optional): プロセス数、省略時は CPU 数
+            seed (int, optional): 乱数の種、同じ値ならばプロセス数によらず同じ結果となる
+            rcl_size (int, optional): 初期巡回路を作る際に次の頂点の候補とする近い頂点の数
+            neighborhoods (tuple[str, ...], optional): 局所探索に用いる近傍、solve を参照
+            paths (bool, optional): 偽ならば経路を復元せず 'paths' を None とする
+        Return:
+            dict: solve と同じ形式の 'tour_osmid', 'cost', 'paths'
+        """
+        if self.n > 3 and iterations > 0:
+            with self.stats.phase('grasp'):
+                new_tour, _ = multi_start(self.dist_matrix, self.neighbors, iterations, workers, seed, rcl_size, neighborhoods)
+            new_cost = self.calc_cost(new_tour)
+            if new_cost < self.min_cost:
+                self.tour = new_tour
+                self.min_cost = new_cost
         self.tour_osmid = [self.V[i] for i in self.tour]
-        self.tour_paths = [self.sp_matrix[self.tour[i]][self.tour[i+1]] for i in range(self.n)]
-        return {'tour_osmid': self.tour_osmid, 'cost': self.min_cost, 'multi_paths': self.tour_paths}
-
-    def _generate_grasp_initial_tour(self) -> list[int]:
-        remaining = set(range(self.n))
-        tour = [random.choice(list(remaining))]
-        remaining.remove(tour[0])
-        
-        while remaining:
-            last = tour[-1]
-            candidates = list(remaining)
-            random.shuffle(candidates)
-            next_city = min(candidates, key=lambda x: self.dist_matrix[last][x])
-            tour.append(next_city)
-            remaining.remove(next_city)
-        
-        tour.append(tour[0])
-        return tour
-"""
\ No newline at end of file
+        return {'tour_osmid': self.tour_osmid, 'cost': self.min_cost, 'paths': self.tour_paths if paths else None}